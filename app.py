@@ -1,15 +1,125 @@
+import hashlib
+import os
 import streamlit as st
 import pandas as pd
-import os
-import tempfile
-from marketing_logic import process_csv, get_recipient_data
-from services.openai_services import generate_email_template
-from services.email_services import send_email
+import threading
+import time
+from itertools import islice
+from marketing_logic import CSV_READ_OPTIONS, count_recipients, iter_recipients, load_contacts
+from services.metrics_services import metrics
+from services.openai_services import personalize_to_queue, response_cache, stream_email_template
+from services.queue_services import CampaignWorker, SendQueue
+from services.send_services import SendEngine
+from services.template_services import load_template, template_cache
+from services.suppression_services import SuppressionList
+
+# CSV uploads larger than this are streamed in chunks instead of loaded whole
+STREAMING_THRESHOLD_BYTES = 20 * 1024 * 1024
+
+# Parsed uploads kept across reruns; each holds one upload's sendable rows
+CONTACT_CACHE_ENTRIES = 2
+CONTACT_CACHE_TTL_SECONDS = 3600
+
+# Status reports are exported here on request and served from disk
+REPORT_DIR = os.path.join('data', 'reports')
+REPORT_MIME_TYPES = {'csv': 'text/csv', 'parquet': 'application/vnd.apache.parquet'}
+
+# Serve /metrics for Prometheus on this port when set
+METRICS_PORT = os.getenv('METRICS_PORT')
 
 st.set_page_config(page_title='AI Email Marketing Agent', layout='wide')
 
 st.title('AI Email Marketing Agent')
 
+@st.cache_resource
+def get_suppression_list():
+    # Unsubscribes and bounces; shared across reruns and sessions
+    return SuppressionList()
+
+suppression = get_suppression_list()
+
+@st.cache_resource
+def get_send_queue():
+    # Durable per-recipient send state; campaigns resume from it after reloads or crashes
+    return SendQueue()
+
+@st.cache_resource
+def get_campaign_workers():
+    # campaign id -> CampaignWorker; lives outside the script rerun cycle
+    return {}
+
+@st.cache_resource
+def get_generation_counts():
+    # campaign id -> {'generated': n, 'failed': n} from the last AI personalization run
+    return {}
+
+send_queue = get_send_queue()
+
+# Ingestion is keyed on the upload's content hash and the suppression list version,
+# so typing into a widget reuses the parsed file instead of reading it again.
+# Arguments starting with an underscore are not part of the cache key.
+@st.cache_resource(max_entries=CONTACT_CACHE_ENTRIES, ttl=CONTACT_CACHE_TTL_SECONDS, show_spinner="Reading contacts...")
+def load_contacts_cached(content_hash, suppression_version, _file):
+    _file.seek(0)
+    return load_contacts(_file, suppression)
+
+@st.cache_resource(max_entries=CONTACT_CACHE_ENTRIES, ttl=CONTACT_CACHE_TTL_SECONDS, show_spinner="Counting contacts...")
+def count_contacts_cached(content_hash, suppression_version, _file):
+    _file.seek(0)
+    return count_recipients(_file, suppression=suppression)
+
+# Keyed on the campaign's counts, so a report is exported again only after more messages finish
+@st.cache_resource(max_entries=4, show_spinner="Preparing report...")
+def export_report(campaign_id, fmt, counts_key):
+    path = os.path.join(REPORT_DIR, f"{campaign_id}.{fmt}")
+    send_queue.write_report(campaign_id, path, fmt)
+    return path
+
+def upload_digest(uploaded_file):
+    return hashlib.sha256(uploaded_file.getbuffer()).hexdigest()
+
+@st.cache_resource
+def start_metrics_server():
+    # One endpoint per process, not per rerun
+    if METRICS_PORT:
+        metrics.enable()
+        return metrics.serve(int(METRICS_PORT))
+    return None
+
+start_metrics_server()
+
+def render_metrics(container):
+    """Timers and counters from the metrics registry as two small tables."""
+    snapshot = metrics.snapshot()
+    with container.container():
+        if not snapshot['timers'] and not snapshot['counters']:
+            st.caption("No metrics recorded yet.")
+            return
+        if snapshot['timers']:
+            st.dataframe(pd.DataFrame([
+                {'stage': t['name'], 'labels': ', '.join(f"{k}={v}" for k, v in t['labels'].items()),
+                 'count': t['count'], 'mean ms': round(t['mean_seconds'] * 1000, 2),
+                 'max ms': round(t['max_seconds'] * 1000, 2), 'total s': round(t['total_seconds'], 3)}
+                for t in snapshot['timers']
+            ]), hide_index=True)
+        if snapshot['counters']:
+            st.dataframe(pd.DataFrame([
+                {'counter': c['name'], 'labels': ', '.join(f"{k}={v}" for k, v in c['labels'].items()),
+                 'value': c['value']}
+                for c in snapshot['counters']
+            ]), hide_index=True)
+
+def start_campaign(campaign_id, producer_done=None):
+    workers = get_campaign_workers()
+    worker = workers.get(campaign_id)
+    if worker is None or not worker.is_alive():
+        # Bounced addresses go straight onto the suppression list
+        worker = CampaignWorker(send_queue, campaign_id, lambda: SendEngine(suppression=suppression),
+                                producer_done=producer_done)
+        workers[campaign_id] = worker
+        worker.start()
+    return worker
+
 # --- Sidebar for Configuration ---
 with st.sidebar:
     st.header("Configuration")
@@ -25,24 +135,68 @@ with st.sidebar:
     elif ai_provider == "Gemini":
         model_name = st.text_input("Model Name", "google/gemini-pro")
 
+    cache_stats = response_cache.stats()
+    st.caption(f"AI cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses")
+    if st.button("Clear cached contacts and templates"):
+        load_contacts_cached.clear()
+        count_contacts_cached.clear()
+        template_cache.clear()
+
+    with st.expander("Diagnostics"):
+        if st.checkbox("Collect metrics", value=metrics.enabled):
+            metrics.enable()
+        else:
+            metrics.disable()
+        if METRICS_PORT:
+            st.caption(f"Prometheus endpoint: http://127.0.0.1:{METRICS_PORT}/metrics")
+        metrics_panel = st.empty()
+        render_metrics(metrics_panel)
+        st.download_button("Download metrics (JSON)", metrics.to_json(), "campaign_metrics.json",
+                           "application/json", key='download-metrics-json')
+        st.download_button("Download metrics (Prometheus)", metrics.to_prometheus(), "campaign_metrics.prom",
+                           "text/plain", key='download-metrics-prom')
+        if st.button("Reset metrics"):
+            metrics.reset()
+            render_metrics(metrics_panel)
+
 
 # --- Step 1: Upload Contacts ---
 st.header("1. Upload Contacts (CSV)")
 uploaded_file = st.file_uploader("Upload CSV file (must contain 'Name' and 'Email' columns)", type=['csv'])
 
+valid_count = 0
+
 if uploaded_file:
     try:
-        df = process_csv(uploaded_file)
-        st.success(f"Loaded {len(df)} contacts.")
-        st.dataframe(df.head())
-        
-        valid_recipients = get_recipient_data(df)
-        st.write(f"Valid recipients: {len(valid_recipients)}")
+        content_hash = upload_digest(uploaded_file)
+        if uploaded_file.size > STREAMING_THRESHOLD_BYTES:
+            # Large export: count and preview in chunks, stream rows again at send time
+            counts = count_contacts_cached(content_hash, suppression.version, uploaded_file)
+            uploaded_file.seek(0)
+            st.success(f"Loaded {counts['total']} contacts (streaming mode).")
+            st.dataframe(pd.read_csv(uploaded_file, nrows=5, **CSV_READ_OPTIONS))
+            valid_count = counts['sendable']
+            skipped = counts['duplicates'] + counts['suppressed']
+
+            def load_recipients():
+                uploaded_file.seek(0)
+                return iter_recipients(uploaded_file, suppression=suppression)
+        else:
+            contacts = load_contacts_cached(content_hash, suppression.version, uploaded_file)
+            st.success(f"Loaded {contacts.stats['total']} contacts.")
+            st.dataframe(contacts.preview)
+            
+            valid_count = len(contacts)
+            skipped = contacts.stats['duplicates'] + contacts.stats['suppressed']
+
+            def load_recipients():
+                return iter(contacts)
+        st.write(f"Valid recipients: {valid_count}")
+        if skipped:
+            st.caption(f"Skipped {skipped} duplicate or suppressed (unsubscribed/bounced) addresses.")
     except Exception as e:
         st.error(f"Error processing CSV: {e}")
-        valid_recipients = []
-else:
-    valid_recipients = []
+        valid_count = 0
 
 # --- Step 2: Campaign Details ---
 st.header("2. Campaign Details")
@@ -78,11 +232,20 @@ if st.button("Generate Email Template"):
         The email should be personalized (use [Name] as placeholder).
         Keep it concise, engaging, and professional.
         """
-        with st.spinner("Generating email..."):
-            # Now returns a dict
-            ai_data = generate_email_template(prompt, provider=ai_provider, model=model_name)
-            st.session_state['ai_data'] = ai_data
-            st.success("Email generated!")
+        # Fields appear as the model writes them; the last update is the finished template
+        live_preview = st.empty()
+        ai_data = {}
+        for ai_data in stream_email_template(prompt, provider=ai_provider, model=model_name):
+            with live_preview.container():
+                st.markdown(f"**Subject:** {ai_data.get('subject', '')}")
+                st.markdown(f"### {ai_data.get('title', '')}")
+                st.markdown(ai_data.get('body', ''), unsafe_allow_html=True)
+                if ai_data.get('cta_text'):
+                    st.caption(f"Button: {ai_data['cta_text']}")
+        live_preview.empty()
+        st.session_state['ai_data'] = ai_data
+        st.session_state['campaign_prompt'] = prompt
+        st.success("Email generated!")
 
 if 'ai_data' in st.session_state:
     st.subheader("Preview")
@@ -104,14 +267,15 @@ if 'ai_data' in st.session_state:
 
     # Render HTML
     try:
-        with open("templates/custom_email_template.html", "r") as f:
-            template_html = f.read()
-            
-        rendered_html = template_html.replace("{{ EMAIL_TITLE }}", title) \
-                                     .replace("{{ EMAIL_BODY }}", body) \
-                                     .replace("{{ CTA_TEXT }}", cta_text) \
-                                     .replace("{{ CTA_LINK }}", cta_link) \
-                                     .replace("{{ COMPANY_NAME }}", company_name)
+        template = load_template("templates/custom_email_template.html")
+
+        rendered_html = template.render({
+            "email_title": title,
+            "email_body": body,
+            "cta_text": cta_text,
+            "cta_link": cta_link,
+            "company_name": company_name,
+        })
         
         st.session_state['final_html'] = rendered_html
         
@@ -125,64 +289,114 @@ if 'ai_data' in st.session_state:
 # --- Step 5: Send Emails ---
 st.header("5. Send Emails")
 
-if 'final_html' in st.session_state and valid_recipients:
+if 'final_html' in st.session_state and valid_count:
     batch_size = st.selectbox("Select Batch Size", ["Test (1 email)", "15", "50", "100", "All"])
+    personalize = st.checkbox("Personalize every email with AI",
+                              help="Writes a unique subject and body for each recipient. Sending starts "
+                                   "as soon as the first emails are ready.")
+    campaign_name = st.text_input("Campaign name (optional)",
+                                  help="Sending the same email again resumes the earlier campaign and skips "
+                                       "everyone it reached. Give it a new name (e.g. today's date) to send "
+                                       "to them again.")
     
     if st.button("Send Emails"):
         # Determine number of emails to send
         if batch_size == "Test (1 email)":
             limit = 1
         elif batch_size == "All":
-            limit = len(valid_recipients)
+            limit = valid_count
         else:
-            limit = int(batch_size)
+            limit = min(int(batch_size), valid_count)
             
-        recipients_to_send = valid_recipients[:limit]
-        
-        # Handle attachments
-        attachment_paths = []
-        if uploaded_attachments:
-            temp_dir = tempfile.mkdtemp()
-            for uploaded_file in uploaded_attachments:
-                path = os.path.join(temp_dir, uploaded_file.name)
-                with open(path, "wb") as f:
-                    f.write(uploaded_file.getbuffer())
-                attachment_paths.append(path)
-        
-        # Progress bar
-        progress_bar = st.progress(0)
-        status_log = []
-        
-        for i, recipient in enumerate(recipients_to_send):
-            # Personalize email
-            # Note: The template might not have [Name] placeholder in the body if AI didn't put it there.
-            # But we can try to replace it if it exists in the rendered HTML.
-            personalized_html = st.session_state['final_html'].replace("[Name]", recipient.get('name', 'there'))
-            
-            subject = st.session_state['ai_data'].get('subject', f"Regarding {product_name}")
-            
-            success = send_email(subject, personalized_html, [recipient['email']], attachment_paths)
-            
-            status_log.append({
-                "Email": recipient['email'],
-                "Name": recipient.get('name', ''),
-                "Status": "Sent" if success else "Failed",
-                "Timestamp": pd.Timestamp.now()
+        subject = st.session_state['ai_data'].get('subject', f"Regarding {product_name}")
+        attachments = [(uploaded_file.name, uploaded_file.getvalue()) for uploaded_file in uploaded_attachments or []]
+
+        if personalize and 'campaign_prompt' in st.session_state:
+            # Per-recipient copy fills the [AI ...] slots; the layout and CTA link stay shared
+            prompt = st.session_state['campaign_prompt']
+            html_body = load_template("templates/custom_email_template.html").render({
+                "email_title": "[AI Title]",
+                "email_body": "[AI Body]",
+                "cta_text": "[AI CTA Text]",
+                "cta_link": st.session_state['ai_data'].get('cta_link', ''),
+                "company_name": company_name,
             })
-            
-            progress_bar.progress((i + 1) / len(recipients_to_send))
-            
-        st.success(f"Process completed. Attempted: {len(recipients_to_send)}")
-        
-        # Show status and download
-        status_df = pd.DataFrame(status_log)
-        st.dataframe(status_df)
-        
-        csv = status_df.to_csv(index=False).encode('utf-8')
-        st.download_button(
-            "Download Status Report",
-            csv,
-            "email_campaign_status.csv",
-            "text/csv",
-            key='download-csv'
-        )
\ No newline at end of file
+            campaign_id = send_queue.create_campaign("[AI Subject]", html_body, attachments,
+                                                     variant=f"{ai_provider}:{model_name}:{prompt}",
+                                                     name=campaign_name.strip())
+            producer_done = threading.Event()
+            recipients = islice(load_recipients(), limit)
+
+            def produce():
+                try:
+                    get_generation_counts()[campaign_id] = personalize_to_queue(
+                        send_queue, campaign_id, recipients, prompt, provider=ai_provider, model=model_name)
+                finally:
+                    producer_done.set()
+
+            threading.Thread(target=produce, name=f"personalize-{campaign_id}", daemon=True).start()
+            start_campaign(campaign_id, producer_done=producer_done)
+        else:
+            # The same content always maps to the same campaign, so clicking Send again
+            # (or after a reload/crash) resumes it and never re-mails anyone already sent to.
+            campaign_id = send_queue.create_campaign(subject, st.session_state['final_html'], attachments,
+                                                     name=campaign_name.strip())
+            # Recipients are pulled lazily so large files never sit in memory as a list
+            if not send_queue.enqueue(campaign_id, islice(load_recipients(), limit)):
+                st.info("Every selected recipient is already part of this campaign, so only unsent messages "
+                        "go out. Enter a new campaign name to send this email to them again.")
+            start_campaign(campaign_id)
+        st.session_state['campaign_id'] = campaign_id
+
+if 'campaign_id' in st.session_state:
+    campaign_id = st.session_state['campaign_id']
+    worker = get_campaign_workers().get(campaign_id)
+
+    # Progress is read from the queue, so it survives reruns while the worker keeps sending
+    progress_bar = st.progress(0)
+    progress_text = st.empty()
+    while True:
+        counts = send_queue.counts(campaign_id)
+        done = counts['sent'] + counts['failed']
+        progress_bar.progress(done / max(counts['total'], 1))
+        progress_text.write(f"Sent: {counts['sent']} | Failed: {counts['failed']} | "
+                            f"Remaining: {counts['total'] - done}")
+        if metrics.enabled:
+            render_metrics(metrics_panel)
+        if worker is None or not worker.is_alive():
+            break
+        time.sleep(1)
+
+    if worker is not None and worker.error:
+        st.error(f"Campaign stopped: {worker.error}")
+    generation = get_generation_counts().get(campaign_id)
+    if generation and generation['failed']:
+        st.warning(f"AI copy could not be written for {generation['failed']} recipients. They are listed as "
+                   "failed in the status report; send the campaign again to retry them.")
+    if worker is not None and worker.budget_exhausted:
+        st.warning("Daily send limit reached. The remaining messages stay queued; resume the campaign tomorrow.")
+    if counts['total'] - done:
+        if st.button("Resume Campaign"):
+            start_campaign(campaign_id)
+            st.rerun()
+    else:
+        st.success(f"Process completed. Attempted: {counts['total']}")
+    
+    # The report is written to disk only when asked for, in the chosen format; Streamlit then
+    # reads that one file to serve the download
+    counts_key = tuple(sorted(counts.items()))
+    format_col, download_col = st.columns(2)
+    report_format = format_col.radio("Report format", list(REPORT_MIME_TYPES), horizontal=True,
+                                     format_func=str.upper)
+    if format_col.button("Prepare Status Report"):
+        st.session_state['report'] = (campaign_id, report_format, counts_key,
+                                      export_report(campaign_id, report_format, counts_key))
+    prepared = st.session_state.get('report')
+    if prepared and prepared[:3] == (campaign_id, report_format, counts_key):
+        with open(prepared[3], 'rb') as report:
+            download_col.download_button(
+                "Download Status Report",
+                report,
+                f"email_campaign_status.{report_format}",
+                REPORT_MIME_TYPES[report_format],
+            )
@@ -0,0 +1,62 @@
+"""Compare in-memory invite rendering with the old temp-file round trip per attendee.
+
+Run from the repository root:
+    python -m benchmarks.bench_ics --attendees 2000
+"""
+import argparse
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+from services.email_services import PreparedAttachment
+from services.ics_services import InviteTemplate, create_ics_file, invite_attachment
+
+START = datetime(2025, 3, 4, 15, 30, tzinfo=timezone.utc)
+END = START + timedelta(minutes=30)
+
+
+def temp_files(attendees: list[str]) -> list[PreparedAttachment]:
+    """What send_meeting_invite did before: mkstemp, write, re-read, delete."""
+    parts = []
+    for attendee in attendees:
+        fd, path = tempfile.mkstemp(suffix='.ics', prefix='invite_')
+        os.close(fd)
+        try:
+            create_ics_file("Product demo", "Agenda", START, END, "me@example.com", attendee, path)
+            parts.append(PreparedAttachment.from_path(path))
+        finally:
+            os.remove(path)
+    return parts
+
+
+def in_memory(attendees: list[str]) -> list[PreparedAttachment]:
+    invite = InviteTemplate("Product demo", "Agenda", START, END, "me@example.com")
+    return [invite_attachment(ics) for ics in invite.render_many(attendees)]
+
+
+def _time(fn, *args, repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--attendees", type=int, default=2000)
+    args = parser.parse_args()
+
+    attendees = [f"person{i}@example.com" for i in range(args.attendees)]
+    baseline = _time(temp_files, attendees)
+    rendered = _time(in_memory, attendees)
+    print(f"attendees:  {args.attendees}")
+    print(f"temp files: {baseline:.3f}s ({args.attendees / baseline:,.0f} invites/s)")
+    print(f"in memory:  {rendered:.3f}s ({args.attendees / rendered:,.0f} invites/s)")
+    print(f"speedup:    {baseline / rendered:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+"""End-to-end send pipeline benchmark against a local SMTP sink and a fake AI provider.
+
+Each scenario ingests a generated contact CSV (process_csv), asks the fake
+provider for the campaign copy, renders every message and sends it through
+SendEngine (render_message / _make_message) to the sink. Scenarios run in a
+fresh process so peak RSS is per scenario; the servers run in this process.
+
+Run from the repository root (the defaults take a couple of minutes):
+    python -m benchmarks.bench_pipeline --output results.json
+    python -m benchmarks.bench_pipeline --contacts 1000,10000,100000,1000000 --attachments 0,65536,1048576 \\
+        --compare results.json
+
+With --compare, throughput is checked against an earlier results file and the
+exit status is 1 if any matching scenario got slower than --tolerance allows.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+TEMPLATE_PATH = "templates/custom_email_template.html"
+
+PROMPT = "Write a cold email introducing Acme Analytics to data teams."
+
+
+def _contacts_csv(n: int) -> bytes:
+    lines = ["Name,Email,Company"]
+    lines.extend(f"Person {i},person{i}@example.com,Company {i % 997}" for i in range(n))
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def _percentile(ordered: list[float], q: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_scenario(contacts: int, attachment_bytes: int, workers: int, smtp_port: int) -> dict:
+    """Runs in the child process; the AI provider is reached through OPENAI_BASE_URL."""
+    from marketing_logic import load_contacts
+    from services.email_services import PreparedAttachment, SMTPSession
+    from services.openai_services import generate_email_template
+    from services.send_services import RateLimit, SendEngine, SendJob
+    from services.template_services import CompiledTemplate, compile_for_recipients, load_template
+
+    csv_bytes = _contacts_csv(contacts)
+    started = time.perf_counter()
+
+    parsed = load_contacts(io.BytesIO(csv_bytes))
+    del csv_bytes
+    ingested = time.perf_counter()
+
+    copy = generate_email_template(PROMPT, cache=None)
+    generated = time.perf_counter()
+
+    html_body = load_template(TEMPLATE_PATH).render({
+        "email_title": copy["title"], "email_body": copy["body"], "cta_text": copy["cta_text"],
+        "cta_link": "https://example.com/demo", "company_name": "Acme",
+    })
+    fields = parsed.sendable.columns
+    subject = CompiledTemplate.compile(copy["subject"], fields)
+    body = compile_for_recipients(html_body, fields)
+    attachments = ()
+    if attachment_bytes:
+        attachments = (PreparedAttachment.from_bytes("brochure.pdf", os.urandom(attachment_bytes)),)
+
+    engine = SendEngine(
+        workers=workers, host="127.0.0.1", port=smtp_port,
+        rate_limit=RateLimit(per_second=1e9, burst=10 ** 9),
+        session_factory=lambda: SMTPSession("127.0.0.1", smtp_port, username="", starttls=False),
+    )
+
+    def jobs():
+        for recipient in parsed:
+            yield SendJob([recipient["email"]], subject.render(recipient), body.render(recipient),
+                          attachments, ref=time.perf_counter())
+
+    latencies = []
+    failed = 0
+    first_error = None
+    for result in engine.run(jobs()):
+        latencies.append(time.perf_counter() - result.job.ref)
+        if not result.ok:
+            failed += 1
+            first_error = first_error or result.error
+    finished = time.perf_counter()
+
+    sent = len(latencies) - failed
+    send_seconds = finished - generated
+    latencies.sort()
+    return {
+        "contacts": contacts,
+        "attachment_bytes": attachment_bytes,
+        "workers": workers,
+        "sent": sent,
+        "failed": failed,
+        "first_error": first_error,
+        "stages_seconds": {
+            "ingest": round(ingested - started, 4),
+            "generate": round(generated - ingested, 4),
+            "render_and_send": round(send_seconds, 4),
+        },
+        "total_seconds": round(finished - started, 4),
+        "send_msgs_per_second": round(sent / send_seconds, 1) if send_seconds else 0.0,
+        "end_to_end_msgs_per_second": round(sent / (finished - started), 1),
+        "latency_ms": {
+            "p50": round(_percentile(latencies, 0.50) * 1000, 3),
+            "p99": round(_percentile(latencies, 0.99) * 1000, 3),
+            "max": round(latencies[-1] * 1000, 3) if latencies else 0.0,
+        },
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+    }
+
+
+def _run_child(contacts: int, attachment_bytes: int, workers: int, smtp_port: int, llm_url: str) -> dict:
+    env = dict(os.environ, OPENAI_BASE_URL=llm_url, OPENAI_API_KEY="bench", EMAIL_ADDRESS="bench@example.com")
+    scenario = json.dumps({"contacts": contacts, "attachment_bytes": attachment_bytes, "workers": workers,
+                           "smtp_port": smtp_port})
+    proc = subprocess.run([sys.executable, "-m", "benchmarks.bench_pipeline", "--scenario", scenario],
+                          env=env, capture_output=True, text=True, check=False)
+    if proc.returncode != 0:
+        raise RuntimeError(f"scenario {scenario} failed:\n{proc.stderr}")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def _key(result: dict) -> tuple:
+    return result["contacts"], result["attachment_bytes"], result["workers"]
+
+
+def compare(baseline_path: str, results: list[dict], tolerance: float) -> bool:
+    """Print throughput changes against a previous run; returns False on a regression."""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {_key(r): r for r in json.load(f)["results"]}
+    ok = True
+    for result in results:
+        before = baseline.get(_key(result))
+        if before is None or not before["send_msgs_per_second"]:
+            continue
+        change = result["send_msgs_per_second"] / before["send_msgs_per_second"] - 1
+        regressed = change < -tolerance
+        ok = ok and not regressed
+        print(f"{result['contacts']:>9} contacts {result['attachment_bytes']:>9} B: "
+              f"{before['send_msgs_per_second']:>10,.1f} -> {result['send_msgs_per_second']:>10,.1f} msg/s "
+              f"({change:+.1%}){'  REGRESSION' if regressed else ''}", file=sys.stderr)
+    return ok
+
+
+def _ints(value: str) -> list[int]:
+    return [int(v) for v in value.split(",") if v]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--contacts", type=_ints, default=[1000, 10000], help="comma-separated counts")
+    parser.add_argument("--attachments", type=_ints, default=[0, 65536], help="comma-separated sizes in bytes")
+    parser.add_argument("--workers", type=int, default=4, help="SMTP connections")
+    parser.add_argument("--smtp-latency", type=float, default=0.0, help="seconds the sink waits per message")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="seconds the fake provider waits")
+    parser.add_argument("--output", help="write the JSON results here (default: stdout)")
+    parser.add_argument("--compare", help="earlier results file to check for throughput regressions")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed throughput drop for --compare")
+    parser.add_argument("--scenario", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.scenario:
+        print(json.dumps(run_scenario(**json.loads(args.scenario))))
+        return 0
+
+    from benchmarks.fakes import FakeLLMServer, SMTPSink
+
+    results = []
+    with SMTPSink(args.smtp_latency) as sink, FakeLLMServer(args.llm_latency) as llm:
+        for contacts in args.contacts:
+            for attachment_bytes in args.attachments:
+                received = sink.messages
+                result = _run_child(contacts, attachment_bytes, args.workers, sink.port, llm.base_url)
+                result["sink_received"] = sink.messages - received
+                results.append(result)
+                print(f"{contacts:>9} contacts {attachment_bytes:>9} B: "
+                      f"{result['send_msgs_per_second']:>10,.1f} msg/s  "
+                      f"p50 {result['latency_ms']['p50']:.2f} ms  p99 {result['latency_ms']['p99']:.2f} ms  "
+                      f"peak RSS {result['peak_rss_mb']:.0f} MB", file=sys.stderr)
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {"workers": args.workers, "smtp_latency": args.smtp_latency, "llm_latency": args.llm_latency},
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    if args.compare and not compare(args.compare, results, args.tolerance):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
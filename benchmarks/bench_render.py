@@ -0,0 +1,83 @@
+"""Compare single-threaded message rendering with the process-pool render stage.
+
+The single-threaded path is what SendEngine does per job on a sender thread:
+render the personalized subject and HTML, build the MIME tree, serialize it
+and convert it to CRLF bytes. The pool path does the same work in
+RenderPool processes; pool start-up is included in its time.
+
+Run from the repository root:
+    python -m benchmarks.bench_render --recipients 20000 --attachment 65536 --processes 1,2,4,8
+"""
+import argparse
+import os
+import time
+
+from services.email_services import PreparedAttachment, render_message
+from services.render_services import RenderPool
+from services.template_services import CompiledTemplate, compile_for_recipients, load_template
+
+TEMPLATE_PATH = "templates/custom_email_template.html"
+
+CAMPAIGN = {
+    "email_title": "Meet Acme Analytics",
+    "email_body": "Hi [Name],<br><br>We help teams at [Company] ship dashboards in minutes. " * 5,
+    "cta_text": "Book a demo",
+    "cta_link": "https://example.com/demo",
+    "company_name": "Acme",
+}
+
+
+def _recipients(n: int) -> list[dict]:
+    return [{"name": f"Person {i}", "email": f"person{i}@example.com", "company": f"Company {i}"} for i in range(n)]
+
+
+def single_threaded(recipients, subject, body, attachments) -> int:
+    rendered = 0
+    for r in recipients:
+        render_message(subject.render(r), body.render(r), [r["email"]], attachments)
+        rendered += 1
+    return rendered
+
+
+def pooled(recipients, subject, body, attachments, processes: int, batch_size: int) -> int:
+    pool = RenderPool(subject, body, attachments, processes=processes, batch_size=batch_size)
+    return sum(1 for _ in pool.render((r["email"], r) for r in recipients))
+
+
+def _time(fn, *args) -> float:
+    start = time.perf_counter()
+    count = fn(*args)
+    elapsed = time.perf_counter() - start
+    assert count == len(args[0])
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--recipients", type=int, default=20000)
+    parser.add_argument("--attachment", type=int, default=65536, help="attachment size in bytes (0 for none)")
+    parser.add_argument("--processes", default=",".join(str(p) for p in sorted({1, 2, os.cpu_count() or 1})),
+                        help="comma-separated pool sizes")
+    parser.add_argument("--batch-size", type=int, default=64)
+    args = parser.parse_args()
+
+    recipients = _recipients(args.recipients)
+    fields = recipients[0].keys()
+    html = load_template(TEMPLATE_PATH).render(CAMPAIGN)
+    subject = CompiledTemplate.compile("Quick question for [Company]", fields)
+    body = compile_for_recipients(html, fields)
+    attachments = ()
+    if args.attachment:
+        attachments = (PreparedAttachment.from_bytes("brochure.pdf", os.urandom(args.attachment)),)
+
+    print(f"recipients: {args.recipients}  attachment: {args.attachment} B  cpus: {os.cpu_count()}")
+    baseline = _time(single_threaded, recipients, subject, body, attachments)
+    print(f"single thread: {baseline:.3f}s ({args.recipients / baseline:,.0f} msg/s)")
+    for processes in (int(p) for p in args.processes.split(",") if p):
+        elapsed = _time(pooled, recipients, subject, body, attachments, processes, args.batch_size)
+        print(f"{processes:>2} processes:  {elapsed:.3f}s ({args.recipients / elapsed:,.0f} msg/s, "
+              f"{baseline / elapsed:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""Compare the compiled template engine with the old chained str.replace rendering.
+
+Run from the repository root:
+    python -m benchmarks.bench_template --recipients 10000
+"""
+import argparse
+import time
+
+from services.template_services import CompiledTemplate, compile_for_recipients
+
+TEMPLATE_PATH = "templates/custom_email_template.html"
+
+CAMPAIGN = {
+    "email_title": "Meet Acme Analytics",
+    "email_body": "Hi [Name],<br><br>We help teams at [Company] ship dashboards in minutes. " * 5,
+    "cta_text": "Book a demo",
+    "cta_link": "https://example.com/demo",
+    "company_name": "Acme",
+}
+
+
+def _recipients(n: int) -> list[dict]:
+    return [{"name": f"Person {i}", "email": f"person{i}@example.com", "company": f"Company {i}"} for i in range(n)]
+
+
+def replace_chain(template_html: str, recipients: list[dict]) -> list[str]:
+    """The rendering app.py used before the template engine."""
+    rendered_html = template_html.replace("{{ EMAIL_TITLE }}", CAMPAIGN["email_title"]) \
+                                 .replace("{{ EMAIL_BODY }}", CAMPAIGN["email_body"]) \
+                                 .replace("{{ CTA_TEXT }}", CAMPAIGN["cta_text"]) \
+                                 .replace("{{ CTA_LINK }}", CAMPAIGN["cta_link"]) \
+                                 .replace("{{ COMPANY_NAME }}", CAMPAIGN["company_name"])
+    return [rendered_html.replace("[Name]", r.get("name", "there")).replace("[Company]", r.get("company", ""))
+            for r in recipients]
+
+
+def compiled(template_html: str, recipients: list[dict]) -> list[str]:
+    rendered_html = CompiledTemplate.compile(template_html).render(CAMPAIGN)
+    return compile_for_recipients(rendered_html, recipients[0].keys()).render_many(recipients)
+
+
+def _time(fn, *args, repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--recipients", type=int, default=10000)
+    args = parser.parse_args()
+
+    with open(TEMPLATE_PATH, "r", encoding="utf-8") as f:
+        template_html = f.read()
+    recipients = _recipients(args.recipients)
+
+    baseline = _time(replace_chain, template_html, recipients)
+    engine = _time(compiled, template_html, recipients)
+    print(f"recipients:      {args.recipients}")
+    print(f"str.replace:     {baseline:.3f}s ({args.recipients / baseline:,.0f} msg/s)")
+    print(f"compiled engine: {engine:.3f}s ({args.recipients / engine:,.0f} msg/s)")
+    print(f"speedup:         {baseline / engine:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
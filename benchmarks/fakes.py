@@ -0,0 +1,208 @@
+"""Local stand-ins for the SMTP relay and the AI provider, used by the pipeline benchmark and the tests.
+
+The servers run on background threads of the process that starts them and
+bind to an ephemeral port on 127.0.0.1.
+"""
+import json
+import smtplib
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _ThreadingTCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class SMTPSink:
+    """Minimal SMTP server that accepts and discards every message (no TLS, no auth).
+
+    ``latency`` seconds are added before the reply to DATA, to mimic a remote relay.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.messages = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+        sink = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def reply(self, line: str):
+                self.wfile.write(line.encode('ascii') + b'\r\n')
+
+            def handle(self):
+                self.reply('220 sink ESMTP')
+                while True:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    command = line[:4].upper()
+                    if command == b'EHLO':
+                        self.wfile.write(b'250-sink\r\n250-8BITMIME\r\n250 SIZE 0\r\n')
+                    elif command == b'DATA':
+                        self.reply('354 End data with <CR><LF>.<CR><LF>')
+                        size = 0
+                        for data_line in self.rfile:
+                            if data_line == b'.\r\n':
+                                break
+                            size += len(data_line)
+                        if sink.latency:
+                            time.sleep(sink.latency)
+                        with sink._lock:
+                            sink.messages += 1
+                            sink.bytes += size
+                        self.reply('250 OK queued')
+                    elif command == b'QUIT':
+                        self.reply('221 Bye')
+                        return
+                    else:
+                        # HELO, MAIL, RCPT, RSET, NOOP
+                        self.reply('250 OK')
+
+        self._server = _ThreadingTCPServer(('127.0.0.1', 0), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, name='smtp-sink', daemon=True)
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def start(self) -> 'SMTPSink':
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class RecordingSession:
+    """SMTPSession stand-in that keeps every (address, message) sent and refuses the addresses in ``reject``."""
+
+    def __init__(self, reject=()):
+        self.reject = set(reject)
+        self.sent = []
+        self.lock = threading.Lock()
+
+    def sendmail(self, from_addr, to_addrs, msg):
+        if to_addrs[0] in self.reject:
+            raise smtplib.SMTPResponseException(550, b'Mailbox unavailable')
+        with self.lock:
+            self.sent.append((to_addrs[0], msg))
+        return {}
+
+    def close(self):
+        pass
+
+
+class FakeLLMServer:
+    """OpenAI-compatible /chat/completions endpoint answering after ``latency`` seconds.
+
+    A prompt for one recipient (with a '- name: ' line) gets copy addressed to
+    that name; any other prompt gets TEMPLATE. ``failures`` is a list of HTTP
+    statuses returned, in order, before requests start succeeding. Requests
+    with "stream": true are answered with server-sent events, a few characters
+    per chunk. Connections are kept alive, so reuse by clients shows in
+    ``connections``.
+    """
+
+    TEMPLATE = {
+        "subject": "Meet Acme Analytics, [Name]",
+        "title": "Dashboards in minutes",
+        "body": "Hi [Name],<br><br>Teams at [Company] ship dashboards in minutes with Acme. " * 3,
+        "cta_text": "Book a demo",
+    }
+
+    def __init__(self, latency: float = 0.05, failures=()):
+        self.latency = latency
+        self.failures = list(failures)
+        self.requests = 0
+        self.connections = set()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                with server._lock:
+                    server.requests += 1
+                    server.connections.add(self.client_address)
+                    server.in_flight += 1
+                    server.max_in_flight = max(server.max_in_flight, server.in_flight)
+                    status = server.failures.pop(0) if server.failures else 200
+                try:
+                    time.sleep(server.latency)
+                    content_type = 'application/json'
+                    if status != 200:
+                        body = json.dumps({"error": {"message": "try later", "type": "rate_limit"}}).encode()
+                    elif payload.get('stream'):
+                        content = server.content(payload)
+                        content_type = 'text/event-stream'
+                        events = []
+                        for i in range(0, len(content), 5):
+                            chunk = {"id": "fake", "object": "chat.completion.chunk", "created": 0,
+                                     "model": payload.get('model', ''),
+                                     "choices": [{"index": 0, "delta": {"content": content[i:i + 5]}}]}
+                            events.append(f"data: {json.dumps(chunk)}\n\n")
+                        events.append("data: [DONE]\n\n")
+                        body = ''.join(events).encode()
+                    else:
+                        body = json.dumps({
+                            "id": "fake", "object": "chat.completion", "created": 0,
+                            "model": payload.get('model', ''),
+                            "choices": [{"index": 0, "finish_reason": "stop",
+                                         "message": {"role": "assistant", "content": server.content(payload)}}],
+                        }).encode()
+                    self.send_response(status)
+                    self.send_header('Content-Type', content_type)
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                finally:
+                    with server._lock:
+                        server.in_flight -= 1
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-llm', daemon=True)
+
+    def content(self, payload: dict) -> str:
+        """The JSON copy answering one request."""
+        prompt = payload['messages'][-1]['content']
+        name = next((line.split(': ', 1)[1] for line in prompt.splitlines() if line.startswith('- name: ')), None)
+        if name is None:
+            return json.dumps(self.TEMPLATE)
+        return json.dumps({"subject": f"For {name}", "title": "Hi", "body": f"Dear {name}<br>", "cta_text": "Go"})
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}/v1"
+
+    def start(self) -> 'FakeLLMServer':
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
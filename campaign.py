@@ -0,0 +1,261 @@
+"""Headless campaign runner, for large or scheduled (cron) sends outside Streamlit.
+
+    python -m campaign run --contacts contacts.csv --config campaign.json
+
+The config is JSON (or YAML when PyYAML is installed) with the campaign copy,
+e.g. {"subject": "...", "title": "...", "body": "...", "cta_text": "...",
+"cta_link": "...", "company_name": "..."}. Missing copy is written by the AI
+when a "prompt" is given, and "personalize": true writes it per recipient.
+
+Contacts are streamed in chunks and sent through the durable send queue, so
+memory stays bounded and re-running the same command resumes an interrupted
+campaign. A JSON report is written to stdout (or --report); service logs go
+to stderr. Exit status: 0 all sent, 1 some messages failed or are unsent,
+2 bad input or configuration.
+"""
+import argparse
+import contextlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from dataclasses import dataclass, field, fields
+from itertools import islice
+
+from marketing_logic import iter_recipients
+from services.metrics_services import metrics
+from services.openai_services import generate_email_template, personalize_to_queue
+from services.queue_services import SEND_QUEUE_DB_PATH, CampaignWorker, SendQueue
+from services.render_services import RENDER_PROCESSES
+from services.send_services import DomainLimit, SendEngine
+from services.suppression_services import SUPPRESSION_DB_PATH, SuppressionList
+from services.template_services import load_template
+
+DEFAULT_TEMPLATE = os.path.join('templates', 'custom_email_template.html')
+
+EXIT_OK = 0
+EXIT_INCOMPLETE = 1
+EXIT_ERROR = 2
+
+# Template copy the AI can write, and the [AI ...] slots used when it writes it per recipient
+COPY_FIELDS = ('subject', 'title', 'body', 'cta_text')
+PERSONALIZED_COPY = {'subject': '[AI Subject]', 'title': '[AI Title]', 'body': '[AI Body]', 'cta_text': '[AI CTA Text]'}
+
+
+@dataclass
+class CampaignConfig:
+    # Re-running a config resumes its campaign; a new name sends the same content again
+    name: str = ''
+    subject: str = ''
+    title: str = ''
+    body: str = ''
+    cta_text: str = ''
+    cta_link: str = ''
+    company_name: str = ''
+    prompt: str = ''
+    provider: str = 'OpenAI'
+    model: str = 'gpt-4o-mini'
+    personalize: bool = False
+    attachments: list[str] = field(default_factory=list)
+    limit: int | None = None
+    workers: int | None = None
+    render_processes: int | None = None
+    # Per recipient domain caps, e.g. {"gmail.com": {"concurrency": 2, "per_second": 1.5}}
+    domain_limits: dict[str, dict] = field(default_factory=dict)
+
+    @classmethod
+    def from_mapping(cls, data: dict) -> 'CampaignConfig':
+        known = {f.name for f in fields(cls)}
+        unknown = set(data) - known
+        if unknown:
+            raise ValueError(f"Unknown config keys: {', '.join(sorted(unknown))}")
+        for domain, caps in data.get('domain_limits', {}).items():
+            if not isinstance(caps, dict) or set(caps) - {'concurrency', 'per_second'}:
+                raise ValueError(f"domain_limits for {domain} takes only 'concurrency' and 'per_second'")
+        return cls(**data)
+
+
+def load_config(path: str) -> CampaignConfig:
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.endswith(('.yaml', '.yml')):
+            try:
+                import yaml
+            except ImportError:
+                raise ValueError("YAML configs need PyYAML (pip install pyyaml); use a .json config instead")
+            data = yaml.safe_load(f) or {}
+        else:
+            data = json.load(f)
+    if not isinstance(data, dict):
+        raise ValueError(f"{path} must contain a mapping of settings")
+    return CampaignConfig.from_mapping(data)
+
+
+def resolve_copy(config: CampaignConfig) -> dict:
+    """Subject, title, body and CTA text for the shared template, asking the AI for whatever is missing."""
+    if config.personalize:
+        if not config.prompt:
+            raise ValueError("personalize needs a prompt")
+        return dict(PERSONALIZED_COPY)
+
+    copy = {name: getattr(config, name) for name in COPY_FIELDS}
+    missing = [name for name, value in copy.items() if not value]
+    if missing and config.prompt:
+        ai_data = generate_email_template(config.prompt, provider=config.provider, model=config.model)
+        if ai_data.get('subject') == 'Error':
+            raise RuntimeError(ai_data.get('body'))
+        for name in missing:
+            copy[name] = ai_data.get(name, '')
+    if not copy['subject'] or not copy['body']:
+        raise ValueError("config needs a subject and body, or a prompt to generate them")
+    return copy
+
+
+def run_campaign(contacts: str, config: CampaignConfig, queue: SendQueue,
+                 suppression: SuppressionList | None = None, template_path: str = DEFAULT_TEMPLATE,
+                 engine_factory=None) -> dict:
+    """Queue and send a campaign; returns the report dict."""
+    started = time.time()
+    copy = resolve_copy(config)
+    html_body = load_template(template_path).render({
+        "email_title": copy['title'],
+        "email_body": copy['body'],
+        "cta_text": copy['cta_text'],
+        "cta_link": config.cta_link,
+        "company_name": config.company_name,
+    })
+    attachments = []
+    for path in config.attachments:
+        with open(path, 'rb') as f:
+            attachments.append((os.path.basename(path), f.read()))
+
+    variant = f"{config.provider}:{config.model}:{config.prompt}" if config.personalize else ''
+    campaign_id = queue.create_campaign(copy['subject'], html_body, attachments, variant=variant, name=config.name)
+
+    if engine_factory is None:
+        engine_options = {
+            'suppression': suppression,
+            'domain_limits': {domain: DomainLimit(**caps) for domain, caps in config.domain_limits.items()},
+        }
+        if config.workers:
+            engine_options['workers'] = config.workers
+        engine_factory = lambda: SendEngine(**engine_options)
+    contact_stats = {}
+    recipients = islice(iter_recipients(contacts, suppression=suppression, stats=contact_stats), config.limit)
+
+    # The worker sends while this thread is still reading (or personalizing) contacts
+    producer_done = threading.Event()
+    worker = CampaignWorker(queue, campaign_id, engine_factory, producer_done=producer_done,
+                            render_processes=config.render_processes or RENDER_PROCESSES)
+    worker.start()
+    generation = None
+    try:
+        if config.personalize:
+            generation = personalize_to_queue(queue, campaign_id, recipients, config.prompt,
+                                              provider=config.provider, model=config.model)
+        else:
+            queue.enqueue(campaign_id, recipients)
+    except Exception:
+        worker.stop()
+        raise
+    finally:
+        producer_done.set()
+        worker.join()
+
+    counts = queue.counts(campaign_id)
+    remaining = counts['total'] - counts['sent'] - counts['failed']
+    if worker.error is not None:
+        status = 'error'
+    elif counts['failed'] or remaining:
+        status = 'incomplete'
+    else:
+        status = 'completed'
+    report = {
+        'campaign_id': campaign_id,
+        'status': status,
+        'error': str(worker.error) if worker.error is not None else None,
+        'contacts': contact_stats,
+        'queued': counts['total'],
+        'sent': counts['sent'],
+        'failed': counts['failed'],
+        'remaining': remaining,
+        'budget_exhausted': worker.budget_exhausted,
+        'started_at': started,
+        'duration_seconds': round(time.time() - started, 3),
+    }
+    if generation is not None:
+        report['generation'] = generation
+    return report
+
+
+def _run_command(args) -> int:
+    report = {'status': 'error'}
+    exit_code = EXIT_ERROR
+    # Services print progress; keep stdout for the JSON report
+    with contextlib.redirect_stdout(sys.stderr):
+        try:
+            config = load_config(args.config)
+            if args.limit is not None:
+                config.limit = args.limit
+            if args.workers is not None:
+                config.workers = args.workers
+            if args.render_processes is not None:
+                config.render_processes = args.render_processes
+            if args.name is not None:
+                config.name = args.name
+            if args.metrics:
+                metrics.enable()
+            with SuppressionList(args.suppression_db) as suppression:
+                queue = SendQueue(args.queue_db)
+                try:
+                    report = run_campaign(args.contacts, config, queue, suppression, args.template)
+                    if args.report_csv:
+                        queue.write_report(report['campaign_id'], args.report_csv, 'csv')
+                    if args.report_parquet:
+                        queue.write_report(report['campaign_id'], args.report_parquet, 'parquet')
+                finally:
+                    queue.close()
+            exit_code = EXIT_OK if report['status'] == 'completed' else EXIT_INCOMPLETE
+        except (OSError, ValueError, RuntimeError, sqlite3.Error) as e:
+            report['error'] = str(e)
+        if args.metrics:
+            try:
+                metrics.write(args.metrics)
+            except OSError as e:
+                print(f"Could not write metrics to {args.metrics}: {e}")
+    output = json.dumps(report, indent=2) + '\n'
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        sys.stdout.write(output)
+    return exit_code
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m campaign', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help='queue and send a campaign')
+    run.add_argument('--contacts', required=True, help="CSV with 'Name' and 'Email' columns")
+    run.add_argument('--config', required=True, help='campaign settings (.json, or .yaml with PyYAML)')
+    run.add_argument('--template', default=DEFAULT_TEMPLATE, help='HTML template')
+    run.add_argument('--name', help='campaign name; a new name sends again to recipients already reached')
+    run.add_argument('--limit', type=int, help='send to at most this many recipients')
+    run.add_argument('--workers', type=int, help='concurrent SMTP connections')
+    run.add_argument('--render-processes', type=int, help='processes rendering personalized messages')
+    run.add_argument('--queue-db', default=SEND_QUEUE_DB_PATH, help='send queue database')
+    run.add_argument('--suppression-db', default=SUPPRESSION_DB_PATH, help='unsubscribe/bounce index')
+    run.add_argument('--report', help='write the JSON report here instead of stdout')
+    run.add_argument('--report-csv', help='also write the per-recipient status CSV here')
+    run.add_argument('--report-parquet', help='also write the per-recipient status as Parquet here')
+    run.add_argument('--metrics', help='write per-stage timings here (.json, otherwise Prometheus text)')
+
+    args = parser.parse_args(argv)
+    return _run_command(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
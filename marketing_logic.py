@@ -1,59 +1,263 @@
+import numpy as np
 import pandas as pd
 import re
-from typing import List, Dict, Optional
+import time
+from collections.abc import Iterator, Mapping
+from dataclasses import dataclass
+from typing import List, Dict, Optional, Set, Tuple
+from services.metrics_services import metrics
+from services.suppression_services import SuppressionList
+
+# Rows per chunk when streaming large CSVs
+DEFAULT_CHUNK_SIZE = 50_000
+
+# Every column can fill a [Field] slot, so cells are read as the text in the file
+# (a Zip of 02134 stays 02134, a blank stays '') whether the upload is loaded or streamed
+CSV_READ_OPTIONS = {'dtype': str, 'keep_default_na': False}
+
+# Map common variations to standard names
+COLUMN_MAP = {
+    'name': 'name', 'full name': 'name', 'fullname': 'name',
+    'email': 'email', 'email address': 'email', 'mail': 'email',
+    'company': 'company', 'company name': 'company', 'organization': 'company'
+}
+
+# Simple regex for email validation, compiled once
+EMAIL_PATTERN = re.compile(r'^[\w\.-]+@[\w\.-]+\.\w+$')
 
 def validate_email(email: str) -> bool:
     """Basic email validation using regex."""
     if not isinstance(email, str):
         return False
-    # Simple regex for email validation
-    pattern = r'^[\w\.-]+@[\w\.-]+\.\w+$'
-    return bool(re.match(pattern, email.strip()))
+    return bool(EMAIL_PATTERN.match(email.strip()))
+
+# Rejection reasons reported in the 'invalid_reason' column ('' means valid)
+INVALID_REASONS = ['', 'missing', 'missing_at', 'multiple_at', 'invalid_format']
+
+def _as_bool(mask: pd.Series) -> np.ndarray:
+    return mask.fillna(False).to_numpy(dtype=bool)
+
+def normalize_emails(emails: pd.Series) -> pd.Series:
+    """
+    Vectorized clean-up of an email column: trims whitespace, strips a
+    leading 'mailto:' and lowercases the domain part.
+    """
+    cleaned = emails.astype("string[pyarrow]").str.strip()
+    cleaned = cleaned.str.replace(r'^[Mm][Aa][Ii][Ll][Tt][Oo]:', '', regex=True)
+    # Only split the rows whose domain actually has capitals
+    needs_lower = _as_bool(cleaned.str.contains(r'@[^@]*[A-Z]', regex=True))
+    if needs_lower.any():
+        parts = cleaned[needs_lower].str.rpartition('@')
+        cleaned = cleaned.mask(needs_lower, parts[0] + '@' + parts[2].str.lower())
+    return cleaned
+
+def classify_emails(raw: pd.Series, normalized: pd.Series) -> pd.Series:
+    """
+    Returns the rejection reason for each address as a categorical column,
+    '' when it is valid. The first matching reason in INVALID_REASONS wins.
+    """
+    well_formed = _as_bool(normalized.str.match(EMAIL_PATTERN.pattern))
+    # Arrow's regex engine treats \w as ASCII only; recheck non-ASCII addresses
+    # (josé@…, x@bücher.de) with re so this agrees with validate_email
+    recheck = ~well_formed & _as_bool(normalized.str.contains(r'[^\x00-\x7f]', regex=True))
+    if recheck.any():
+        well_formed[recheck] = [bool(EMAIL_PATTERN.match(email)) for email in normalized[recheck]]
+    conditions = [
+        _as_bool(raw.isna() | (normalized == '')),
+        ~_as_bool(normalized.str.contains('@', regex=False)),
+        _as_bool(normalized.str.contains('@.*@', regex=True)),
+        ~well_formed,
+    ]
+    codes = np.select(conditions, [1, 2, 3, 4], default=0)
+    return pd.Series(pd.Categorical.from_codes(codes, INVALID_REASONS), index=normalized.index)
+
+def _prepare_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Standardize columns and validate emails for a whole file or one chunk of it."""
+    # Normalize column names to lowercase for easier matching
+    df.columns = [c.strip().lower() for c in df.columns]
+    
+    df.rename(columns=COLUMN_MAP, inplace=True)
+    
+    # Ensure required columns exist
+    if 'email' not in df.columns:
+        raise ValueError("CSV must contain an 'Email' column.")
+    
+    if 'name' not in df.columns:
+        # If no name, use a default or empty
+        df['name'] = ''
+        
+    if 'company' not in df.columns:
+        df['company'] = ''
 
+    # Clean and validate emails over the whole column at once
+    raw_emails = df['email']
+    df['email'] = normalize_emails(raw_emails)
+    df['invalid_reason'] = classify_emails(raw_emails, df['email'])
+    df['is_valid_email'] = df['invalid_reason'] == ''
+    
+    return df
+
+@metrics.timed('csv_parse')
 def process_csv(file) -> pd.DataFrame:
     """
     Reads a CSV file and standardizes column names.
     Expected columns: Name, Email, Company (optional).
     """
     try:
-        df = pd.read_csv(file)
-        # Normalize column names to lowercase for easier matching
-        df.columns = [c.strip().lower() for c in df.columns]
-        
-        # Map common variations to standard names
-        col_map = {
-            'name': 'name', 'full name': 'name', 'fullname': 'name',
-            'email': 'email', 'email address': 'email', 'mail': 'email',
-            'company': 'company', 'company name': 'company', 'organization': 'company'
-        }
-        
-        df.rename(columns=col_map, inplace=True)
-        
-        # Ensure required columns exist
-        if 'email' not in df.columns:
-            raise ValueError("CSV must contain an 'Email' column.")
-        
-        if 'name' not in df.columns:
-            # If no name, use a default or empty
-            df['name'] = ''
-            
-        if 'company' not in df.columns:
-            df['company'] = ''
-
-        # Clean emails
-        df['email'] = df['email'].astype(str).str.strip()
-        
-        # Validate emails
-        df['is_valid_email'] = df['email'].apply(validate_email)
-        
-        return df
+        df = pd.read_csv(file, **CSV_READ_OPTIONS)
+        return _prepare_frame(df)
+    except Exception as e:
+        raise ValueError(f"Error processing CSV: {str(e)}")
+
+class Recipient(Mapping):
+    """
+    A compact, read-only contact record.
+    All records from one file share a single column index, so each
+    record only stores a tuple of values.
+    """
+    __slots__ = ('_index', '_values')
+
+    def __init__(self, index: Dict[str, int], values: tuple):
+        self._index = index
+        self._values = values
+
+    def __getitem__(self, key):
+        return self._values[self._index[key]]
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __repr__(self):
+        return f"Recipient({dict(self)!r})"
+
+@metrics.timed('contact_filter')
+def _sendable(df: pd.DataFrame, suppression: Optional[SuppressionList] = None,
+              seen: Optional[Set[str]] = None) -> Tuple[pd.DataFrame, Dict[str, int]]:
+    """
+    Keeps valid rows whose address is neither a repeat nor suppressed.
+    ``seen`` carries already-kept addresses across chunks of the same file.
+    """
+    valid_df = df[df['is_valid_email']]
+    keys = valid_df['email'].str.lower()
+    duplicate = keys.duplicated().to_numpy(copy=True)
+    if seen:
+        duplicate |= keys.isin(seen).to_numpy()
+    suppressed = np.zeros(len(keys), dtype=bool)
+    if suppression is not None and len(keys):
+        blocked = suppression.suppressed_among(keys[~duplicate])
+        if blocked:
+            suppressed = keys.isin(blocked).to_numpy() & ~duplicate
+    keep = ~(duplicate | suppressed)
+    if metrics.enabled:
+        metrics.inc('contacts_rows_total', int(keep.sum()), outcome='sendable')
+        metrics.inc('contacts_rows_total', len(df) - len(valid_df), outcome='invalid')
+        metrics.inc('contacts_rows_total', int(duplicate.sum()), outcome='duplicate')
+        metrics.inc('contacts_rows_total', int(suppressed.sum()), outcome='suppressed')
+    if seen is not None:
+        seen.update(keys[keep])
+    stats = {
+        'total': len(df),
+        'valid': len(valid_df),
+        'duplicates': int(duplicate.sum()),
+        'suppressed': int(suppressed.sum()),
+        'sendable': int(keep.sum()),
+    }
+    return valid_df[keep], stats
+
+def _frame_recipients(df: pd.DataFrame, index: Optional[Dict[str, int]] = None) -> Iterator[Recipient]:
+    if index is None:
+        index = {column: i for i, column in enumerate(df.columns)}
+    for values in df.itertuples(index=False, name=None):
+        yield Recipient(index, values)
+
+def _read_chunks(file, chunksize: int):
+    reader = iter(pd.read_csv(file, chunksize=chunksize, **CSV_READ_OPTIONS))
+    while True:
+        # Time the read and validation only, not the consumer's work between chunks
+        started = time.perf_counter()
+        chunk = next(reader, None)
+        if chunk is None:
+            return
+        chunk = _prepare_frame(chunk)
+        metrics.observe('csv_chunk', time.perf_counter() - started)
+        yield chunk
+
+def iter_recipients(file, chunksize: int = DEFAULT_CHUNK_SIZE,
+                    suppression: Optional[SuppressionList] = None,
+                    stats: Optional[Dict[str, int]] = None) -> Iterator[Recipient]:
+    """
+    Streams sendable recipients from a CSV without loading the whole file.
+    Invalid, repeated and suppressed addresses are skipped.
+    Peak memory is bounded by ``chunksize`` rows rather than the file size.
+    If ``stats`` is given, the counts of count_recipients are added to it as chunks are read.
+    """
+    try:
+        index = None
+        seen = set()
+        for chunk in _read_chunks(file, chunksize):
+            chunk, chunk_stats = _sendable(chunk, suppression, seen)
+            if stats is not None:
+                for key, value in chunk_stats.items():
+                    stats[key] = stats.get(key, 0) + value
+            chunk = chunk.drop(columns=['is_valid_email', 'invalid_reason'])
+            if index is None:
+                index = {column: i for i, column in enumerate(chunk.columns)}
+            yield from _frame_recipients(chunk, index)
     except Exception as e:
         raise ValueError(f"Error processing CSV: {str(e)}")
 
-def get_recipient_data(df: pd.DataFrame) -> List[Dict]:
+def count_recipients(file, chunksize: int = DEFAULT_CHUNK_SIZE,
+                     suppression: Optional[SuppressionList] = None) -> Dict[str, int]:
+    """
+    Counts rows chunk by chunk, for summaries of files too large to load.
+    Returns total, valid, duplicates, suppressed and sendable counts.
     """
-    Extracts valid recipients from the DataFrame.
+    totals = {'total': 0, 'valid': 0, 'duplicates': 0, 'suppressed': 0, 'sendable': 0}
+    seen = set()
+    try:
+        for chunk in _read_chunks(file, chunksize):
+            _, stats = _sendable(chunk, suppression, seen)
+            for key, value in stats.items():
+                totals[key] += value
+    except Exception as e:
+        raise ValueError(f"Error processing CSV: {str(e)}")
+    return totals
+
+def get_recipient_data(df: pd.DataFrame, suppression: Optional[SuppressionList] = None) -> List[Dict]:
+    """
+    Extracts valid recipients from the DataFrame, dropping repeated
+    addresses and any address on the suppression list.
     Returns a list of dictionaries.
     """
-    valid_df = df[df['is_valid_email']].copy()
+    valid_df, _ = _sendable(df, suppression)
     return valid_df.to_dict('records')
+
+@dataclass
+class ContactList:
+    """
+    One parsed upload: a small preview, the counts, and the sendable rows.
+    Only the filtered frame is kept (the full frame and per-row dicts are
+    not), and recipients are produced from it lazily when iterated.
+    """
+    preview: pd.DataFrame
+    stats: Dict[str, int]
+    sendable: pd.DataFrame
+
+    def __len__(self):
+        return len(self.sendable)
+
+    def __iter__(self) -> Iterator[Recipient]:
+        return _frame_recipients(self.sendable)
+
+def load_contacts(file, suppression: Optional[SuppressionList] = None, preview_rows: int = 5) -> ContactList:
+    """
+    Parses an upload once into a ContactList, for callers that cache it (e.g. across Streamlit reruns).
+    """
+    df = process_csv(file)
+    sendable, stats = _sendable(df, suppression)
+    sendable = sendable.drop(columns=['is_valid_email', 'invalid_reason']).reset_index(drop=True)
+    # copy() so the preview does not pin the full frame's columns in memory
+    return ContactList(df.head(preview_rows).copy(), stats, sendable)
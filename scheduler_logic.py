@@ -1,9 +1,26 @@
 import os
-import tempfile
+import re
+import threading
+from collections import OrderedDict
+from collections.abc import Callable
 from datetime import datetime
 from services.openai_services import generate_email_template
-from services.ics_services import create_ics_file
-from services.email_services import send_email
+from services.ics_services import InviteTemplate, invite_attachment
+from services.send_services import SendEngine, SendJob
+
+
+INVITE_FOOTER = 'Please find the calendar invite attached.'
+
+# Formatting the AI may use in an invite body; any other tag is dropped along with its attributes
+ALLOWED_TAGS = frozenset({'b', 'strong', 'i', 'em', 'u', 'br', 'p', 'ul', 'ol', 'li'})
+
+# Script/style blocks (including JSON-LD), any other tag, and runs of line breaks
+_SANITIZE_PATTERN = re.compile(
+    r'<(script|style)\b.*?(?:</\1\s*>|\Z)'
+    r'|<(/?)([A-Za-z][A-Za-z0-9]*)\b[^>]*>'
+    r'|[ \t]*(?:\r?\n[ \t]*)+',
+    re.IGNORECASE | re.DOTALL,
+)
 
 
 
@@ -25,67 +42,116 @@ def get_meeting_prompt(meeting_title: str, start_dt: datetime, end_dt: datetime,
 
 
 
-def generate_ai_email(prompt: str) -> str:
-    ai_body = generate_email_template(prompt)
+def _sanitize_match(match: re.Match) -> str:
+    block, closing, tag = match.groups()
+    if block:
+        return ''
+    if tag:
+        tag = tag.lower()
+        return f'<{closing}{tag}>' if tag in ALLOWED_TAGS else ''
+    return '<br>'
 
 
-    # Simple cleaning to remove any script tags or JSON-LD
-    cleaned = []
-    for line in ai_body.splitlines():
-        if line.strip().lower().startswith('<script'):
-            break
-        cleaned.append(line)
+def sanitize_ai_html(text: str) -> str:
+    """Single pass over the AI text: drop scripts and unknown tags, strip attributes, turn line breaks into <br>."""
+    return _SANITIZE_PATTERN.sub(_sanitize_match, text.strip())
 
 
-    email_text = '\n'.join([l.strip() for l in cleaned if l.strip()])
-    if 'calendar invite' not in email_text.lower():
-        email_text += '\n\nPlease find the calendar invite attached.'
+def _wrap_invite_html(email_html: str) -> str:
+    if 'calendar invite' not in email_html.lower():
+        email_html += f'<br><br>{INVITE_FOOTER}'
+    return f"<html><body><p>{email_html}</p></body></html>"
 
 
-    # Wrap into simple HTML body
-    html_body = f"<html><body><p>{email_text.replace('\n', '<br>')}</p></body></html>"
-    return html_body
+def _ai_body_text(prompt: str) -> str | None:
+    """The body the model wrote, or None if generation failed."""
+    data = generate_email_template(prompt)
+    if data.get('subject') == 'Error' or not data.get('body'):
+        print(f"AI invite body unavailable: {data.get('body')}")
+        return None
+    return data['body']
 
 
 
 
-def send_meeting_invite(subject: str, body: str, recipients: list[str], meeting_title: str,
-                        start_dt: datetime, end_dt: datetime, extra_notes: str = "") -> bool:
+def generate_ai_email(prompt: str, fallback_text: str = "") -> str:
+    """AI-written invite body as HTML; ``fallback_text`` is used if generation fails."""
+    return _wrap_invite_html(sanitize_ai_html(_ai_body_text(prompt) or fallback_text))
 
 
-    duration = int((end_dt - start_dt).total_seconds() // 60)
-    prompt = get_meeting_prompt(meeting_title, start_dt, end_dt, duration, extra_notes)
-    html_body = generate_ai_email(prompt)
+class InviteRenderer:
+    """Produces the invite HTML once per (meeting, notes) and reuses it.
 
+    Every attendee of a meeting, and any later send of the same invite,
+    shares one AI call. Concurrent renders of the same meeting wait for
+    the first instead of calling the model again. Failed generations are
+    not memoized.
+    """
 
-    success = True
-    for r in recipients:
-        # create a temp file for each recipient to include their attendee address (helps RSVP tracking)
-        fd, path = tempfile.mkstemp(suffix='.ics', prefix='invite_')
-        os.close(fd)
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._bodies: OrderedDict[tuple, str] = OrderedDict()
+        self._key_locks: dict[tuple, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def render(self, meeting_title: str, start_dt: datetime, end_dt: datetime, extra_notes: str = "",
+               fallback_text: str = "") -> str:
+        key = (meeting_title, start_dt, end_dt, extra_notes)
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            with self._lock:
+                if key in self._bodies:
+                    self._bodies.move_to_end(key)
+                    return self._bodies[key]
 
+            duration = int((end_dt - start_dt).total_seconds() // 60)
+            text = _ai_body_text(get_meeting_prompt(meeting_title, start_dt, end_dt, duration, extra_notes))
+            html_body = _wrap_invite_html(sanitize_ai_html(text or fallback_text))
 
-        try:
-            create_ics_file(
-                title=meeting_title,
-                description=extra_notes or body,
-                start_dt=start_dt,
-                end_dt=end_dt,
-                organizer_email=os.getenv('EMAIL_ADDRESS'),
-                attendee_email=r,
-                filepath=path,
-            )
+            with self._lock:
+                self._key_locks.pop(key, None)
+                if text is not None:
+                    self._bodies[key] = html_body
+                    while len(self._bodies) > self.max_entries:
+                        self._bodies.popitem(last=False)
+        return html_body
 
+    def clear(self):
+        with self._lock:
+            self._bodies.clear()
 
-            ok = send_email(subject, html_body, [r], attachment_path=path)
-            success = success and ok
 
+invite_renderer = InviteRenderer()
 
-        finally:
-            try:
-                os.remove(path)
-            except Exception:
-                pass
 
 
-    return success
\ No newline at end of file
+
+def send_meeting_invite(subject: str, body: str, recipients: list[str], meeting_title: str,
+                        start_dt: datetime, end_dt: datetime, extra_notes: str = "",
+                        engine_factory: Callable[[], SendEngine] = SendEngine,
+                        renderer: InviteRenderer = invite_renderer) -> bool:
+    """Email the invite to every recipient; ``body`` is used if the AI body cannot be generated."""
+    html_body = renderer.render(meeting_title, start_dt, end_dt, extra_notes, fallback_text=body)
+
+    # One invite per recipient carries their attendee address (helps RSVP tracking);
+    # the invites are rendered in memory and never written to disk
+    invite = InviteTemplate(
+        title=meeting_title,
+        description=extra_notes or body,
+        start_dt=start_dt,
+        end_dt=end_dt,
+        organizer_email=os.getenv('EMAIL_ADDRESS'),
+    )
+    jobs = (SendJob(to_addrs=[r], subject=subject, html_body=html_body, attachments=(invite_attachment(ics),), ref=r)
+            for r, ics in zip(recipients, invite.render_many(recipients)))
+
+
+    success = True
+    for result in engine_factory().run(jobs):
+        if not result.ok:
+            print(f"Invite to {result.job.ref} failed: {result.error}")
+            success = False
+
+
+    return success
@@ -1,11 +1,16 @@
 import os
-import smtplib
+import re
+import threading
+from collections.abc import Iterable
+from dataclasses import dataclass
 from dotenv import load_dotenv
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.base import MIMEBase
 from email import encoders
 
+from services.metrics_services import metrics
+
 
 load_dotenv()
 
@@ -14,9 +19,165 @@ EMAIL_ADDRESS = os.getenv('EMAIL_ADDRESS')
 EMAIL_PASSWORD = os.getenv('EMAIL_PASSWORD')
 SMTP_HOST = os.getenv('SMTP_HOST', 'smtp.gmail.com')
 SMTP_PORT = int(os.getenv('SMTP_PORT', 587))
+# Set to false only for local relays or test sinks that do not offer TLS
+SMTP_STARTTLS = os.getenv('SMTP_STARTTLS', 'true').lower() not in ('0', 'false', 'no')
+
+
+class SMTPSession:
+    """A logged-in SMTP connection that is reused across many sends.
+
+    The connection is opened lazily on the first send and re-established
+    transparently if the server drops it. Use as a context manager so the
+    session is closed with QUIT when the batch is done.
+    """
+
+    def __init__(self, host: str | None = None, port: int | None = None,
+                 username: str | None = None, password: str | None = None,
+                 timeout: float = 60.0, max_reconnects: int = 2, starttls: bool = SMTP_STARTTLS):
+        self.host = host or SMTP_HOST
+        self.port = port or SMTP_PORT
+        self.username = username if username is not None else EMAIL_ADDRESS
+        self.password = password if password is not None else EMAIL_PASSWORD
+        self.timeout = timeout
+        self.max_reconnects = max_reconnects
+        self.starttls = starttls
+        self._server = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def connect(self):
+        """Open the connection, upgrade to TLS and log in."""
+        # smtplib (with socket and ssl) is loaded here so building messages and invites stays light
+        import smtplib
+
+        self.close()
+        server = None
+        try:
+            with metrics.timer('smtp_connect'):
+                server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+                server.ehlo()
+            if self.starttls:
+                with metrics.timer('smtp_starttls'):
+                    server.starttls()
+                    server.ehlo()
+            if self.username:
+                with metrics.timer('smtp_login'):
+                    server.login(self.username, self.password)
+        except BaseException:
+            # A failed handshake or login would otherwise leak the socket on every retry
+            if server is not None:
+                server.close()
+            raise
+        metrics.inc('smtp_connections_total')
+        self._server = server
+        return server
+
+    def close(self):
+        """Send QUIT and drop the connection. Safe to call more than once."""
+        server, self._server = self._server, None
+        if server is None:
+            return
+        try:
+            server.quit()
+        except Exception:
+            server.close()
+
+    def sendmail(self, from_addr: str, to_addrs: list[str], msg: str | bytes) -> dict:
+        """Send one message, reconnecting if the server has hung up on us."""
+        import smtplib
+
+        attempts = 0
+        while True:
+            server = self._server or self.connect()
+            try:
+                with metrics.timer('smtp_send'):
+                    return server.sendmail(from_addr, to_addrs, msg)
+            except smtplib.SMTPServerDisconnected:
+                metrics.inc('smtp_disconnects_total')
+                self._server = None
+                attempts += 1
+                if attempts > self.max_reconnects:
+                    raise
+
+
+@dataclass(frozen=True)
+class PreparedAttachment:
+    """An attachment encoded once and shared by every message of a campaign.
+
+    ``part`` is the base64-encoded MIME part and ``wire`` its serialized form
+    with CRLF line endings, ready to be copied into every message; neither
+    must be mutated after construction.
+    """
+    filename: str
+    part: MIMEBase
+    wire: bytes
+
+    @classmethod
+    def from_bytes(cls, filename: str, data: bytes, maintype: str = 'application',
+                   subtype: str = 'octet-stream', **params) -> 'PreparedAttachment':
+        part = MIMEBase(maintype, subtype, **params)
+        part.set_payload(data)
+        encoders.encode_base64(part)
+        part.add_header('Content-Disposition', f'attachment; filename="{filename}"')
+        return cls(filename, part, to_wire(part.as_string()))
+
+    @classmethod
+    def from_path(cls, path: str) -> 'PreparedAttachment':
+        with open(path, 'rb') as f:
+            return cls.from_bytes(os.path.basename(path), f.read())
+
+
+class AttachmentCache:
+    """Campaign-level cache of encoded attachments keyed by path, size and mtime."""
+
+    def __init__(self, max_entries: int = 32):
+        self.max_entries = max_entries
+        self._entries: dict[tuple, PreparedAttachment] = {}
+        self._lock = threading.Lock()
 
-def _make_message(subject: str, html_body: str, recipients: list[str], attachment_paths: list[str] | None = None) -> MIMEMultipart:
-    """Constructs an email message with HTML body and optional attachments. Returns MIMEMultipart."""
+    def get(self, path: str) -> PreparedAttachment:
+        st = os.stat(path)
+        key = (os.path.realpath(path), st.st_size, st.st_mtime_ns)
+        with self._lock:
+            cached = self._entries.get(key)
+        if cached is not None:
+            return cached
+        prepared = PreparedAttachment.from_path(path)
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                self._entries.pop(next(iter(self._entries)))
+            self._entries[key] = prepared
+        return prepared
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+attachment_cache = AttachmentCache()
+
+
+def load_attachments(attachment_paths: list[str] | None) -> list[PreparedAttachment]:
+    """Encode each file once (via the shared cache). Unreadable files are reported and skipped."""
+    prepared = []
+    for path in attachment_paths or []:
+        try:
+            prepared.append(attachment_cache.get(path))
+        except Exception as e:
+            print(f"Failed to attach file {path}: {e}")
+    return prepared
+
+
+def _make_message(subject: str, html_body: str, recipients: list[str], attachment_paths: list[str] | None = None,
+                  attachments: list[PreparedAttachment] | None = None, to_header: str | None = None) -> MIMEMultipart:
+    """Constructs an email message with HTML body and optional attachments. Returns MIMEMultipart.
+
+    ``to_header`` replaces the To header (e.g. 'undisclosed-recipients:;' for Bcc-style envelopes).
+    """
 
 
     if not isinstance(recipients, list):
@@ -26,7 +187,7 @@ def _make_message(subject: str, html_body: str, recipients: list[str], attachmen
     outer = MIMEMultipart('mixed')
     outer['Subject'] = subject
     outer['From'] = EMAIL_ADDRESS
-    outer['To'] = ', '.join(recipients)
+    outer['To'] = to_header or ', '.join(recipients)
 
 
     # Alternative: HTML body (for email clients)
@@ -37,44 +198,83 @@ def _make_message(subject: str, html_body: str, recipients: list[str], attachmen
     outer.attach(alt)
 
 
-    if attachment_paths:
-        for path in attachment_paths:
-            try:
-                with open(path, 'rb') as f:
-                    file_data = f.read()
-                    filename = os.path.basename(path)
-                
-                part = MIMEBase('application', 'octet-stream')
-                part.set_payload(file_data)
-                encoders.encode_base64(part)
-                
-                part.add_header('Content-Disposition', f'attachment; filename="{filename}"')
-                outer.attach(part)
-            except Exception as e:
-                print(f"Failed to attach file {path}: {e}")
+    # Shared, already-encoded parts are attached by reference
+    for attachment in load_attachments(attachment_paths) + list(attachments or []):
+        outer.attach(attachment.part)
 
 
     return outer
 
-def send_email(subject: str, body_html: str, to_emails: list[str], attachment_paths: list[str] | None = None) -> bool:
-    """Send email to one or many recipients. If attachment_paths provided, read and attach files."""
+def render_head(subject: str, html_body: str, recipients: list[str],
+                to_header: str | None = None) -> tuple[str, str]:
+    """The serialized message up to where attachments go, and its MIME boundary.
+
+    Appending ``\n--boundary\n`` plus a serialized part per attachment and a
+    closing ``\n--boundary--\n`` completes it (see attach_wire).
+    """
+    outer = _make_message(subject, html_body, recipients, to_header=to_header)
+    text = outer.as_string()
+    boundary = outer.get_boundary()
+    return text[:text.rindex(f"\n--{boundary}--\n")], boundary
+
+
+# Any line ending that is not already CRLF
+_EOL_PATTERN = re.compile(r'(?:\r\n|\n|\r(?!\n))')
+
+
+def to_wire(message: str) -> bytes:
+    """CRLF line endings and ASCII bytes, as smtplib would send a str message."""
+    return _EOL_PATTERN.sub('\r\n', message).encode('ascii')
+
+
+def attach_wire(head: bytes, boundary: str, attachments: Iterable[bytes] = ()) -> bytes:
+    """Complete a message head (``render_head`` in wire form) with attachment parts already in wire form."""
+    delimiter = f"\r\n--{boundary}\r\n".encode('ascii')
+    pieces = [head]
+    for attachment in attachments:
+        pieces += (delimiter, attachment)
+    pieces.append(f"\r\n--{boundary}--\r\n".encode('ascii'))
+    return b''.join(pieces)
+
+
+@metrics.timed('mime_build')
+def render_message(subject: str, html_body: str, recipients: list[str],
+                   attachments: list[PreparedAttachment] | None = None, to_header: str | None = None) -> bytes:
+    """Serialize a message to the bytes sent over SMTP, splicing in pre-serialized attachments.
+
+    Only the per-recipient headers and HTML body are generated and converted
+    here; attachment parts are copied verbatim from ``PreparedAttachment.wire``,
+    so smtplib has no line endings to fix or text to encode.
+    """
+    head, boundary = render_head(subject, html_body, recipients, to_header)
+    return attach_wire(to_wire(head), boundary, (attachment.wire for attachment in attachments or ()))
+
+def send_email(subject: str, body_html: str, to_emails: list[str], attachment_paths: list[str] | None = None,
+               session: SMTPSession | None = None, attachments: list[PreparedAttachment] | None = None) -> bool:
+    """Send email to one or many recipients. If attachment_paths provided, read and attach files.
+
+    Pass an open ``SMTPSession`` to reuse one authenticated connection across
+    many calls; without it a throwaway session is opened for this message.
+    ``attachments`` takes parts prepared once per campaign.
+    """
 
 
     recipients = to_emails if isinstance(to_emails, list) else [to_emails]
 
 
-    msg = _make_message(subject, body_html, recipients, attachment_paths)
+    msg = render_message(subject, body_html, recipients, load_attachments(attachment_paths) + list(attachments or []))
 
 
     try:
-        server = smtplib.SMTP(SMTP_HOST, SMTP_PORT)
-        server.ehlo()
-        server.starttls()
-        server.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
-        server.sendmail(EMAIL_ADDRESS, recipients, msg.as_string())
-        server.quit()
+        if session is not None:
+            session.sendmail(EMAIL_ADDRESS, recipients, msg)
+        else:
+            with SMTPSession() as own_session:
+                own_session.sendmail(EMAIL_ADDRESS, recipients, msg)
+        metrics.inc('emails_sent_total')
         print('Email sent to:', recipients)
         return True
     except Exception as e:
+        metrics.inc('emails_failed_total', reason='error')
         print('Error sending email:', e)
-        return False
\ No newline at end of file
+        return False
@@ -0,0 +1,236 @@
+import bisect
+import functools
+import json
+import os
+import threading
+import time
+from collections.abc import Callable
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from http.server import ThreadingHTTPServer
+
+
+# Collect timings and counters (off by default; the Diagnostics panel can switch it on)
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+
+# Prefix for exported metric names
+METRICS_NAMESPACE = 'campaign'
+
+# Histogram bucket upper bounds, in seconds
+TIMER_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class _NoopTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_TIMER = _NoopTimer()
+
+
+class _Timer:
+    __slots__ = ('_registry', '_key', '_start')
+
+    def __init__(self, registry: 'MetricsRegistry', key: tuple):
+        self._registry = registry
+        self._key = key
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._registry.observe_key(self._key, time.perf_counter() - self._start)
+        return False
+
+
+def _labels_key(name: str, labels: dict) -> tuple:
+    return (name, tuple(sorted(labels.items()))) if labels else (name, ())
+
+
+class _TimerStats:
+    __slots__ = ('count', 'total', 'max', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * len(TIMER_BUCKETS)
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        i = bisect.bisect_left(TIMER_BUCKETS, seconds)
+        if i < len(self.buckets):
+            self.buckets[i] += 1
+
+
+class MetricsRegistry:
+    """Process-wide timers and counters for the campaign pipeline stages.
+
+    When disabled, ``timer`` hands back a shared no-op context manager and
+    ``inc`` returns after one attribute check, so instrumented code pays
+    next to nothing. Export with ``to_json`` / ``to_prometheus``, ``write``
+    to a file, or ``serve`` over HTTP.
+    """
+
+    def __init__(self, enabled: bool = METRICS_ENABLED, namespace: str = METRICS_NAMESPACE):
+        self.enabled = enabled
+        self.namespace = namespace
+        self._timers: dict[tuple, _TimerStats] = {}
+        self._counters: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+        self._server = None
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self._timers.clear()
+            self._counters.clear()
+
+    def timer(self, name: str, **labels):
+        """``with metrics.timer('smtp_send'):`` records the block's duration."""
+        if not self.enabled:
+            return _NOOP_TIMER
+        return _Timer(self, _labels_key(name, labels))
+
+    def timed(self, name: str, **labels) -> Callable:
+        """Decorator form of ``timer`` for plain (non-generator) functions."""
+        key = _labels_key(name, labels)
+
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return fn(*args, **kwargs)
+                with _Timer(self, key):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def observe(self, name: str, seconds: float, **labels):
+        if self.enabled:
+            self.observe_key(_labels_key(name, labels), seconds)
+
+    def observe_key(self, key: tuple, seconds: float):
+        with self._lock:
+            stats = self._timers.get(key)
+            if stats is None:
+                stats = self._timers[key] = _TimerStats()
+            stats.add(seconds)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        if not self.enabled:
+            return
+        key = _labels_key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def snapshot(self) -> dict:
+        """Current values as plain data: {'timers': [...], 'counters': [...]}."""
+        with self._lock:
+            timers = [
+                {'name': name, 'labels': dict(labels), 'count': s.count, 'total_seconds': s.total,
+                 'mean_seconds': s.total / s.count if s.count else 0.0, 'max_seconds': s.max}
+                for (name, labels), s in sorted(self._timers.items())
+            ]
+            counters = [{'name': name, 'labels': dict(labels), 'value': value}
+                        for (name, labels), value in sorted(self._counters.items())]
+        return {'enabled': self.enabled, 'timers': timers, 'counters': counters}
+
+    def to_json(self) -> str:
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self) -> str:
+        """Prometheus text exposition format: timers as histograms, counters as counters."""
+        lines = []
+        with self._lock:
+            timers = sorted((key, s.count, s.total, list(s.buckets)) for key, s in self._timers.items())
+            counters = sorted(self._counters.items())
+
+        declared = set()
+        for (name, labels), count, total, buckets in timers:
+            metric = f"{self.namespace}_{name}_seconds"
+            if metric not in declared:
+                declared.add(metric)
+                lines.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            for bound, hits in zip(TIMER_BUCKETS, buckets):
+                cumulative += hits
+                lines.append(f"{metric}_bucket{_format_labels(labels, le=bound)} {cumulative}")
+            lines.append(f"{metric}_bucket{_format_labels(labels, le='+Inf')} {count}")
+            lines.append(f"{metric}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{metric}_count{_format_labels(labels)} {count}")
+        for (name, labels), value in counters:
+            metric = f"{self.namespace}_{name}"
+            if metric not in declared:
+                declared.add(metric)
+                lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric}{_format_labels(labels)} {value:g}")
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path: str):
+        """Write a snapshot to ``path``: JSON for .json files, Prometheus text otherwise."""
+        content = self.to_json() if path.endswith('.json') else self.to_prometheus()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+
+    def serve(self, port: int, host: str = '127.0.0.1') -> 'ThreadingHTTPServer':
+        """Serve /metrics (Prometheus text) and /metrics.json from a daemon thread."""
+        if self._server is not None:
+            return self._server
+        # http.server is only needed here; every service imports this module
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path == '/metrics':
+                    body, content_type = registry.to_prometheus(), 'text/plain; version=0.0.4'
+                elif self.path == '/metrics.json':
+                    body, content_type = registry.to_json(), 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                data = body.encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self._server.serve_forever, name='metrics-http', daemon=True).start()
+        return self._server
+
+
+def _escape_label(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels: tuple, **extra) -> str:
+    items = list(labels) + list(extra.items())
+    if not items:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape_label(v)}"' for k, v in items) + '}'
+
+
+metrics = MetricsRegistry()
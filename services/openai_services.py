@@ -1,19 +1,204 @@
+import asyncio
+import hashlib
+import json
 import os
-from openai import OpenAI
+import random
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from collections.abc import AsyncIterator, Iterable, Iterator, Mapping
+from typing import TYPE_CHECKING
 from dotenv import load_dotenv
+from services.metrics_services import metrics
+from services.template_services import AI_FIELDS, is_missing
+
+# The openai SDK (and httpx under it) takes most of a second to import, so it is
+# loaded when the first client is built; scheduling and sending never pay for it.
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI, OpenAI
 
 load_dotenv()
 
-def get_client(provider: str):
+AI_CACHE_DIR = os.getenv('AI_CACHE_DIR', os.path.join('data', 'ai_cache'))
+AI_CACHE_TTL_SECONDS = int(os.getenv('AI_CACHE_TTL_SECONDS', 7 * 24 * 3600))
+AI_CACHE_MAX_BYTES = int(os.getenv('AI_CACHE_MAX_BYTES', 50 * 1024 * 1024))
+
+# Connection pool shared by all generations against the same provider
+AI_HTTP_MAX_CONNECTIONS = int(os.getenv('AI_HTTP_MAX_CONNECTIONS', 32))
+AI_HTTP_MAX_KEEPALIVE = int(os.getenv('AI_HTTP_MAX_KEEPALIVE', 16))
+AI_HTTP_KEEPALIVE_EXPIRY = float(os.getenv('AI_HTTP_KEEPALIVE_EXPIRY', 60))
+AI_HTTP_TIMEOUT = float(os.getenv('AI_HTTP_TIMEOUT', 60))
+AI_HTTP_CONNECT_TIMEOUT = float(os.getenv('AI_HTTP_CONNECT_TIMEOUT', 10))
+
+SYSTEM_PROMPT = """
+        You are a professional marketing copywriter. 
+        You must output a valid JSON object with the following keys:
+        - subject: The email subject line.
+        - title: A catchy headline for the email body (2-5 words).
+        - body: The main persuasive email content (2-3 paragraphs). HTML tags like <br> and <b> are allowed.
+        - cta_text: A short, punchy call-to-action button text (2-4 words).
+        
+        Do not include markdown formatting (like ```json). Just return the raw JSON string.
+        """
+
+class ResponseCache:
+    """
+    Content-addressed cache for generated templates.
+    An in-memory LRU sits in front of a directory of JSON files; disk entries
+    expire after ``ttl`` seconds and the oldest are evicted once the directory
+    grows past ``max_disk_bytes``.
+    """
+
+    def __init__(self, directory: str | None = AI_CACHE_DIR, max_memory_entries: int = 256,
+                 ttl: float = AI_CACHE_TTL_SECONDS, max_disk_bytes: int = AI_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_memory_entries = max_memory_entries
+        self.ttl = ttl
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self._disk_bytes = None  # running estimate, measured on first write
+        self._memory: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(provider: str, model: str, system_prompt: str, prompt: str,
+                 max_tokens: int, temperature: float) -> str:
+        payload = json.dumps([provider, model, system_prompt, prompt, max_tokens, temperature])
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> dict | None:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and now - entry[0] < self.ttl:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                metrics.inc('ai_cache_lookups_total', result='memory_hit')
+                return dict(entry[1])
+        value = self._read_disk(key, now)
+        metrics.inc('ai_cache_lookups_total', result='miss' if value is None else 'disk_hit')
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk_hits += 1
+            self._remember(key, value, now)
+        return dict(value)
+
+    def set(self, key: str, value: dict):
+        now = time.time()
+        with self._lock:
+            self._remember(key, dict(value), now)
+        self._write_disk(key, value)
+
+    def _remember(self, key: str, value: dict, stored_at: float):
+        self._memory[key] = (stored_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _read_disk(self, key: str, now: float) -> dict | None:
+        if not self.directory:
+            return None
+        path = self._path(key)
+        try:
+            if now - os.path.getmtime(path) >= self.ttl:
+                os.remove(path)
+                return None
+            with open(path, 'r', encoding='utf-8') as f:
+                value = json.load(f)
+            # Touch so eviction drops the least recently used entries first
+            os.utime(path)
+            return value
+        except (OSError, ValueError):
+            return None
+
+    def _write_disk(self, key: str, value: dict):
+        if not self.directory:
+            return
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(value, f)
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, path)
+            with self._lock:
+                if self._disk_bytes is not None:
+                    self._disk_bytes += size
+                needs_scan = self._disk_bytes is None or self._disk_bytes > self.max_disk_bytes
+            if needs_scan:
+                self._evict()
+        except OSError as e:
+            print(f"Could not write AI cache entry: {e}")
+
+    def _evict(self):
+        entries = []
+        total = 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+        if total > self.max_disk_bytes:
+            # Drop least recently used files until comfortably under the limit
+            for _, size, path in sorted(entries):
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                if total <= self.max_disk_bytes * 0.9:
+                    break
+        with self._lock:
+            self._disk_bytes = total
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self.hits = self.misses = self.disk_hits = 0
+            self._disk_bytes = None
+        if self.directory and os.path.isdir(self.directory):
+            for root, _, files in os.walk(self.directory):
+                for name in files:
+                    try:
+                        os.remove(os.path.join(root, name))
+                    except OSError:
+                        pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'disk_hits': self.disk_hits,
+                'memory_entries': len(self._memory),
+            }
+
+response_cache = ResponseCache()
+
+def get_provider_config(provider: str) -> tuple[str | None, str | None]:
     """
-    Returns an OpenAI-compatible client based on the selected provider.
+    Returns (api_key, base_url) for the selected provider; base_url None means api.openai.com.
     """
     if provider == "OpenRouter":
         api_key = os.getenv("OPENROUTER_API_KEY")
         base_url = "https://openrouter.ai/api/v1"
         if not api_key:
             raise ValueError("OpenRouter API Key not found in .env")
-        return OpenAI(base_url=base_url, api_key=api_key)
+        return api_key, base_url
     
     elif provider == "Gemini":
         # Using OpenRouter to access Gemini models is often easiest if the user has an OpenRouter key.
@@ -30,63 +215,498 @@ def get_client(provider: str):
         pass
 
     # Default to OpenAI
-    api_key = os.getenv("OPENAI_API_KEY")
-    return OpenAI(api_key=api_key)
+    return os.getenv("OPENAI_API_KEY"), None
 
-def generate_email_template(prompt: str, max_tokens: int = 500, provider: str = "OpenAI", model: str = "gpt-4o-mini") -> dict:
+class ClientRegistry:
+    """
+    Long-lived OpenAI-compatible clients, one per (provider, base_url, api_key).
+
+    Each client owns an httpx pool, so keeping it around lets generations reuse
+    keep-alive connections instead of paying DNS, TCP and TLS setup every time.
+    The registry is module-level, so it outlives Streamlit reruns and is shared
+    by every thread. httpx async pools belong to the event loop that opened
+    them, so async clients are shared per running loop instead.
+    """
+
+    def __init__(self, max_connections: int = AI_HTTP_MAX_CONNECTIONS,
+                 max_keepalive_connections: int = AI_HTTP_MAX_KEEPALIVE,
+                 keepalive_expiry: float = AI_HTTP_KEEPALIVE_EXPIRY,
+                 timeout: float = AI_HTTP_TIMEOUT, connect_timeout: float = AI_HTTP_CONNECT_TIMEOUT):
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self._lock = threading.Lock()
+        self._clients = {}
+        # event loop -> {key: AsyncOpenAI}; entries vanish with their loop
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    def _http_options(self) -> dict:
+        import httpx
+
+        return {
+            'limits': httpx.Limits(max_connections=self.max_connections,
+                                   max_keepalive_connections=self.max_keepalive_connections,
+                                   keepalive_expiry=self.keepalive_expiry),
+            'timeout': httpx.Timeout(self.timeout, connect=self.connect_timeout),
+        }
+
+    def get(self, provider: str) -> 'OpenAI':
+        api_key, base_url = get_provider_config(provider)
+        key = (provider, base_url, api_key)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                from openai import DefaultHttpxClient, OpenAI
+
+                options = self._http_options()
+                client = OpenAI(base_url=base_url, api_key=api_key, timeout=options['timeout'],
+                                http_client=DefaultHttpxClient(**options))
+                self._clients[key] = client
+        return client
+
+    def get_async(self, provider: str) -> 'AsyncOpenAI':
+        """
+        Must be called from a coroutine. Retries are handled by the pipeline (with jitter), not the SDK.
+        """
+        api_key, base_url = get_provider_config(provider)
+        key = (provider, base_url, api_key)
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            clients = self._async_clients.setdefault(loop, {})
+            client = clients.get(key)
+            if client is None:
+                from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+                options = self._http_options()
+                client = AsyncOpenAI(base_url=base_url, api_key=api_key, timeout=options['timeout'], max_retries=0,
+                                     http_client=DefaultAsyncHttpxClient(**options))
+                clients[key] = client
+        return client
+
+    async def aclose_loop(self):
+        """Close the async clients of the running loop; call before the loop shuts down."""
+        with self._lock:
+            clients = self._async_clients.pop(asyncio.get_running_loop(), {})
+        for client in clients.values():
+            await client.close()
+
+    def close(self):
+        """Close the pooled sync clients."""
+        with self._lock:
+            clients, self._clients = self._clients, {}
+        for client in clients.values():
+            client.close()
+
+client_registry = ClientRegistry()
+
+def get_client(provider: str) -> 'OpenAI':
+    """
+    Returns the shared OpenAI-compatible client for the selected provider.
+    """
+    return client_registry.get(provider)
+
+def _strip_fences(content: str) -> str:
+    content = content.strip()
+    # Clean up potential markdown code blocks if the model adds them
+    if content.startswith("```json"):
+        content = content[7:]
+    if content.endswith("```"):
+        content = content[:-3]
+    return content.strip()
+
+def parse_template_content(content: str) -> dict | None:
+    """
+    Parses the model's JSON answer, tolerating ```json fences. Returns None if it is not JSON.
+    """
+    try:
+        return json.loads(_strip_fences(content))
+    except json.JSONDecodeError:
+        return None
+
+def _fallback_template(content: str) -> dict:
+    # Fallback if JSON fails
+    return {
+        "subject": "Exclusive Offer",
+        "title": "Special Update",
+        "body": content, # Return raw text as body
+        "cta_text": "Learn More"
+    }
+
+def _finish_template(content: str, cache: ResponseCache | None, key: str | None) -> dict:
+    data = parse_template_content(content)
+    if data is None:
+        return _fallback_template(_strip_fences(content))
+    # Only well-formed answers are worth keeping
+    if cache is not None:
+        cache.set(key, data)
+    return data
+
+def _error_template(error: Exception) -> dict:
+    return {
+        "subject": "Error",
+        "title": "Error Generating Email",
+        "body": f"An error occurred: {str(error)}",
+        "cta_text": "Retry"
+    }
+
+def generate_email_template(prompt: str, max_tokens: int = 500, provider: str = "OpenAI", model: str = "gpt-4o-mini",
+                            temperature: float = 0.7, cache: ResponseCache | None = response_cache) -> dict:
     """
     Call the selected AI provider and return a structured dictionary for the email template.
     Expected keys: 'subject', 'title', 'body', 'cta_text'
+    Identical requests are answered from ``cache``; pass ``cache=None`` to always call the API.
     """
+    key = None
+    if cache is not None:
+        key = ResponseCache.make_key(provider, model, SYSTEM_PROMPT, prompt, max_tokens, temperature)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
     try:
         client = get_client(provider)
         
-        system_prompt = """
-        You are a professional marketing copywriter. 
-        You must output a valid JSON object with the following keys:
-        - subject: The email subject line.
-        - title: A catchy headline for the email body (2-5 words).
-        - body: The main persuasive email content (2-3 paragraphs). HTML tags like <br> and <b> are allowed.
-        - cta_text: A short, punchy call-to-action button text (2-4 words).
-        
-        Do not include markdown formatting (like ```json). Just return the raw JSON string.
-        """
-        
-        resp = client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=max_tokens,
-            temperature=0.7,
-        )
-
-        content = resp.choices[0].message.content.strip()
-        
-        # Clean up potential markdown code blocks if the model adds them
-        if content.startswith("```json"):
-            content = content[7:]
-        if content.endswith("```"):
-            content = content[:-3]
+        with metrics.timer('ai_generate', provider=provider, mode='blocking'):
+            resp = client.chat.completions.create(
+                model=model,
+                messages=[
+                    {"role": "system", "content": SYSTEM_PROMPT},
+                    {"role": "user", "content": prompt}
+                ],
+                max_tokens=max_tokens,
+                temperature=temperature,
+            )
+        metrics.inc('ai_requests_total', provider=provider, outcome='ok')
+
+        return _finish_template(resp.choices[0].message.content, cache, key)
             
-        import json
+    except Exception as e:
+        metrics.inc('ai_requests_total', provider=provider, outcome='error')
+        return _error_template(e)
+
+_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+class PartialTemplateParser:
+    """
+    Incremental parser for the flat JSON object the model streams back.
+
+    ``feed`` takes raw text as it arrives and returns the fields known so far;
+    the field currently being written is included with its partial value.
+    A leading ```json fence is skipped. If the text turns out not to be a JSON
+    object, ``valid`` becomes False and callers should show the raw text instead.
+    """
+
+    # Characters tolerated before the opening brace (a ```json fence and whitespace)
+    MAX_PREAMBLE = 16
+
+    def __init__(self):
+        self.values = {}
+        self.completed = []
+        self.valid = True
+        self._state = 'start'
+        self._skipped = 0
+        self._key = []
+        self._value = []
+        self._unicode = None
+
+    def feed(self, chunk: str) -> dict:
+        for char in chunk:
+            if not self.valid or self._state == 'done':
+                break
+            self._step(char)
+        if self._state == 'value':
+            self.values[self._current_key] = ''.join(self._value)
+        return dict(self.values)
+
+    @property
+    def _current_key(self) -> str:
+        return ''.join(self._key)
+
+    def _step(self, char: str):
+        state = self._state
+        if state == 'value':
+            if char == '\\':
+                self._state = 'escape'
+            elif char == '"':
+                self.values[self._current_key] = ''.join(self._value)
+                self.completed.append(self._current_key)
+                self._state = 'after_value'
+            else:
+                self._value.append(char)
+        elif state == 'escape':
+            if char == 'u':
+                self._unicode = []
+                self._state = 'unicode'
+            else:
+                self._value.append(_ESCAPES.get(char, char))
+                self._state = 'value'
+        elif state == 'unicode':
+            self._unicode.append(char)
+            if len(self._unicode) == 4:
+                code = int(''.join(self._unicode), 16)
+                if 0xDC00 <= code <= 0xDFFF and self._value and 0xD800 <= ord(self._value[-1]) <= 0xDBFF:
+                    # Second half of a surrogate pair
+                    code = 0x10000 + ((ord(self._value.pop()) - 0xD800) << 10) + (code - 0xDC00)
+                self._value.append(chr(code))
+                self._state = 'value'
+        elif state == 'key':
+            if char == '"':
+                self._state = 'colon'
+            else:
+                self._key.append(char)
+        elif char.isspace():
+            pass
+        elif state == 'start':
+            if char == '{':
+                self._state = 'key_or_end'
+            else:
+                self._skipped += 1
+                self.valid = self._skipped <= self.MAX_PREAMBLE
+        elif state in ('key_or_end', 'after_value'):
+            if char == '"' and state == 'key_or_end':
+                self._key = []
+                self._state = 'key'
+            elif char == ',' and state == 'after_value':
+                self._state = 'key_or_end'
+            elif char == '}':
+                self._state = 'done'
+            else:
+                self.valid = False
+        elif state == 'colon':
+            self.valid = char == ':'
+            self._state = 'value_start'
+        elif state == 'value_start':
+            if char == '"':
+                self._value = []
+                self._state = 'value'
+            else:
+                # Only string values are expected; leave anything else to the final parse
+                self.valid = False
+
+def stream_email_template(prompt: str, max_tokens: int = 500, provider: str = "OpenAI", model: str = "gpt-4o-mini",
+                          temperature: float = 0.7, cache: ResponseCache | None = response_cache) -> Iterator[dict]:
+    """
+    Streaming variant of generate_email_template for a live preview.
+    Yields the fields parsed so far each time new text arrives; the last dict yielded
+    is the finished template, exactly what generate_email_template would return.
+    Providers that reject or ignore ``stream=True`` fall back to a single blocking request.
+    """
+    key = None
+    if cache is not None:
+        key = ResponseCache.make_key(provider, model, SYSTEM_PROMPT, prompt, max_tokens, temperature)
+        cached = cache.get(key)
+        if cached is not None:
+            yield cached
+            return
+
+    request = dict(
+        model=model,
+        messages=[
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ],
+        max_tokens=max_tokens,
+        temperature=temperature,
+    )
+    pieces = []
+    parser = PartialTemplateParser()
+    started = time.perf_counter()
+    try:
+        stream = get_client(provider).chat.completions.create(**request, stream=True)
         try:
-            data = json.loads(content.strip())
-            return data
-        except json.JSONDecodeError:
-            # Fallback if JSON fails
-            return {
-                "subject": "Exclusive Offer",
-                "title": "Special Update",
-                "body": content, # Return raw text as body
-                "cta_text": "Learn More"
-            }
-            
+            for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if not delta:
+                    continue
+                if not pieces:
+                    metrics.observe('ai_first_token', time.perf_counter() - started, provider=provider)
+                pieces.append(delta)
+                partial = parser.feed(delta)
+                yield partial if parser.valid else {"body": ''.join(pieces)}
+        finally:
+            stream.close()
     except Exception as e:
-        return {
-            "subject": "Error",
-            "title": "Error Generating Email",
-            "body": f"An error occurred: {str(e)}",
-            "cta_text": "Retry"
-        }
\ No newline at end of file
+        print(f"Streaming from {provider} failed, retrying without streaming: {e}")
+        pieces = []
+
+    if pieces:
+        metrics.observe('ai_generate', time.perf_counter() - started, provider=provider, mode='stream')
+        metrics.inc('ai_requests_total', provider=provider, outcome='ok')
+        yield _finish_template(''.join(pieces), cache, key)
+        return
+    try:
+        resp = get_client(provider).chat.completions.create(**request)
+        yield _finish_template(resp.choices[0].message.content, cache, key)
+    except Exception as e:
+        yield _error_template(e)
+
+# HTTP statuses worth retrying besides 5xx: timeouts, conflicts and rate limiting
+RETRYABLE_STATUS_CODES = {408, 409, 429}
+
+def get_async_client(provider: str) -> 'AsyncOpenAI':
+    """
+    Async counterpart of get_client, shared within the running event loop.
+    """
+    return client_registry.get_async(provider)
+
+def _is_retryable(error: Exception) -> bool:
+    import openai
+
+    if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in RETRYABLE_STATUS_CODES or error.status_code >= 500
+    return False
+
+def _retry_delay(attempt: int, error: Exception, base: float, cap: float = 30.0) -> float:
+    """Full-jitter exponential backoff, never shorter than the server's Retry-After."""
+    delay = random.uniform(0, min(cap, base * 2 ** attempt))
+    response = getattr(error, 'response', None)
+    if response is not None:
+        try:
+            delay = max(delay, float(response.headers.get('retry-after', 0)))
+        except ValueError:
+            pass
+    return delay
+
+def build_personalized_prompt(base_prompt: str, recipient: Mapping) -> str:
+    """
+    Extends the campaign prompt with one recipient's CSV details (the address itself is not sent).
+    """
+    details = []
+    for key, value in recipient.items():
+        if key == 'email' or key in AI_FIELDS or is_missing(value):
+            continue
+        details.append(f"- {key}: {value}")
+    return (f"{base_prompt.strip()}\n\n"
+            "Write this email specifically for the recipient below. Use their details naturally "
+            "and do not use placeholders like [Name].\n" + "\n".join(details))
+
+async def agenerate_email_template(client: 'AsyncOpenAI', prompt: str, max_tokens: int = 500, provider: str = "OpenAI",
+                                   model: str = "gpt-4o-mini", temperature: float = 0.7, max_retries: int = 5,
+                                   retry_base: float = 0.5, cache: ResponseCache | None = response_cache) -> dict:
+    """
+    Async generate_email_template for the batch pipeline. Retries 429/5xx and connection errors
+    with jittered backoff, and raises once retries are exhausted instead of returning an error template.
+    """
+    key = None
+    if cache is not None:
+        key = ResponseCache.make_key(provider, model, SYSTEM_PROMPT, prompt, max_tokens, temperature)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+    attempt = 0
+    while True:
+        try:
+            with metrics.timer('ai_generate', provider=provider, mode='async'):
+                resp = await client.chat.completions.create(
+                    model=model,
+                    messages=[
+                        {"role": "system", "content": SYSTEM_PROMPT},
+                        {"role": "user", "content": prompt}
+                    ],
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                )
+            metrics.inc('ai_requests_total', provider=provider, outcome='ok')
+            break
+        except Exception as e:
+            if attempt >= max_retries or not _is_retryable(e):
+                metrics.inc('ai_requests_total', provider=provider, outcome='error')
+                raise
+            metrics.inc('ai_retries_total', provider=provider)
+            await asyncio.sleep(_retry_delay(attempt, e, retry_base))
+            attempt += 1
+
+    return _finish_template(resp.choices[0].message.content, cache, key)
+
+async def personalize_stream(recipients: Iterable[Mapping], base_prompt: str, provider: str = "OpenAI",
+                             model: str = "gpt-4o-mini", concurrency: int = 16, client: 'AsyncOpenAI | None' = None,
+                             **generate_kwargs) -> AsyncIterator[tuple[Mapping, dict | None, Exception | None]]:
+    """
+    Generates one template per recipient with at most ``concurrency`` requests in flight.
+    Yields (recipient, template, error) in completion order; recipients are pulled lazily.
+    """
+    if client is None:
+        client = get_async_client(provider)
+
+    async def generate(recipient):
+        prompt = build_personalized_prompt(base_prompt, recipient)
+        try:
+            data = await agenerate_email_template(client, prompt, provider=provider, model=model, **generate_kwargs)
+            return recipient, data, None
+        except Exception as e:
+            return recipient, None, e
+
+    recipients_iter = iter(recipients)
+    pending = set()
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and len(pending) < concurrency:
+                recipient = next(recipients_iter, None)
+                if recipient is None:
+                    exhausted = True
+                    break
+                pending.add(asyncio.ensure_future(generate(recipient)))
+            if not pending:
+                break
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+
+def personalized_record(recipient: Mapping, data: dict) -> dict:
+    """
+    The recipient's CSV fields plus the AI copy under the ai_* keys used by the template slots.
+    """
+    record = dict(recipient)
+    for field in AI_FIELDS:
+        record[field] = data.get(field[3:], '')
+    return record
+
+def personalize_to_queue(queue, campaign_id: str, recipients: Iterable[Mapping], base_prompt: str,
+                         provider: str = "OpenAI", model: str = "gpt-4o-mini", concurrency: int = 16,
+                         flush_every: int = 50, **generate_kwargs) -> dict:
+    """
+    Runs the personalization pipeline and enqueues each recipient on ``queue`` (a SendQueue)
+    as soon as their copy is ready, so sending can start before generation finishes.
+    Recipients whose copy could not be generated are queued as failed with the error,
+    and are generated again when the campaign is re-run.
+    Returns counts of generated and failed recipients.
+    """
+    async def run():
+        counts = {'generated': 0, 'failed': 0}
+        batch = []
+        failures = []
+        try:
+            async for recipient, data, error in personalize_stream(recipients, base_prompt, provider, model,
+                                                                   concurrency, **generate_kwargs):
+                if error is not None:
+                    counts['failed'] += 1
+                    print(f"AI personalization failed for {recipient.get('email')}: {error}")
+                    failures.append((recipient, f"AI personalization failed: {error}"))
+                else:
+                    counts['generated'] += 1
+                    batch.append(personalized_record(recipient, data))
+                if len(batch) >= flush_every:
+                    await asyncio.to_thread(queue.enqueue, campaign_id, batch)
+                    batch = []
+                if len(failures) >= flush_every:
+                    await asyncio.to_thread(queue.enqueue_failed, campaign_id, failures)
+                    failures = []
+            if batch:
+                await asyncio.to_thread(queue.enqueue, campaign_id, batch)
+            if failures:
+                await asyncio.to_thread(queue.enqueue_failed, campaign_id, failures)
+        finally:
+            # asyncio.run closes the loop next, taking its connection pool with it
+            await client_registry.aclose_loop()
+        return counts
+
+    return asyncio.run(run())
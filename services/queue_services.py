@@ -0,0 +1,501 @@
+import csv
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections.abc import Callable, Iterable, Iterator, Mapping
+from typing import BinaryIO
+from dataclasses import dataclass
+from datetime import date, datetime
+from itertools import chain
+
+from services.email_services import PreparedAttachment
+from services.render_services import RENDER_PROCESSES, RenderPool
+from services.send_services import QUOTA, SESSION, SMTP_MAX_RECIPIENTS, SendEngine, SendJob, batch_jobs
+from services.template_services import CompiledTemplate, compile_for_recipients
+
+
+SEND_QUEUE_DB_PATH = os.getenv('SEND_QUEUE_DB_PATH', os.path.join('data', 'send_queue.db'))
+
+# Message states
+PENDING = 'pending'
+SENDING = 'sending'
+SENT = 'sent'
+FAILED = 'failed'
+RETRYING = 'retrying'
+
+REPORT_COLUMNS = ['Email', 'Name', 'Status', 'Timestamp', 'Attempts', 'Error']
+
+# Report formats accepted by SendQueue.write_report
+REPORT_FORMATS = ('csv', 'parquet')
+
+# Rows per batch when streaming a report or looking up statuses by seq (SQLite allows 999 parameters)
+REPORT_BATCH_SIZE = 5000
+_LOOKUP_BATCH = 500
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS campaigns (
+    id TEXT PRIMARY KEY,
+    subject TEXT NOT NULL,
+    html_body TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS campaign_attachments (
+    campaign_id TEXT NOT NULL REFERENCES campaigns(id),
+    position INTEGER NOT NULL,
+    filename TEXT NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (campaign_id, position)
+);
+CREATE TABLE IF NOT EXISTS messages (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    campaign_id TEXT NOT NULL REFERENCES campaigns(id),
+    email TEXT NOT NULL,
+    fields TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    updated_at REAL NOT NULL,
+    UNIQUE (campaign_id, email)
+);
+CREATE INDEX IF NOT EXISTS messages_by_status ON messages (campaign_id, status, seq);
+CREATE INDEX IF NOT EXISTS messages_sent_at ON messages (updated_at) WHERE status = 'sent';
+"""
+
+
+def campaign_id_for(subject: str, html_body: str, attachments: Iterable[tuple[str, bytes]] = (),
+                    variant: str = '', name: str = '') -> str:
+    """Deterministic id, so sending the same campaign again resumes it instead of starting over.
+
+    ``variant`` distinguishes campaigns that share a template but differ elsewhere
+    (e.g. the prompt used for per-recipient AI copy). A new ``name`` starts a new
+    campaign with the same content, e.g. to send an announcement to the same list again.
+    """
+    digest = hashlib.sha256()
+    for piece in (subject, html_body, variant):
+        digest.update(piece.encode('utf-8'))
+        digest.update(b'\0')
+    if name:
+        # Only hashed when set, so ids of unnamed campaigns stay as they were
+        digest.update(b'name\0' + name.encode('utf-8') + b'\0')
+    for filename, data in attachments:
+        digest.update(filename.encode('utf-8'))
+        digest.update(hashlib.sha256(data).digest())
+    return digest.hexdigest()[:16]
+
+
+@dataclass
+class QueuedMessage:
+    seq: int
+    campaign_id: str
+    email: str
+    fields: dict
+    attempts: int
+
+
+class SendQueue:
+    """Persistent per-recipient send state for campaigns.
+
+    Every recipient is a row in SQLite with status pending, sending, sent,
+    failed or retrying. Rows are claimed in insertion order, so a campaign
+    interrupted by a reload or crash resumes exactly where it stopped.
+
+    Per-status counts are read from the table once per campaign and then
+    kept up to date in memory by this instance's own writes, so polling
+    ``counts`` for a progress bar does not scan the campaign's rows.
+    """
+
+    def __init__(self, path: str = SEND_QUEUE_DB_PATH):
+        self.path = path
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._counts: dict[str, dict[str, int]] = {}
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _count(self, campaign_id: str, status: str, delta: int):
+        """Adjust the cached counts, if this campaign's have been loaded. Call with the lock held."""
+        counts = self._counts.get(campaign_id)
+        if counts is not None:
+            counts[status] += delta
+
+    def create_campaign(self, subject: str, html_body: str, attachments: Iterable[tuple[str, bytes]] = (),
+                        variant: str = '', name: str = '') -> str:
+        """Register a campaign (idempotent) and return its id. ``attachments`` are (filename, data) pairs."""
+        attachments = list(attachments)
+        campaign_id = campaign_id_for(subject, html_body, attachments, variant, name)
+        with self._lock, self._conn:
+            cur = self._conn.execute(
+                "INSERT OR IGNORE INTO campaigns (id, subject, html_body, created_at) VALUES (?, ?, ?, ?)",
+                (campaign_id, subject, html_body, time.time()),
+            )
+            if cur.rowcount:
+                self._conn.executemany(
+                    "INSERT INTO campaign_attachments (campaign_id, position, filename, data) VALUES (?, ?, ?, ?)",
+                    [(campaign_id, i, name, data) for i, (name, data) in enumerate(attachments)],
+                )
+        return campaign_id
+
+    def load_campaign(self, campaign_id: str) -> tuple[str, str, tuple[PreparedAttachment, ...]]:
+        """Return (subject, html_body, prepared attachments) for a stored campaign."""
+        with self._lock:
+            row = self._conn.execute("SELECT subject, html_body FROM campaigns WHERE id = ?", (campaign_id,)).fetchone()
+            files = self._conn.execute(
+                "SELECT filename, data FROM campaign_attachments WHERE campaign_id = ? ORDER BY position",
+                (campaign_id,),
+            ).fetchall()
+        if row is None:
+            raise KeyError(f"Unknown campaign {campaign_id}")
+        return row[0], row[1], tuple(PreparedAttachment.from_bytes(name, data) for name, data in files)
+
+    def enqueue(self, campaign_id: str, recipients: Iterable[Mapping], batch_size: int = 5000) -> int:
+        """Add recipients as pending. Addresses already queued for the campaign are left untouched,
+        except ones that failed before any send attempt (see ``enqueue_failed``), which are queued again.
+        """
+        added = 0
+        batch = []
+        now = time.time()
+
+        def flush():
+            nonlocal added
+            with self._lock, self._conn:
+                revived = self._conn.executemany(
+                    "UPDATE messages SET status = ?, fields = ?, last_error = NULL, updated_at = ?"
+                    " WHERE campaign_id = ? AND email = ? AND status = ? AND attempts = 0",
+                    [(PENDING, fields, updated_at, campaign, email, FAILED)
+                     for campaign, email, fields, updated_at in batch],
+                ).rowcount
+                self._count(campaign_id, FAILED, -revived)
+                self._count(campaign_id, PENDING, revived)
+                before = self._conn.total_changes
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO messages (campaign_id, email, fields, updated_at) VALUES (?, ?, ?, ?)",
+                    batch,
+                )
+                changed = self._conn.total_changes - before
+                added += changed
+                self._count(campaign_id, PENDING, changed)
+            batch.clear()
+
+        for recipient in recipients:
+            batch.append((campaign_id, recipient['email'], json.dumps(dict(recipient), default=str), now))
+            if len(batch) >= batch_size:
+                flush()
+        if batch:
+            flush()
+        return added
+
+    def enqueue_failed(self, campaign_id: str, failures: Iterable[tuple[Mapping, str]]) -> int:
+        """Record recipients that failed before sending (e.g. their AI copy could not be written)
+        as (recipient, error) pairs, so they appear in counts and reports. A later ``enqueue`` retries them.
+        """
+        now = time.time()
+        rows = [(campaign_id, recipient['email'], json.dumps(dict(recipient), default=str), FAILED, error, now)
+                for recipient, error in failures]
+        with self._lock, self._conn:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO messages (campaign_id, email, fields, status, last_error, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            added = self._conn.total_changes - before
+            self._count(campaign_id, FAILED, added)
+        return added
+
+    def claim(self, campaign_id: str, limit: int) -> list[QueuedMessage]:
+        """Mark the next ``limit`` pending/retrying messages as sending and return them."""
+        with self._lock, self._conn:
+            rows = self._conn.execute(
+                "SELECT seq, email, fields, attempts, status FROM messages"
+                " WHERE campaign_id = ? AND status IN (?, ?) ORDER BY seq LIMIT ?",
+                (campaign_id, PENDING, RETRYING, limit),
+            ).fetchall()
+            self._conn.executemany(
+                "UPDATE messages SET status = ?, updated_at = ? WHERE seq = ?",
+                [(SENDING, time.time(), row[0]) for row in rows],
+            )
+            for row in rows:
+                self._count(campaign_id, row[4], -1)
+            self._count(campaign_id, SENDING, len(rows))
+        return [QueuedMessage(seq, campaign_id, email, json.loads(fields), attempts)
+                for seq, email, fields, attempts, _ in rows]
+
+    def mark(self, seq: int, status: str, error: str | None = None, attempts: int = 1):
+        self.mark_many([(seq, status, error, attempts)])
+
+    def mark_many(self, updates: Iterable[tuple[int, str, str | None, int]]):
+        """Record outcomes as (seq, status, error, attempts_made) tuples."""
+        updates = list(updates)
+        now = time.time()
+        with self._lock, self._conn:
+            if self._counts:
+                # Look up the statuses being replaced so the cached counts stay exact
+                previous = {}
+                for start in range(0, len(updates), _LOOKUP_BATCH):
+                    seqs = [u[0] for u in updates[start:start + _LOOKUP_BATCH]]
+                    rows = self._conn.execute(
+                        f"SELECT seq, campaign_id, status FROM messages WHERE seq IN ({','.join('?' * len(seqs))})",
+                        seqs,
+                    )
+                    previous.update((seq, (campaign_id, status)) for seq, campaign_id, status in rows)
+                for seq, status, _, _ in updates:
+                    if seq in previous:
+                        campaign_id, old_status = previous.pop(seq)
+                        self._count(campaign_id, old_status, -1)
+                        self._count(campaign_id, status, 1)
+            self._conn.executemany(
+                "UPDATE messages SET status = ?, last_error = ?, attempts = attempts + ?, updated_at = ?"
+                " WHERE seq = ?",
+                [(status, error, attempts, now, seq) for seq, status, error, attempts in updates],
+            )
+
+    def recover(self, campaign_id: str) -> int:
+        """Return messages left in 'sending' by a dead worker to the queue."""
+        with self._lock, self._conn:
+            recovered = self._conn.execute(
+                "UPDATE messages SET status = ? WHERE campaign_id = ? AND status = ?",
+                (RETRYING, campaign_id, SENDING),
+            ).rowcount
+            self._count(campaign_id, SENDING, -recovered)
+            self._count(campaign_id, RETRYING, recovered)
+        return recovered
+
+    def sent_today(self) -> int:
+        """Messages of any campaign delivered since local midnight, for the daily send budget."""
+        midnight = datetime.combine(date.today(), datetime.min.time()).timestamp()
+        with self._lock:
+            # status is written out so the partial index messages_sent_at applies
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM messages WHERE status = 'sent' AND updated_at >= ?", (midnight,)
+            ).fetchone()[0]
+
+    def counts(self, campaign_id: str) -> dict[str, int]:
+        with self._lock:
+            counts = self._counts.get(campaign_id)
+            if counts is None:
+                counts = dict.fromkeys((PENDING, SENDING, SENT, FAILED, RETRYING), 0)
+                counts.update(self._conn.execute(
+                    "SELECT status, COUNT(*) FROM messages WHERE campaign_id = ? GROUP BY status", (campaign_id,)
+                ).fetchall())
+                self._counts[campaign_id] = counts
+            counts = dict(counts)
+        counts['total'] = sum(counts.values())
+        return counts
+
+    def _report_batches(self, campaign_id: str, batch_size: int = REPORT_BATCH_SIZE) -> Iterator[list[tuple]]:
+        """Raw (email, name, status, updated_at, attempts, error) rows in send order, a batch at a time."""
+        last_seq = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT seq, email, fields, status, updated_at, attempts, last_error FROM messages"
+                    " WHERE campaign_id = ? AND seq > ? ORDER BY seq LIMIT ?",
+                    (campaign_id, last_seq, batch_size),
+                ).fetchall()
+            if not rows:
+                return
+            yield [(email, json.loads(fields).get('name', ''), status, updated_at, attempts, error or '')
+                   for _, email, fields, status, updated_at, attempts, error in rows]
+            last_seq = rows[-1][0]
+
+    def iter_report(self, campaign_id: str, batch_size: int = REPORT_BATCH_SIZE) -> Iterator[list]:
+        """Yield report rows (see REPORT_COLUMNS) in send order without loading them all at once."""
+        for batch in self._report_batches(campaign_id, batch_size):
+            for email, name, status, updated_at, attempts, error in batch:
+                timestamp = datetime.fromtimestamp(updated_at).isoformat(sep=' ', timespec='seconds')
+                yield [email, name, status.capitalize(), timestamp, attempts, error]
+
+    def write_report(self, campaign_id: str, destination: str | BinaryIO, fmt: str = 'csv'):
+        """Stream the status report to a path or binary file, batch by batch.
+
+        'csv' matches ``report_csv``; 'parquet' writes one row group per batch
+        with a real timestamp column. A path is written to a temporary file
+        first and moved into place, so a reader never sees a partial report.
+        """
+        if fmt not in REPORT_FORMATS:
+            raise ValueError(f"Unknown report format {fmt!r}; use one of {', '.join(REPORT_FORMATS)}")
+        if not isinstance(destination, str):
+            self._write_report(campaign_id, destination, fmt)
+            return
+        os.makedirs(os.path.dirname(destination) or '.', exist_ok=True)
+        partial = f"{destination}.partial"
+        try:
+            with open(partial, 'wb') as f:
+                self._write_report(campaign_id, f, fmt)
+            os.replace(partial, destination)
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+
+    def _write_report(self, campaign_id: str, f: BinaryIO, fmt: str):
+        if fmt == 'csv':
+            text = io.TextIOWrapper(f, encoding='utf-8', newline='', write_through=True)
+            try:
+                writer = csv.writer(text)
+                writer.writerow(REPORT_COLUMNS)
+                writer.writerows(self.iter_report(campaign_id))
+            finally:
+                # Leave the caller's file open
+                text.detach()
+            return
+
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ValueError("Parquet reports need pyarrow (pip install pyarrow); use csv instead")
+        schema = pa.schema([
+            ('Email', pa.string()), ('Name', pa.string()), ('Status', pa.string()),
+            ('Timestamp', pa.timestamp('s', tz='UTC')), ('Attempts', pa.int32()), ('Error', pa.string()),
+        ])
+        with pq.ParquetWriter(f, schema) as writer:
+            for batch in self._report_batches(campaign_id):
+                emails, names, statuses, stamps, attempts, errors = zip(*batch)
+                writer.write_table(pa.table([
+                    pa.array(emails, pa.string()),
+                    pa.array([str(n) for n in names], pa.string()),
+                    pa.array([s.capitalize() for s in statuses], pa.string()),
+                    pa.array([int(t) for t in stamps], pa.int64()).cast(pa.timestamp('s', tz='UTC')),
+                    pa.array(attempts, pa.int32()),
+                    pa.array(errors, pa.string()),
+                ], schema=schema))
+
+    def report_csv(self, campaign_id: str) -> bytes:
+        """The status report as CSV bytes; prefer write_report for large campaigns."""
+        buffer = io.BytesIO()
+        self.write_report(campaign_id, buffer, 'csv')
+        return buffer.getvalue()
+
+
+class CampaignWorker(threading.Thread):
+    """Drains one campaign from the queue on a background thread.
+
+    The worker is independent of the Streamlit script, so it keeps sending
+    across reruns; progress is read back from ``SendQueue.counts``. When
+    another thread is still filling the queue (AI personalization), pass its
+    ``producer_done`` event and the worker waits for more messages until it is set.
+
+    Consecutive messages that render identically (no per-recipient slots) are
+    sent as one envelope of up to ``max_recipients`` addresses; pass 1 to
+    send every message separately. Personalized messages are rendered on
+    ``render_processes`` processes when that is more than one. Outcomes are
+    written back in one transaction per ``flush_every`` messages or
+    ``flush_interval`` seconds, whichever comes first. The daily send budget
+    starts from the messages the queue recorded as sent today; when it runs out
+    the worker stops claiming, leaves the unsent messages
+    pending and sets ``budget_exhausted``. A failure of the SMTP session itself
+    (e.g. a rejected login) stops it the same way and sets ``error``.
+    """
+
+    def __init__(self, queue: SendQueue, campaign_id: str, engine_factory: Callable[[], SendEngine] = SendEngine,
+                 batch_size: int = 200, flush_every: int = 500, flush_interval: float = 1.0,
+                 producer_done: threading.Event | None = None,
+                 poll_interval: float = 0.5, max_recipients: int = SMTP_MAX_RECIPIENTS,
+                 render_processes: int = RENDER_PROCESSES):
+        super().__init__(name=f"campaign-{campaign_id}", daemon=True)
+        self.queue = queue
+        self.campaign_id = campaign_id
+        self.engine_factory = engine_factory
+        self.batch_size = batch_size
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.producer_done = producer_done
+        self.poll_interval = poll_interval
+        self.max_recipients = max_recipients
+        self.render_processes = render_processes
+        self.error: Exception | None = None
+        self.budget_exhausted = False
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        """Finish the current batch, then stop. Unsent messages stay queued for a later resume."""
+        self._stop_event.set()
+
+    def _messages(self) -> Iterator[QueuedMessage]:
+        """Claim messages batch by batch as they are asked for."""
+        while not self._stop_event.is_set():
+            producer_finished = self.producer_done is None or self.producer_done.is_set()
+            messages = self.queue.claim(self.campaign_id, self.batch_size)
+            if not messages:
+                if producer_finished:
+                    return
+                self._stop_event.wait(self.poll_interval)
+                continue
+            yield from messages
+
+    def _jobs(self, subject_text: str, html_body: str,
+              attachments: tuple[PreparedAttachment, ...]) -> Iterator[SendJob]:
+        """Turn claimed messages into jobs as the engine asks for more."""
+        messages = self._messages()
+        first = next(messages, None)
+        if first is None:
+            return
+        messages = chain([first], messages)
+        fields = first.fields.keys()
+        subject = CompiledTemplate.compile(subject_text, fields)
+        body = compile_for_recipients(html_body, fields)
+        if self.render_processes > 1 and (subject.slot_names or body.slot_names):
+            pool = RenderPool(subject, body, attachments, processes=self.render_processes)
+            yield from pool.render((message, message.fields) for message in messages)
+            return
+        for message in messages:
+            yield SendJob(
+                to_addrs=[message.email],
+                subject=subject.render(message.fields),
+                html_body=body.render(message.fields),
+                attachments=attachments,
+                ref=message,
+            )
+
+    def run(self):
+        updates = []
+        try:
+            self.queue.recover(self.campaign_id)
+            engine = self.engine_factory()
+            if engine.budget.limit is not None:
+                # Runs earlier today (another process, or before a restart) used the same daily cap
+                engine.budget.seed(self.queue.sent_today())
+            flushed_at = time.monotonic()
+            jobs = batch_jobs(self._jobs(*self.queue.load_campaign(self.campaign_id)), self.max_recipients,
+                              domain_limits=engine.domain_limits)
+            for result in engine.run(jobs):
+                if result.failure in (QUOTA, SESSION):
+                    # Out of today's budget, or the server will not take mail from us at all: keep these
+                    # queued and stop claiming, so a later run resumes once the cause is fixed
+                    if result.failure == QUOTA:
+                        self.budget_exhausted = True
+                    elif self.error is None:
+                        self.error = RuntimeError(f"SMTP session refused: {result.error}")
+                    self.stop()
+                    updates.extend((result.job.ref[address].seq, PENDING, result.error, result.attempts)
+                                   for address in result.job.to_addrs)
+                    continue
+                for address in result.job.to_addrs:
+                    ok, error = result.recipient_status(address)
+                    updates.append((result.job.ref[address].seq, SENT if ok else FAILED, error,
+                                    max(1, result.attempts)))
+                if len(updates) >= self.flush_every or time.monotonic() - flushed_at >= self.flush_interval:
+                    self.queue.mark_many(updates)
+                    updates = []
+                    flushed_at = time.monotonic()
+        except Exception as e:
+            self.error = e
+            print(f"Campaign {self.campaign_id} worker stopped: {e}")
+        finally:
+            # Delivered messages left in 'sending' would be sent again after recover()
+            try:
+                self.queue.mark_many(updates)
+            except Exception as e:
+                self.error = self.error or e
+                print(f"Campaign {self.campaign_id} could not record {len(updates)} outcomes: {e}")
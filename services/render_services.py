@@ -0,0 +1,110 @@
+import multiprocessing
+import os
+from collections import deque
+from collections.abc import Iterable, Iterator, Mapping
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from services.email_services import PreparedAttachment, render_head, to_wire
+from services.metrics_services import metrics
+from services.send_services import SendJob
+from services.template_services import CompiledTemplate
+
+
+# Processes rendering personalized messages; 1 renders on the sending thread as before
+RENDER_PROCESSES = int(os.getenv('RENDER_PROCESSES', 1))
+
+# Recipients handed to a render process at a time
+RENDER_BATCH_SIZE = int(os.getenv('RENDER_BATCH_SIZE', 64))
+
+# Forking a process that already runs sender threads is unsafe, so start clean interpreters
+RENDER_START_METHOD = os.getenv(
+    'RENDER_START_METHOD',
+    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn',
+)
+
+# Set in each render process by _init_process
+_templates: tuple[CompiledTemplate, CompiledTemplate] | None = None
+
+
+def _init_process(subject: CompiledTemplate, body: CompiledTemplate):
+    global _templates
+    _templates = (subject, body)
+
+
+def render_heads(records: list[Mapping], subject: CompiledTemplate,
+                 body: CompiledTemplate) -> list[tuple[bytes, str]]:
+    """Per-recipient work in wire form: (message up to the attachments, MIME boundary) for each record.
+
+    A record that cannot be rendered gets (None, error message) instead, so it fails on its own.
+    """
+    subjects = subject.render_many(records)
+    bodies = body.render_many(records)
+    heads = []
+    for record, s, b in zip(records, subjects, bodies):
+        try:
+            head, boundary = render_head(s, b, [record['email']])
+            heads.append((to_wire(head), boundary))
+        except Exception as e:
+            heads.append((None, f"Could not render message: {e}"))
+    return heads
+
+
+def _render_in_process(records: list[Mapping]) -> list[tuple[bytes, str]]:
+    return render_heads(records, *_templates)
+
+
+class RenderPool:
+    """Renders personalized messages to wire bytes on a pool of processes.
+
+    The compiled templates are sent to each process once when it starts;
+    after that recipient fields go over in batches of ``batch_size`` and the
+    personalized part of each message comes back in wire form. Attachments
+    never cross: jobs carry the head and the shared attachments, and the
+    engine splices the attachment wire bytes in as it sends (a copy rather
+    than a second base64 pass), so jobs queued ahead of the senders stay
+    small. At most ``max_pending`` batches are rendered ahead of the
+    consumer, so when the SMTP senders fall behind, rendering waits.
+    """
+
+    def __init__(self, subject: CompiledTemplate, body: CompiledTemplate,
+                 attachments: Iterable[PreparedAttachment] = (), processes: int = RENDER_PROCESSES,
+                 batch_size: int = RENDER_BATCH_SIZE, max_pending: int | None = None,
+                 start_method: str = RENDER_START_METHOD):
+        self.subject = subject
+        self.body = body
+        self.attachments = tuple(attachments)
+        self.processes = max(1, processes)
+        self.batch_size = max(1, batch_size)
+        self.max_pending = max_pending or self.processes * 2
+        self.start_method = start_method
+
+    def render(self, records: Iterable[tuple[object, Mapping]]) -> Iterator[SendJob]:
+        """Turn (ref, fields) pairs into SendJobs carrying pre-rendered message heads, in input order."""
+        records = iter(records)
+        pending = deque()
+        with ProcessPoolExecutor(self.processes, mp_context=multiprocessing.get_context(self.start_method),
+                                 initializer=_init_process, initargs=(self.subject, self.body)) as pool:
+            try:
+                while True:
+                    while len(pending) < self.max_pending:
+                        batch = list(islice(records, self.batch_size))
+                        if not batch:
+                            break
+                        refs = [ref for ref, _ in batch]
+                        fields = [dict(f) for _, f in batch]
+                        pending.append((refs, fields, pool.submit(_render_in_process, fields)))
+                    if not pending:
+                        return
+                    refs, fields, future = pending.popleft()
+                    with metrics.timer('render_wait'):
+                        heads = future.result()
+                    for ref, record, (head, boundary) in zip(refs, fields, heads):
+                        if head is None:
+                            yield SendJob([record['email']], '', '', ref=ref, render_error=boundary)
+                        else:
+                            yield SendJob([record['email']], '', '', self.attachments, ref=ref,
+                                          payload=head, boundary=boundary)
+            finally:
+                for _, _, future in pending:
+                    future.cancel()
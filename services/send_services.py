@@ -0,0 +1,753 @@
+import heapq
+import itertools
+import os
+import random
+import smtplib
+import threading
+import time
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator, Mapping
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dataclasses import dataclass, field, replace
+from datetime import date
+
+from services.email_services import (
+    EMAIL_ADDRESS, SMTP_HOST, SMTP_PORT, SMTPSession, PreparedAttachment, attach_wire, render_message,
+)
+from services.metrics_services import metrics
+from services.suppression_services import BOUNCE, SuppressionList
+
+
+SMTP_MAX_CONNECTIONS = int(os.getenv('SMTP_MAX_CONNECTIONS', 4))
+
+# RCPT TOs per envelope when identical messages are batched (RFC 5321 servers accept at least 100)
+SMTP_MAX_RECIPIENTS = int(os.getenv('SMTP_MAX_RECIPIENTS', 100))
+
+# To header of batched messages, so recipients do not see each other
+BATCH_TO_HEADER = 'undisclosed-recipients:;'
+
+# Jobs read ahead of sending so other domains can go while a throttled one waits
+SMTP_DOMAIN_LOOKAHEAD = int(os.getenv('SMTP_DOMAIN_LOOKAHEAD', 500))
+
+# Permanent replies that reject the recipient itself (no such mailbox, not local, bad address)
+BOUNCE_SMTP_CODES = {550, 551, 553}
+
+# Replies that refuse the connection or account rather than one message
+# (STARTTLS or authentication required, credentials rejected, encryption required)
+SESSION_SMTP_CODES = {530, 534, 535, 538}
+
+# Failure classes carried on SendResult.failure
+TRANSIENT = 'transient'
+BOUNCED = 'bounce'
+PERMANENT = 'permanent'
+QUOTA = 'quota'
+SESSION = 'session'
+
+# Longest wait between attempts of one message, in seconds
+MAX_RETRY_DELAY = 300.0
+
+
+@dataclass(frozen=True)
+class RateLimit:
+    """Sending budget for one SMTP host."""
+    per_second: float
+    per_day: int | None = None
+    burst: int = 1
+
+
+# Conservative defaults for common providers; override with SMTP_RATE_PER_SECOND / SMTP_DAILY_LIMIT
+PROVIDER_RATE_LIMITS = {
+    'smtp.gmail.com': RateLimit(per_second=1.0, per_day=2000, burst=5),
+    'smtp.office365.com': RateLimit(per_second=0.5, per_day=10000, burst=5),
+}
+DEFAULT_RATE_LIMIT = RateLimit(per_second=5.0, per_day=None, burst=10)
+
+
+def get_rate_limit(host: str) -> RateLimit:
+    """Return the rate limit for an SMTP host, applying environment overrides."""
+    limit = PROVIDER_RATE_LIMITS.get(host.lower(), DEFAULT_RATE_LIMIT)
+    per_second = os.getenv('SMTP_RATE_PER_SECOND')
+    per_day = os.getenv('SMTP_DAILY_LIMIT')
+    if per_second or per_day:
+        limit = RateLimit(
+            per_second=float(per_second) if per_second else limit.per_second,
+            per_day=int(per_day) if per_day else limit.per_day,
+            burst=limit.burst,
+        )
+    return limit
+
+
+class TokenBucket:
+    """Thread-safe token bucket; ``acquire`` blocks until a token is available."""
+
+    def __init__(self, rate: float, capacity: int = 1, clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self._tokens = float(self.capacity)
+        self._clock = clock
+        self._sleep = sleep
+        self._last = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait_for = (1 - self._tokens) / self.rate
+            self._sleep(wait_for)
+
+
+class DailyBudget:
+    """Counts sends per calendar day and refuses once the limit is reached."""
+
+    def __init__(self, limit: int | None, today: Callable[[], date] = date.today):
+        self.limit = limit
+        self._today = today
+        self._day = today()
+        self._used = 0
+        self._lock = threading.Lock()
+
+    def _roll(self):
+        """Start a fresh count when the day has changed. Call with the lock held."""
+        day = self._today()
+        if day != self._day:
+            self._day, self._used = day, 0
+
+    def seed(self, used: int):
+        """Count ``used`` sends already made today elsewhere (other processes, earlier runs).
+
+        Sends recorded there include this process's own, so the count is raised to
+        ``used`` rather than added to.
+        """
+        with self._lock:
+            self._roll()
+            self._used = max(self._used, used)
+
+    def take(self, count: int = 1) -> int:
+        """Take up to ``count`` sends from today's budget; returns how many were granted."""
+        if self.limit is None:
+            return count
+        with self._lock:
+            self._roll()
+            granted = max(0, min(count, self.limit - self._used))
+            self._used += granted
+            return granted
+
+
+_limiters: dict[tuple[str, RateLimit], tuple[TokenBucket, DailyBudget]] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(host: str, rate_limit: RateLimit | None = None) -> tuple[TokenBucket, DailyBudget]:
+    """Return the shared (bucket, daily budget) pair for a host so every engine respects the same quota.
+
+    Engines share a pair when they use the same limit for the host; an explicit
+    ``rate_limit`` that differs from the host's default gets a pair of its own.
+    """
+    host = host.lower()
+    limit = rate_limit or get_rate_limit(host)
+    with _limiters_lock:
+        key = (host, limit)
+        if key not in _limiters:
+            _limiters[key] = (TokenBucket(limit.per_second, limit.burst), DailyBudget(limit.per_day))
+        return _limiters[key]
+
+
+@dataclass(frozen=True)
+class DomainLimit:
+    """Caps for one recipient domain: messages in flight and messages per second (None for no cap)."""
+    concurrency: int | None = None
+    per_second: float | None = None
+
+
+# Conservative defaults for the big mailbox providers; override with SMTP_DOMAIN_LIMITS
+DOMAIN_LIMITS = {
+    'gmail.com': DomainLimit(concurrency=2, per_second=2.0),
+    'googlemail.com': DomainLimit(concurrency=2, per_second=2.0),
+    'yahoo.com': DomainLimit(concurrency=1, per_second=1.0),
+    'outlook.com': DomainLimit(concurrency=2, per_second=1.0),
+    'hotmail.com': DomainLimit(concurrency=2, per_second=1.0),
+    'live.com': DomainLimit(concurrency=2, per_second=1.0),
+}
+
+
+def parse_domain_limits(spec: str) -> dict[str, DomainLimit]:
+    """Parse 'gmail.com=2:1.5,yahoo.com=1' (domain=concurrency[:per_second]); 0 or empty means no cap."""
+    limits = {}
+    for entry in filter(None, (e.strip() for e in spec.split(','))):
+        domain, _, caps = entry.partition('=')
+        concurrency, _, per_second = caps.partition(':')
+        limits[domain.strip().lower()] = DomainLimit(
+            concurrency=(int(concurrency) or None) if concurrency.strip() else None,
+            per_second=(float(per_second) or None) if per_second.strip() else None,
+        )
+    return limits
+
+
+def get_domain_limits(overrides: Mapping[str, DomainLimit] | None = None) -> dict[str, DomainLimit]:
+    """DOMAIN_LIMITS with SMTP_DOMAIN_LIMITS from the environment and then ``overrides`` applied."""
+    limits = dict(DOMAIN_LIMITS)
+    limits.update(parse_domain_limits(os.getenv('SMTP_DOMAIN_LIMITS', '')))
+    limits.update({domain.lower(): limit for domain, limit in (overrides or {}).items()})
+    return limits
+
+
+def recipient_domain(address: str) -> str:
+    return address.rpartition('@')[2].strip().lower()
+
+
+@dataclass
+class SendJob:
+    """One message to deliver. ``ref`` is an opaque handle for the caller (e.g. the recipient record).
+
+    ``attachments`` should be the same prepared parts for every job of a
+    campaign so they are encoded only once. Several ``to_addrs`` share one
+    SMTP transaction; ``to_header`` then keeps them out of the To header.
+    A ``payload`` rendered ahead of time (see render_services) is sent as-is,
+    and ``subject`` and ``html_body`` are then ignored. With ``boundary`` set
+    the payload is only the message head in wire form and ``attachments`` are
+    spliced in when it is sent, so jobs waiting in the engine stay small. A job
+    whose message could not be rendered carries ``render_error`` and is
+    reported as a PERMANENT failure without being sent.
+    """
+    to_addrs: list[str]
+    subject: str
+    html_body: str
+    attachments: tuple[PreparedAttachment, ...] = ()
+    ref: object = None
+    to_header: str | None = None
+    payload: str | bytes | None = None
+    boundary: str | None = None
+    render_error: str | None = None
+
+
+def batch_jobs(jobs: Iterable[SendJob], max_recipients: int = SMTP_MAX_RECIPIENTS,
+               window: int = SMTP_DOMAIN_LOOKAHEAD,
+               domain_limits: Mapping[str, DomainLimit] | None = None) -> Iterator[SendJob]:
+    """Merge jobs with identical content into multi-recipient envelopes.
+
+    Each envelope is throttled as a whole under its first address's domain, so
+    addresses at a domain with caps in ``domain_limits`` (default:
+    get_domain_limits()) get envelopes of their own, while every uncapped
+    domain shares one group. Up to ``window`` addresses are held while
+    envelopes fill, after which the oldest partial envelope goes out.
+    Personalized and pre-rendered jobs come out one per recipient as before.
+    Every job yielded has ``ref`` set to a dict of address -> the original
+    job's ref, so callers can map per-address outcomes back (see
+    ``SendResult.recipient_status``).
+    """
+    limits = get_domain_limits() if domain_limits is None else domain_limits
+    capped = {domain for domain, limit in limits.items() if limit.concurrency or limit.per_second}
+    # capped domain (or '' for all the others) -> (jobs, address -> ref) for the content being batched
+    groups: dict[str, tuple[list[SendJob], dict[str, object]]] = {}
+    held = 0
+
+    def envelope(group: list[SendJob], refs: dict[str, object]) -> SendJob:
+        first = group[0]
+        if len(group) == 1 and len(first.to_addrs) == 1:
+            return replace(first, ref=dict(refs))
+        return replace(first, to_addrs=list(refs), ref=dict(refs), to_header=BATCH_TO_HEADER)
+
+    for job in jobs:
+        if groups:
+            first = next(iter(groups.values()))[0][0]
+            same = (job.payload is None and first.payload is None and job.render_error is None
+                    and first.render_error is None and job.html_body == first.html_body
+                    and job.subject == first.subject and job.attachments == first.attachments)
+            if not same:
+                for group, refs in groups.values():
+                    yield envelope(group, refs)
+                groups, held = {}, 0
+        domain = recipient_domain(job.to_addrs[0])
+        if domain not in capped:
+            domain = ''
+        group, refs = groups.pop(domain, ([], {}))
+        if group and (len(refs) + len(job.to_addrs) > max_recipients
+                      or any(address in refs for address in job.to_addrs)):
+            yield envelope(group, refs)
+            held -= len(refs)
+            group, refs = [], {}
+        group.append(job)
+        for address in job.to_addrs:
+            refs[address] = job.ref
+        held += len(job.to_addrs)
+        if len(refs) >= max_recipients:
+            yield envelope(group, refs)
+            held -= len(refs)
+        else:
+            groups[domain] = (group, refs)
+        while held > window and groups:
+            group, refs = groups.pop(next(iter(groups)))
+            yield envelope(group, refs)
+            held -= len(refs)
+    for group, refs in groups.values():
+        yield envelope(group, refs)
+
+
+@dataclass
+class SendResult:
+    """Outcome of one job. Failed results carry the SMTP reply code (when the server gave one)
+    and the failure class: TRANSIENT, BOUNCED, PERMANENT, QUOTA or SESSION."""
+    job: SendJob
+    ok: bool
+    error: str | None = None
+    attempts: int = 0
+    finished_at: float = field(default_factory=time.time)
+    smtp_code: int | None = None
+    failure: str | None = None
+    # Addresses the server turned away at RCPT TO: address -> (code, message)
+    refused: dict[str, tuple[int, bytes]] = field(default_factory=dict)
+
+    def recipient_status(self, address: str) -> tuple[bool, str | None]:
+        """(delivered, error) for one address of the job."""
+        if address in self.refused:
+            code, message = self.refused[address]
+            return False, f"{code} {message!r}"
+        return self.ok, self.error
+
+
+def reply_class(code: int) -> str:
+    """Failure class of an SMTP reply rejecting a recipient."""
+    if 400 <= code < 500:
+        return TRANSIENT
+    return BOUNCED if code in BOUNCE_SMTP_CODES else PERMANENT
+
+
+def classify_failure(error: Exception) -> tuple[int | None, str]:
+    """Return (SMTP code, failure class) for an exception raised while sending.
+
+    4xx replies, dropped connections and network errors are TRANSIENT. Only
+    5xx refusals at RCPT TO can be BOUNCED. 5xx replies refusing the session
+    itself (login failed, sender refused at MAIL FROM, STARTTLS required) are
+    SESSION: every other message would fail the same way. Anything else, such
+    as content rejected at DATA, is PERMANENT for that message only.
+    """
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        replies = list(error.recipients.values())
+        if not replies:
+            return None, PERMANENT
+        return replies[0][0], reply_class(replies[0][0])
+    if isinstance(error, smtplib.SMTPResponseException):
+        code = error.smtp_code
+        if 400 <= code < 500:
+            return code, TRANSIENT
+        if isinstance(error, (smtplib.SMTPAuthenticationError, smtplib.SMTPSenderRefused, smtplib.SMTPHeloError)) \
+                or code in SESSION_SMTP_CODES:
+            return code, SESSION
+        return code, PERMANENT
+    if isinstance(error, smtplib.SMTPNotSupportedError):
+        # The server cannot do STARTTLS or AUTH as configured
+        return None, SESSION
+    if isinstance(error, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, OSError)):
+        return None, TRANSIENT
+    return None, PERMANENT
+
+
+def retry_delay(attempt: int, base: float, cap: float = MAX_RETRY_DELAY) -> float:
+    """Exponential backoff with jitter: between half and all of ``base * 2 ** (attempt - 1)``, capped."""
+    delay = min(cap, base * 2 ** max(0, attempt - 1))
+    return random.uniform(delay / 2, delay)
+
+
+class RetryScheduler:
+    """Min-heap of items keyed on their next attempt time.
+
+    Owned by one send loop, so it is not locked. ``pop_due`` returns every
+    item whose time has come; ``next_delay`` says how long until the next one.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self._clock = clock
+        self._heap: list[tuple[float, int, object]] = []
+        self._order = itertools.count()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def schedule(self, item, delay: float):
+        heapq.heappush(self._heap, (self._clock() + delay, next(self._order), item))
+
+    def drain(self) -> list:
+        """Remove and return every item, due or not, in due order."""
+        items = [item for _, _, item in sorted(self._heap)]
+        self._heap = []
+        return items
+
+    def pop_due(self) -> list:
+        now = self._clock()
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            due.append(heapq.heappop(self._heap)[2])
+        return due
+
+    def next_delay(self) -> float | None:
+        """Seconds until the earliest item is due (0 if overdue), or None when empty."""
+        if not self._heap:
+            return None
+        return max(0.0, self._heap[0][0] - self._clock())
+
+
+class _DomainState:
+    __slots__ = ('limit', 'queue', 'listed', 'in_flight', 'concurrency', 'ceiling', 'rate', 'next_at')
+
+    def __init__(self, limit: DomainLimit, default_concurrency: int):
+        self.limit = limit
+        self.queue = deque()
+        self.listed = False
+        self.in_flight = 0
+        self.ceiling = float(limit.concurrency or default_concurrency)
+        self.concurrency = self.ceiling
+        self.rate = limit.per_second
+        self.next_at = 0.0
+
+
+class DomainScheduler:
+    """Hands out queued items round-robin across recipient domains under per-domain caps.
+
+    A domain is skipped while it has ``concurrency`` items in flight or its
+    ``per_second`` pacing says wait. Caps adapt to the domain's answers:
+    a 4xx deferral halves its concurrency and rate, and every accepted
+    message wins a little back, up to the configured limit. Like
+    RetryScheduler, it is owned by one send loop and not locked.
+    """
+
+    def __init__(self, limits: Mapping[str, DomainLimit] | None = None, default_concurrency: int = 1,
+                 clock: Callable[[], float] = time.monotonic):
+        self.limits = dict(limits or {})
+        self.default_concurrency = max(1, default_concurrency)
+        self._clock = clock
+        self._states: dict[str, _DomainState] = {}
+        self._active: deque[str] = deque()
+        self._queued = 0
+
+    def __len__(self):
+        return self._queued
+
+    def _state(self, domain: str) -> _DomainState:
+        state = self._states.get(domain)
+        if state is None:
+            state = self._states[domain] = _DomainState(self.limits.get(domain, DomainLimit()),
+                                                        self.default_concurrency)
+        return state
+
+    def push(self, domain: str, item, front: bool = False):
+        state = self._state(domain)
+        if front:
+            state.queue.appendleft(item)
+        else:
+            state.queue.append(item)
+        self._queued += 1
+        if not state.listed:
+            state.listed = True
+            self._active.append(domain)
+
+    def pop_ready(self) -> tuple[str, object] | None:
+        """The next (domain, item) allowed to start, rotating through domains, or None."""
+        now = self._clock()
+        for _ in range(len(self._active)):
+            domain = self._active.popleft()
+            state = self._states[domain]
+            if not state.queue:
+                state.listed = False
+                continue
+            self._active.append(domain)
+            if state.in_flight >= int(state.concurrency) or now < state.next_at:
+                continue
+            state.in_flight += 1
+            if state.rate:
+                state.next_at = max(now, state.next_at) + 1 / state.rate
+            self._queued -= 1
+            return domain, state.queue.popleft()
+        return None
+
+    def drain(self) -> list:
+        """Remove and return every queued item, domain by domain."""
+        items = []
+        for state in self._states.values():
+            items.extend(state.queue)
+            state.queue.clear()
+        self._queued = 0
+        return items
+
+    def release(self, domain: str):
+        """Give back the slot of an item from ``domain`` that was not sent after all."""
+        state = self._state(domain)
+        state.in_flight = max(0, state.in_flight - 1)
+
+    def next_delay(self) -> float | None:
+        """Seconds until a domain held back only by its pacing may send, or None."""
+        now = self._clock()
+        delays = [state.next_at - now for state in map(self._states.get, self._active)
+                  if state.queue and state.in_flight < int(state.concurrency) and state.next_at > now]
+        return min(delays) if delays else None
+
+    def finished(self, domain: str, deferred: bool = False):
+        """Record the outcome of an item from ``domain``; ``deferred`` for a 4xx reply."""
+        state = self._state(domain)
+        state.in_flight = max(0, state.in_flight - 1)
+        limit = state.limit
+        if deferred:
+            state.concurrency = max(1.0, min(state.concurrency, state.in_flight + 1) / 2)
+            if state.rate:
+                state.rate = max(limit.per_second / 16, state.rate / 2)
+            metrics.inc('smtp_domain_deferrals_total', domain=domain if domain in self.limits else 'other')
+        else:
+            state.concurrency = min(state.ceiling, state.concurrency + 1 / state.concurrency)
+            if state.rate:
+                state.rate = min(limit.per_second, state.rate + limit.per_second / 20)
+
+    def caps(self, domain: str) -> tuple[float, float | None]:
+        """Current (concurrency, per-second) caps for a domain."""
+        state = self._state(domain)
+        return state.concurrency, state.rate
+
+
+class SendEngine:
+    """Delivers jobs over several pooled SMTP connections under a per-host rate limit.
+
+    Each worker thread owns one ``SMTPSession``. Results are yielded from
+    ``run`` on the calling thread as they complete, so callers such as the
+    Streamlit app can update their progress bar safely.
+
+    Workers make one attempt per job. Transient failures go to a
+    ``RetryScheduler`` and are resubmitted once their backoff has passed,
+    so waiting messages never hold up a connection. Bounced addresses are
+    added to ``suppression`` when one is given.
+
+    Up to ``lookahead`` jobs are read ahead and started through a
+    ``DomainScheduler``, so recipient domains take turns under their
+    ``domain_limits`` (see get_domain_limits) instead of going out in list order.
+    """
+
+    def __init__(self, workers: int = SMTP_MAX_CONNECTIONS, host: str | None = None, port: int | None = None,
+                 rate_limit: RateLimit | None = None, max_retries: int = 3, backoff_base: float = 2.0,
+                 session_factory: Callable[[], SMTPSession] | None = None,
+                 suppression: SuppressionList | None = None,
+                 domain_limits: Mapping[str, DomainLimit] | None = None, lookahead: int = SMTP_DOMAIN_LOOKAHEAD,
+                 sleep: Callable[[float], None] = time.sleep, clock: Callable[[], float] = time.monotonic):
+        self.workers = max(1, workers)
+        self.host = host or SMTP_HOST
+        self.port = port or SMTP_PORT
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.suppression = suppression
+        self.domain_limits = get_domain_limits(domain_limits)
+        self.lookahead = max(1, lookahead)
+        self.bucket, self.budget = get_limiter(self.host, rate_limit)
+        self._session_factory = session_factory or (lambda: SMTPSession(self.host, self.port))
+        self._sleep = sleep
+        self._clock = clock
+        self._local = threading.local()
+        self._sessions: list[SMTPSession] = []
+        self._sessions_lock = threading.Lock()
+
+    def _session(self) -> SMTPSession:
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._session_factory()
+            self._local.session = session
+            with self._sessions_lock:
+                self._sessions.append(session)
+        return session
+
+    def _deliver(self, job: SendJob, attempts: int = 0) -> SendResult:
+        """Make one attempt. The message is built here, so only jobs being sent hold a full payload."""
+        if job.render_error is not None:
+            return SendResult(job, False, job.render_error, attempts, failure=PERMANENT)
+        payload = job.payload
+        if payload is None:
+            try:
+                payload = render_message(job.subject, job.html_body, job.to_addrs, job.attachments, job.to_header)
+            except Exception as e:
+                # Bad recipient data (e.g. a newline in a field filling the subject) fails only this job
+                return SendResult(job, False, f"Could not render message: {e}", attempts, failure=PERMANENT)
+        elif job.boundary is not None:
+            payload = attach_wire(payload, job.boundary, (attachment.wire for attachment in job.attachments))
+        with metrics.timer('rate_limit_wait'):
+            self.bucket.acquire()
+        attempts += 1
+        session = self._session()
+        try:
+            refused = session.sendmail(EMAIL_ADDRESS, job.to_addrs, payload)
+            return SendResult(job, True, None, attempts, refused=dict(refused or {}))
+        except smtplib.SMTPRecipientsRefused as e:
+            # Every address was turned away, possibly for different reasons
+            code, failure = classify_failure(e)
+            return SendResult(job, False, "All recipients refused", attempts, smtp_code=code, failure=failure,
+                              refused=dict(e.recipients))
+        except Exception as e:
+            code, failure = classify_failure(e)
+            if failure == TRANSIENT and (code is None or code == 421):
+                # The server dropped or is closing the channel; reconnect on the next attempt
+                session.close()
+            if isinstance(e, smtplib.SMTPResponseException):
+                error = f"{e.smtp_code} {e.smtp_error!r}"
+            else:
+                error = str(e)
+            return SendResult(job, False, error, attempts, smtp_code=code, failure=failure)
+
+    def _split_refused(self, result: SendResult) -> tuple[SendResult | None, list[str]]:
+        """Split RCPT refusals into addresses worth another attempt and a result for the rest.
+
+        Returns the result to report (None if every address is retried) and the addresses to retry.
+        """
+        job = result.job
+        retry = []
+        if result.attempts <= self.max_retries:
+            retry = [a for a, (code, _) in result.refused.items() if reply_class(code) == TRANSIENT]
+        settled = [a for a in job.to_addrs if a not in retry]
+        if not settled:
+            return None, retry
+        if retry:
+            result = replace(result, job=replace(job, to_addrs=settled),
+                             refused={a: r for a, r in result.refused.items() if a not in retry})
+        if not result.ok:
+            code = result.refused[settled[0]][0]
+            result = replace(result, smtp_code=code, failure=reply_class(code))
+        return result, retry
+
+    def _record(self, result: SendResult):
+        recipients = result.job.to_addrs
+        if result.ok:
+            metrics.inc('emails_sent_total', len(recipients) - len(result.refused))
+        bounced = []
+        if result.refused:
+            for address, (code, _) in result.refused.items():
+                failure = reply_class(code)
+                metrics.inc('emails_failed_total', reason=failure)
+                if failure == BOUNCED:
+                    bounced.append(address)
+        elif not result.ok:
+            metrics.inc('emails_failed_total', len(recipients), reason=result.failure)
+            if result.failure == BOUNCED:
+                bounced = recipients
+        if bounced and self.suppression is not None:
+            self.suppression.add_many(bounced, BOUNCE)
+
+    def run(self, jobs: Iterable[SendJob],
+            progress: Callable[[int, int | None], None] | None = None) -> Iterator[SendResult]:
+        """Send every job and yield a ``SendResult`` per job in completion order.
+
+        A job that fails transiently is retried up to ``max_retries`` times
+        before its last failure is yielded. When the server refuses some
+        addresses of a multi-recipient job with a 4xx, the result for the
+        others is yielded now and a later result covers the retried addresses.
+        Addresses beyond today's budget are not sent: they come back as a QUOTA
+        result (and the rest of an envelope goes out), so the caller can hold
+        them for another day. A SESSION failure (e.g. the login is rejected)
+        stops the run: nothing more is sent, and every job not yet attempted
+        comes back as a SESSION result so the caller can keep it queued.
+        """
+        total = len(jobs) if hasattr(jobs, '__len__') else None
+        done = 0
+        max_in_flight = self.workers * 4
+        # future -> (domain, job, attempts, whether the job was already counted towards progress)
+        pending = {}
+        # Error of the first SESSION failure, once the run has been stopped
+        aborted = None
+        retries = RetryScheduler(self._clock)
+        domains = DomainScheduler(self.domain_limits, max_in_flight, self._clock)
+        jobs_iter = iter(jobs)
+
+        def schedule_retry(job, attempts, counted):
+            metrics.inc('smtp_retries_total')
+            retries.schedule((job, attempts, counted), retry_delay(attempts, self.backoff_base))
+
+        def settle(result, counted):
+            nonlocal done
+            self._record(result)
+            if not counted:
+                done += 1
+                if progress is not None:
+                    progress(done, total)
+            return result
+
+        def next_wait():
+            delays = [d for d in (retries.next_delay(), domains.next_delay()) if d is not None]
+            return min(delays) if delays else None
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='smtp-send') as pool:
+                exhausted = False
+                while True:
+                    if aborted is not None:
+                        # Hand back everything unsent instead of logging in again for each job
+                        unsent = retries.drain() + domains.drain()
+                        for future in [future for future in pending if future.cancel()]:
+                            domain, job, attempts, counted = pending.pop(future)
+                            domains.release(domain)
+                            unsent.append((job, attempts, counted))
+                        unsent += ((job, 0, False) for job in jobs_iter)
+                        for job, attempts, counted in unsent:
+                            yield settle(SendResult(job, False, f"Not sent: {aborted}", attempts,
+                                                    failure=SESSION), counted)
+                        exhausted = True
+                    # Due retries go to the front of their domain's line, new jobs to the back
+                    for job, attempts, counted in retries.pop_due():
+                        domains.push(recipient_domain(job.to_addrs[0]), (job, attempts, counted), front=True)
+                    while not exhausted and len(domains) < self.lookahead:
+                        job = next(jobs_iter, None)
+                        if job is None:
+                            exhausted = True
+                            break
+                        domains.push(recipient_domain(job.to_addrs[0]), (job, 0, False))
+                    while len(pending) < max_in_flight:
+                        ready = domains.pop_ready()
+                        if ready is None:
+                            break
+                        domain, (job, attempts, counted) = ready
+                        allowed = self.budget.take(len(job.to_addrs))
+                        if allowed < len(job.to_addrs):
+                            over = replace(job, to_addrs=job.to_addrs[allowed:])
+                            yield settle(SendResult(over, False, "Daily send limit reached", attempts,
+                                                    failure=QUOTA), counted)
+                            if not allowed:
+                                domains.release(domain)
+                                continue
+                            job, counted = replace(job, to_addrs=job.to_addrs[:allowed]), True
+                        pending[pool.submit(self._deliver, job, attempts)] = (domain, job, attempts, counted)
+                    if not pending:
+                        if not retries and not domains:
+                            break
+                        self._sleep(next_wait() or 0)
+                        continue
+                    finished, _ = wait(pending, timeout=next_wait(), return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        domain, _, _, counted = pending.pop(future)
+                        result = future.result()
+                        if result.failure == SESSION and aborted is None:
+                            aborted = result.error
+                        deferred = ((result.failure == TRANSIENT and result.smtp_code is not None)
+                                    or any(reply_class(code) == TRANSIENT for code, _ in result.refused.values()))
+                        domains.finished(domain, deferred)
+                        if result.refused:
+                            job, attempts = result.job, result.attempts
+                            result, retry = self._split_refused(result)
+                            if retry:
+                                # If the rest of the job is reported now, the retried addresses must not count again
+                                schedule_retry(replace(job, to_addrs=retry), attempts, counted or result is not None)
+                            if result is None:
+                                continue
+                        elif result.failure == TRANSIENT and result.attempts <= self.max_retries:
+                            schedule_retry(result.job, result.attempts, counted)
+                            continue
+                        yield settle(result, counted)
+        finally:
+            self.close()
+
+    def close(self):
+        with self._sessions_lock:
+            sessions, self._sessions = self._sessions, []
+        for session in sessions:
+            session.close()
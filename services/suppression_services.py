@@ -0,0 +1,132 @@
+import os
+import sqlite3
+import threading
+import time
+from collections.abc import Iterable
+
+
+SUPPRESSION_DB_PATH = os.getenv('SUPPRESSION_DB_PATH', os.path.join('data', 'suppression.db'))
+
+# Reasons an address may be suppressed
+UNSUBSCRIBE = 'unsubscribe'
+BOUNCE = 'bounce'
+COMPLAINT = 'complaint'
+MANUAL = 'manual'
+
+# Rows per executemany when loading or probing in bulk
+_BATCH_SIZE = 10_000
+
+
+def suppression_key(email: str) -> str:
+    """Normalized form used as the index key: trimmed, no mailto:, lowercased."""
+    key = str(email).strip()
+    if key[:7].lower() == 'mailto:':
+        key = key[7:]
+    return key.lower()
+
+
+def _batched(items: Iterable, size: int = _BATCH_SIZE):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class SuppressionList:
+    """On-disk index of addresses that must never be mailed (unsubscribes, bounces, complaints).
+
+    Backed by a SQLite ``WITHOUT ROWID`` table keyed on the normalized address,
+    so membership is a single primary-key lookup even with millions of rows.
+    The database is opened with memory-mapped I/O and WAL so lookups can run
+    while a campaign is adding bounces. ``version`` increases with every change
+    made through this instance, so callers can tell when cached results are stale.
+    """
+
+    def __init__(self, path: str = SUPPRESSION_DB_PATH, mmap_size: int = 256 * 1024 * 1024):
+        self.path = path
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.version = 0
+        with self._lock, self._conn:
+            self._conn.execute(f"PRAGMA mmap_size={int(mmap_size)}")
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS suppressed ("
+                " email TEXT PRIMARY KEY,"
+                " reason TEXT NOT NULL,"
+                " added_at REAL NOT NULL"
+                ") WITHOUT ROWID"
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def add(self, email: str, reason: str = MANUAL):
+        self.add_many([email], reason)
+
+    def add_many(self, emails: Iterable[str], reason: str = MANUAL) -> int:
+        """Suppress addresses in bulk; re-adding an address updates its reason. Returns rows written."""
+        written = 0
+        now = time.time()
+        with self._lock:
+            for batch in _batched(emails):
+                with self._conn:
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO suppressed (email, reason, added_at) VALUES (?, ?, ?)",
+                        [(suppression_key(e), reason, now) for e in batch],
+                    )
+                written += len(batch)
+            self.version += 1
+        return written
+
+    def remove(self, email: str) -> bool:
+        with self._lock, self._conn:
+            cur = self._conn.execute("DELETE FROM suppressed WHERE email = ?", (suppression_key(email),))
+            self.version += 1
+            return cur.rowcount > 0
+
+    def reason(self, email: str) -> str | None:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT reason FROM suppressed WHERE email = ?", (suppression_key(email),)
+            ).fetchone()
+        return row[0] if row else None
+
+    def __contains__(self, email: str) -> bool:
+        return self.reason(email) is not None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM suppressed").fetchone()[0]
+
+    def suppressed_among(self, emails: Iterable[str]) -> set[str]:
+        """Return the normalized keys of ``emails`` that are suppressed.
+
+        The candidates are loaded into a temporary table and joined against the
+        index, which is far cheaper than one query per address.
+        """
+        with self._lock:
+            conn = self._conn
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS probe (email TEXT PRIMARY KEY) WITHOUT ROWID")
+            try:
+                for batch in _batched(emails):
+                    conn.executemany("INSERT OR IGNORE INTO probe (email) VALUES (?)",
+                                     [(suppression_key(e),) for e in batch])
+                rows = conn.execute("SELECT s.email FROM probe p JOIN suppressed s ON s.email = p.email")
+                return {row[0] for row in rows}
+            finally:
+                conn.execute("DELETE FROM probe")
+                conn.commit()
@@ -0,0 +1,153 @@
+import html
+import os
+import re
+import threading
+from collections.abc import Iterable, Mapping
+
+
+# {{ EMAIL_TITLE }} style campaign slots and [Name] style recipient slots
+SLOT_PATTERN = re.compile(r'\{\{\s*([A-Za-z0-9_]+)\s*\}\}|\[([A-Za-z][A-Za-z0-9_ \-]*)\]')
+
+# Used when a recipient has no value for a slot
+DEFAULT_VALUES = {'name': 'there'}
+
+# Recipient fields that are always recognised as [Field] slots
+DEFAULT_FIELDS = ('name', 'email', 'company')
+
+# Per-recipient copy written by the AI personalization pipeline; may contain HTML such as <br>
+AI_FIELDS = ('ai_subject', 'ai_title', 'ai_body', 'ai_cta_text')
+
+
+def normalize_key(key: str) -> str:
+    """'EMAIL_TITLE', 'First Name' and 'first-name' all become 'email_title' / 'first_name'."""
+    return re.sub(r'[\s\-]+', '_', str(key).strip().lower())
+
+
+def is_missing(value) -> bool:
+    if value is None:
+        return True
+    if isinstance(value, str):
+        return value == ''
+    try:
+        # NaN is the only value not equal to itself
+        return bool(value != value)
+    except TypeError:
+        # pandas.NA refuses to be coerced to bool
+        return True
+
+
+class CompiledTemplate:
+    """A template parsed once into literal segments and slots.
+
+    ``{{ KEY }}`` placeholders are always slots. ``[Field]`` placeholders are
+    slots only when ``Field`` is one of ``fields`` (the CSV columns), so text
+    such as the CSS selector ``[x-apple-data-detectors]`` is left alone.
+    Rendering copies the segment list, drops the values in and does a single join.
+    """
+
+    __slots__ = ('_parts', '_slots')
+
+    def __init__(self, parts: list[str], slots: list[tuple[int, str, bool]]):
+        self._parts = parts
+        self._slots = slots
+
+    @classmethod
+    def compile(cls, text: str, fields: Iterable[str] = (), escape: bool = False,
+                raw_fields: Iterable[str] = ()) -> 'CompiledTemplate':
+        """With ``escape`` set, values are HTML-escaped except for slots named in ``raw_fields``."""
+        raw = {normalize_key(f) for f in raw_fields}
+        known_fields = {normalize_key(f) for f in (*DEFAULT_FIELDS, *fields)} | raw
+        parts, slots = [], []
+        literal_start = 0
+        for match in SLOT_PATTERN.finditer(text):
+            curly, bracket = match.groups()
+            key = normalize_key(curly or bracket)
+            if bracket and key not in known_fields:
+                continue
+            parts.append(text[literal_start:match.start()])
+            slots.append((len(parts), key, escape and key not in raw))
+            parts.append('')
+            literal_start = match.end()
+        parts.append(text[literal_start:])
+        return cls(parts, slots)
+
+    @property
+    def slot_names(self) -> set[str]:
+        return {key for _, key, _ in self._slots}
+
+    def _resolve(self, keys: Iterable[str]) -> dict[str, str]:
+        """Map each slot name to the matching key of a context (e.g. 'first_name' -> 'First Name')."""
+        lookup = {normalize_key(k): k for k in keys}
+        return {key: lookup.get(key, key) for key in self.slot_names}
+
+    def _fill(self, context: Mapping, key_map: dict[str, str]) -> str:
+        parts = self._parts.copy()
+        for position, key, escape in self._slots:
+            value = context.get(key_map[key])
+            if is_missing(value):
+                value = DEFAULT_VALUES.get(key, '')
+            value = str(value)
+            parts[position] = html.escape(value) if escape else value
+        return ''.join(parts)
+
+    def render(self, context: Mapping) -> str:
+        """Render for one context (a dict of campaign values or one recipient record)."""
+        return self._fill(context, self._resolve(context.keys()))
+
+    def render_many(self, contexts: Iterable[Mapping]) -> list[str]:
+        """Render a batch of records that share the same columns, resolving slot keys only once."""
+        rendered = []
+        key_map = None
+        for context in contexts:
+            if key_map is None:
+                key_map = self._resolve(context.keys())
+            rendered.append(self._fill(context, key_map))
+        return rendered
+
+
+class TemplateCache:
+    """Compiled templates keyed by path, size and mtime, so an edited file is picked up on the next load."""
+
+    def __init__(self, max_entries: int = 16):
+        self.max_entries = max_entries
+        self._entries: dict[str, tuple[tuple, CompiledTemplate]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, path: str) -> CompiledTemplate:
+        realpath = os.path.realpath(path)
+        st = os.stat(realpath)
+        stamp = (st.st_size, st.st_mtime_ns)
+        with self._lock:
+            cached = self._entries.get(realpath)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        with open(realpath, 'r', encoding='utf-8') as f:
+            template = CompiledTemplate.compile(f.read())
+        with self._lock:
+            self._entries.pop(realpath, None)
+            if len(self._entries) >= self.max_entries:
+                self._entries.pop(next(iter(self._entries)))
+            self._entries[realpath] = (stamp, template)
+        return template
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+template_cache = TemplateCache()
+
+
+def load_template(path: str) -> CompiledTemplate:
+    """Read and compile an HTML template file; unchanged files are served from ``template_cache``."""
+    return template_cache.get(path)
+
+
+def compile_for_recipients(rendered_html: str, fields: Iterable[str],
+                           raw_fields: Iterable[str] = AI_FIELDS) -> CompiledTemplate:
+    """Compile campaign HTML (campaign slots already filled) for per-recipient rendering.
+
+    Recipient values are HTML-escaped since they come straight from the uploaded CSV;
+    ``raw_fields`` (such as AI-written bodies containing <br>) are inserted as-is.
+    """
+    return CompiledTemplate.compile(rendered_html, fields=fields, escape=True, raw_fields=raw_fields)
@@ -0,0 +1,126 @@
+import io
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+from contextlib import redirect_stderr, redirect_stdout
+from unittest import mock
+
+import campaign
+from benchmarks.fakes import RecordingSession
+from campaign import CampaignConfig, main, run_campaign
+from services.queue_services import SendQueue
+from services.send_services import RateLimit, SendEngine
+from services.suppression_services import SuppressionList
+
+
+class TestCampaignRunner(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+        self.contacts = os.path.join(self.dir, 'contacts.csv')
+        rows = ["Name,Email"] + [f"User {i},user{i}@example.com" for i in range(12)]
+        rows += ["Repeat,USER0@example.com", "Broken,not-an-email"]
+        with open(self.contacts, 'w') as f:
+            f.write("\n".join(rows) + "\n")
+        self.session = RecordingSession(reject={'user5@example.com'})
+
+    def _engine_factory(self):
+        return SendEngine(workers=3, host='cli.test', rate_limit=RateLimit(per_second=1000, burst=1000),
+                          session_factory=lambda: self.session)
+
+    def _write_config(self, **settings):
+        path = os.path.join(self.dir, 'campaign.json')
+        with open(path, 'w') as f:
+            json.dump(settings, f)
+        return path
+
+    def test_run_campaign_sends_and_reports(self):
+        queue = SendQueue(':memory:')
+        self.addCleanup(queue.close)
+        suppression = SuppressionList(':memory:')
+        self.addCleanup(suppression.close)
+        suppression.add('user11@example.com')
+        config = CampaignConfig(subject="Hi [Name]", title="Launch", body="Hello [Name]", cta_text="Go",
+                                cta_link="https://example.com")
+
+        report = run_campaign(self.contacts, config, queue, suppression, engine_factory=self._engine_factory)
+
+        self.assertEqual(report['status'], 'incomplete')
+        self.assertEqual((report['queued'], report['sent'], report['failed'], report['remaining']), (11, 10, 1, 0))
+        self.assertEqual(report['contacts'], {'total': 14, 'valid': 13, 'duplicates': 1, 'suppressed': 1,
+                                              'sendable': 11})
+        self.assertIn(b'Hello User 3', dict(self.session.sent)['user3@example.com'])
+
+        # Running the same campaign again resumes it; nobody is mailed twice
+        again = run_campaign(self.contacts, config, queue, suppression, engine_factory=self._engine_factory)
+        self.assertEqual(again['campaign_id'], report['campaign_id'])
+        self.assertEqual(len(self.session.sent), 10)
+
+        # A new name starts a fresh campaign with the same content
+        config.name = 'second wave'
+        renamed = run_campaign(self.contacts, config, queue, suppression, engine_factory=self._engine_factory)
+        self.assertNotEqual(renamed['campaign_id'], report['campaign_id'])
+        self.assertEqual(len(self.session.sent), 20)
+
+    def test_missing_copy_is_generated(self):
+        ai = mock.Mock(return_value={"subject": "AI subject", "title": "T", "body": "AI body", "cta_text": "Go"})
+        config = CampaignConfig(subject="Own subject", prompt="Pitch our CRM")
+        with mock.patch.object(campaign, 'generate_email_template', ai):
+            copy = campaign.resolve_copy(config)
+
+        self.assertEqual(copy, {"subject": "Own subject", "title": "T", "body": "AI body", "cta_text": "Go"})
+
+    def test_cli_prints_json_report_and_exit_code(self):
+        config = self._write_config(subject="Hi", body="Hello [Name]", limit=4)
+        self.session.reject = set()
+        args = ['run', '--contacts', self.contacts, '--config', config,
+                '--queue-db', os.path.join(self.dir, 'queue.db'),
+                '--suppression-db', os.path.join(self.dir, 'suppression.db'),
+                '--report-csv', os.path.join(self.dir, 'status.csv')]
+        stdout = io.StringIO()
+        with mock.patch.object(campaign, 'SendEngine', lambda **kw: self._engine_factory()), \
+                redirect_stdout(stdout), redirect_stderr(io.StringIO()):
+            code = main(args)
+
+        report = json.loads(stdout.getvalue())
+        self.assertEqual(code, campaign.EXIT_OK)
+        self.assertEqual((report['status'], report['sent']), ('completed', 4))
+        with open(os.path.join(self.dir, 'status.csv')) as f:
+            self.assertEqual(len(f.readlines()), 5)
+
+    def test_cli_rejects_bad_config(self):
+        config = self._write_config(subject="Hi", body="Hello", unknown_option=True)
+        stdout = io.StringIO()
+        with redirect_stdout(stdout), redirect_stderr(io.StringIO()):
+            code = main(['run', '--contacts', self.contacts, '--config', config,
+                         '--queue-db', os.path.join(self.dir, 'queue.db'),
+                         '--suppression-db', os.path.join(self.dir, 'suppression.db')])
+
+        self.assertEqual(code, campaign.EXIT_ERROR)
+        self.assertIn('unknown_option', json.loads(stdout.getvalue())['error'])
+
+    def test_cli_reports_database_errors(self):
+        config = self._write_config(subject="Hi", body="Hello [Name]")
+        stdout = io.StringIO()
+        locked = mock.Mock(side_effect=sqlite3.OperationalError('database is locked'))
+        with mock.patch.object(campaign, 'run_campaign', locked), \
+                redirect_stdout(stdout), redirect_stderr(io.StringIO()):
+            code = main(['run', '--contacts', self.contacts, '--config', config,
+                         '--queue-db', os.path.join(self.dir, 'queue.db'),
+                         '--suppression-db', os.path.join(self.dir, 'suppression.db')])
+
+        self.assertEqual(code, campaign.EXIT_ERROR)
+        self.assertEqual(json.loads(stdout.getvalue()), {'status': 'error', 'error': 'database is locked'})
+
+    def test_config_checks_domain_limits(self):
+        config = CampaignConfig.from_mapping({'domain_limits': {'gmail.com': {'concurrency': 2, 'per_second': 1}}})
+        self.assertEqual(config.domain_limits['gmail.com']['concurrency'], 2)
+        with self.assertRaises(ValueError):
+            CampaignConfig.from_mapping({'domain_limits': {'gmail.com': {'burst': 3}}})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+import email
+import os
+import smtplib
+import tempfile
+import unittest
+from unittest import mock
+
+from services.email_services import (
+    AttachmentCache, PreparedAttachment, SMTPSession, render_message, send_email,
+)
+
+
+class FakeSMTP:
+    """Minimal stand-in for smtplib.SMTP that records calls."""
+
+    instances = []
+
+    def __init__(self, host, port, timeout=None):
+        self.host = host
+        self.port = port
+        self.logins = 0
+        self.tls = False
+        self.sent = []
+        self.fail_next_send = False
+        self.closed = False
+        FakeSMTP.instances.append(self)
+
+    def ehlo(self):
+        pass
+
+    def starttls(self):
+        self.tls = True
+
+    def login(self, user, password):
+        self.logins += 1
+
+    def sendmail(self, from_addr, to_addrs, msg):
+        if self.fail_next_send:
+            self.fail_next_send = False
+            raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+        self.sent.append((from_addr, list(to_addrs), msg))
+        return {}
+
+    def quit(self):
+        self.closed = True
+
+    def close(self):
+        self.closed = True
+
+
+class TestSMTPSession(unittest.TestCase):
+    def setUp(self):
+        FakeSMTP.instances = []
+        patcher = mock.patch.object(smtplib, 'SMTP', FakeSMTP)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_session_logs_in_once_for_many_sends(self):
+        with SMTPSession(username='me@example.com', password='pw') as session:
+            for i in range(5):
+                self.assertTrue(send_email("Hi", "<p>x</p>", [f"user{i}@example.com"], session=session))
+
+        self.assertEqual(len(FakeSMTP.instances), 1)
+        server = FakeSMTP.instances[0]
+        self.assertEqual(server.logins, 1)
+        self.assertEqual(len(server.sent), 5)
+        self.assertTrue(server.closed)
+
+    def test_session_reconnects_after_disconnect(self):
+        session = SMTPSession(username='me@example.com', password='pw')
+        session.sendmail('me@example.com', ['a@example.com'], 'msg')
+        FakeSMTP.instances[0].fail_next_send = True
+        session.sendmail('me@example.com', ['b@example.com'], 'msg')
+        session.close()
+
+        self.assertEqual(len(FakeSMTP.instances), 2)
+        self.assertEqual(FakeSMTP.instances[1].sent[0][1], ['b@example.com'])
+
+    def test_starttls_can_be_disabled_for_local_relays(self):
+        with SMTPSession(username='', starttls=False) as session:
+            session.sendmail('me@example.com', ['a@example.com'], 'msg')
+        with SMTPSession(username='') as session:
+            session.sendmail('me@example.com', ['a@example.com'], 'msg')
+
+        self.assertEqual([server.tls for server in FakeSMTP.instances], [False, True])
+        self.assertEqual(FakeSMTP.instances[0].logins, 0)
+
+    def test_failed_login_closes_the_connection(self):
+        session = SMTPSession(username='me@example.com', password='wrong')
+        with mock.patch.object(FakeSMTP, 'login', side_effect=smtplib.SMTPAuthenticationError(535, b'Bad login')):
+            with self.assertRaises(smtplib.SMTPAuthenticationError):
+                session.connect()
+
+        self.assertTrue(FakeSMTP.instances[0].closed)
+        self.assertIsNone(session._server)
+
+    def test_send_email_without_session_uses_throwaway_connection(self):
+        self.assertTrue(send_email("Hi", "<p>x</p>", "solo@example.com"))
+        self.assertEqual(len(FakeSMTP.instances), 1)
+        self.assertTrue(FakeSMTP.instances[0].closed)
+
+
+class TestAttachments(unittest.TestCase):
+    def test_render_message_splices_prepared_parts(self):
+        brochure = PreparedAttachment.from_bytes("brochure.pdf", b"%PDF-1.4 " * 100)
+        logo = PreparedAttachment.from_bytes("logo.png", b"\x89PNG" * 50)
+        wire = render_message("Hello", "<p>Hi [Name]</p>", ["a@example.com"], [brochure, logo])
+
+        self.assertIsInstance(wire, bytes)
+        self.assertNotIn(b'\n', wire.replace(b'\r\n', b''))
+        self.assertIn(brochure.wire, wire)
+        parsed = email.message_from_bytes(wire)
+        parts = parsed.get_payload()
+        self.assertEqual(parsed['To'], "a@example.com")
+        self.assertEqual(len(parts), 3)
+        self.assertEqual(parts[0].get_content_type(), "multipart/alternative")
+        self.assertEqual(parts[1].get_filename(), "brochure.pdf")
+        self.assertEqual(parts[1].get_payload(decode=True), b"%PDF-1.4 " * 100)
+        self.assertEqual(parts[2].get_payload(decode=True), b"\x89PNG" * 50)
+
+    def test_cache_encodes_each_file_once(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "doc.txt")
+            with open(path, "wb") as f:
+                f.write(b"payload")
+            cache = AttachmentCache()
+            with mock.patch.object(PreparedAttachment, 'from_path', wraps=PreparedAttachment.from_path) as spy:
+                first = cache.get(path)
+                second = cache.get(path)
+            self.assertIs(first, second)
+            self.assertEqual(spy.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
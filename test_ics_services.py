@@ -0,0 +1,64 @@
+import email
+import os
+import tempfile
+import unittest
+from datetime import datetime, timezone
+
+from services.email_services import render_message
+from services.ics_services import InviteTemplate, create_ics_file, invite_attachment, render_ics
+
+
+START = datetime(2025, 3, 4, 15, 30, tzinfo=timezone.utc)
+END = datetime(2025, 3, 4, 16, 0, tzinfo=timezone.utc)
+
+
+class TestInviteTemplate(unittest.TestCase):
+    def setUp(self):
+        self.invite = InviteTemplate("Product demo", "Agenda:\nWalkthrough", START, END, "me@example.com")
+
+    def test_render_matches_calendar_layout(self):
+        lines = self.invite.render("ann@example.com", "Ann", uid="fixed-uid").decode('utf-8').splitlines()
+
+        self.assertEqual(lines[:6], ["BEGIN:VCALENDAR", "PRODID:-//YourCompany//AI Scheduler//EN", "VERSION:2.0",
+                                     "CALSCALE:GREGORIAN", "METHOD:REQUEST", "BEGIN:VEVENT"])
+        self.assertEqual(lines[6], "UID:fixed-uid")
+        self.assertTrue(lines[7].startswith("DTSTAMP:"))
+        self.assertEqual(lines[8:], ["DTSTART:20250304T153000Z", "DTEND:20250304T160000Z", "SUMMARY:Product demo",
+                                     "DESCRIPTION:Agenda:\\nWalkthrough", "ORGANIZER:mailto:me@example.com",
+                                     "ATTENDEE;CN=Ann;RSVP=TRUE:mailto:ann@example.com", "END:VEVENT", "",
+                                     "END:VCALENDAR"])
+
+    def test_render_many_varies_only_uid_and_attendee(self):
+        first, second = self.invite.render_many(["a@example.com", "b@example.com"])
+        diff = [(x, y) for x, y in zip(first.splitlines(), second.splitlines()) if x != y]
+
+        self.assertEqual(len(diff), 2)
+        self.assertTrue(diff[0][0].startswith(b"UID:"))
+        self.assertEqual(diff[1], (b"ATTENDEE;CN=Attendee;RSVP=TRUE:mailto:a@example.com",
+                                   b"ATTENDEE;CN=Attendee;RSVP=TRUE:mailto:b@example.com"))
+
+    def test_file_and_bytes_agree(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = create_ics_file("Demo", "", START, END, "me@example.com", "a@example.com", os.path.join(tmp, "x.ics"))
+            with open(path, 'rb') as f:
+                written = f.read()
+        rendered = render_ics("Demo", "", START, END, "me@example.com", "a@example.com")
+
+        def strip(payload):
+            return [line for line in payload.splitlines() if not line.startswith((b"UID:", b"DTSTAMP:"))]
+
+        self.assertEqual(strip(written), strip(rendered))
+
+    def test_invite_attachment_is_text_calendar(self):
+        ics = self.invite.render("a@example.com")
+        wire = render_message("Invite", "<p>See you</p>", ["a@example.com"], [invite_attachment(ics)])
+        part = email.message_from_bytes(wire).get_payload()[1]
+
+        self.assertEqual(part.get_content_type(), "text/calendar")
+        self.assertEqual(part.get_param("method"), "REQUEST")
+        self.assertEqual(part.get_filename(), "invite.ics")
+        self.assertEqual(part.get_payload(decode=True), ics)
+
+
+if __name__ == '__main__':
+    unittest.main()
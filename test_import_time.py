@@ -0,0 +1,54 @@
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Cumulative cold import budget, in seconds, for the modules the headless send and invite paths load
+IMPORT_BUDGET_SECONDS = {
+    'services.email_services': 0.2,
+    'services.ics_services': 0.2,
+}
+
+# Loaded on first use only; importing these up front costs seconds and tens of MB
+HEAVY_MODULES = ('openai', 'httpx', 'pandas', 'numpy', 'http.server')
+
+
+def _import(module: str) -> tuple[float, set[str]]:
+    """Import ``module`` in a fresh interpreter; returns its cumulative import time and every module loaded."""
+    code = f"import json, sys; import {module}; print(json.dumps(sorted(sys.modules)))"
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=ROOT,
+                          capture_output=True, text=True, check=True)
+    cumulative = None
+    for line in proc.stderr.splitlines():
+        # "import time: self [us] | cumulative | imported package"
+        fields = line.split('|')
+        if len(fields) == 3 and fields[2].strip() == module:
+            cumulative = int(fields[1]) / 1e6
+    return cumulative, set(json.loads(proc.stdout))
+
+
+class TestImportTime(unittest.TestCase):
+    def test_service_modules_import_within_budget(self):
+        for module, budget in IMPORT_BUDGET_SECONDS.items():
+            with self.subTest(module=module):
+                # Best of three, so a compile of stale .pyc files or a busy machine does not fail the run
+                seconds = min(_import(module)[0] for _ in range(3))
+                self.assertLess(seconds, budget, f"{module} took {seconds * 1000:.0f} ms to import")
+
+    def test_heavy_dependencies_load_lazily(self):
+        for module in ('services.email_services', 'services.ics_services', 'services.openai_services',
+                       'scheduler_logic'):
+            with self.subTest(module=module):
+                loaded = _import(module)[1]
+                self.assertEqual([m for m in HEAVY_MODULES if m in loaded], [])
+
+    def test_smtplib_loads_only_for_sending(self):
+        self.assertNotIn('smtplib', _import('services.ics_services')[1])
+        self.assertIn('smtplib', _import('services.send_services')[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
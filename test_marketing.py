@@ -1,7 +1,9 @@
 import unittest
 import pandas as pd
 import io
-from marketing_logic import process_csv, validate_email
+from marketing_logic import (process_csv, validate_email, iter_recipients, count_recipients, get_recipient_data,
+                             load_contacts)
+from services.suppression_services import SuppressionList
 
 class TestMarketingLogic(unittest.TestCase):
     def test_email_validation(self):
@@ -19,5 +21,73 @@ class TestMarketingLogic(unittest.TestCase):
         self.assertIn('email', df.columns)
         self.assertTrue(df.iloc[0]['is_valid_email'])
 
+    def test_normalization_and_rejection_reasons(self):
+        csv_content = "Name,Email\nA,  MAILTO:Ann.Lee@Example.COM \nB,\nC,no-at-sign\nD,d@@x.com\nE,e@localhost"
+        df = process_csv(io.StringIO(csv_content))
+
+        self.assertEqual(df.iloc[0]['email'], 'Ann.Lee@example.com')
+        self.assertEqual(list(df['invalid_reason']), ['', 'missing', 'missing_at', 'multiple_at', 'invalid_format'])
+        self.assertEqual(list(df['is_valid_email']), [True, False, False, False, False])
+
+    def test_unicode_addresses_agree_with_validate_email(self):
+        emails = ['josé@example.com', 'x@bücher.de', 'ü@x', 'plain@example.com']
+        df = process_csv(io.StringIO("Name,Email\n" + "\n".join(f"N,{e}" for e in emails)))
+
+        self.assertEqual(list(df['is_valid_email']), [validate_email(e) for e in emails])
+        self.assertEqual(list(df['is_valid_email']), [True, True, False, True])
+
+    def test_streaming_ingestion(self):
+        csv_content = "Full Name,Email Address,Plan\n" + "".join(
+            f"User {i},{'user' + str(i) + '@example.com' if i % 3 else 'broken'},Gold\n" for i in range(10)
+        )
+        recipients = list(iter_recipients(io.StringIO(csv_content), chunksize=4))
+
+        self.assertEqual(len(recipients), 6)
+        self.assertEqual(recipients[0]['email'], 'user1@example.com')
+        self.assertEqual(recipients[0].get('name'), 'User 1')
+        self.assertEqual(recipients[0]['plan'], 'Gold')
+        self.assertEqual(recipients[0].get('missing', 'x'), 'x')
+        counts = count_recipients(io.StringIO(csv_content), chunksize=4)
+        self.assertEqual((counts['total'], counts['valid'], counts['sendable']), (10, 6, 6))
+
+    def test_loaded_and_streamed_rows_render_the_same(self):
+        csv_content = "Name,Email,Zip,Phone\nA,a@example.com,02134,5551234567\nB,b@example.com,10001,\n"
+        loaded = list(load_contacts(io.StringIO(csv_content)))
+        streamed = list(iter_recipients(io.StringIO(csv_content)))
+
+        self.assertEqual([(r['zip'], r['phone']) for r in loaded], [('02134', '5551234567'), ('10001', '')])
+        self.assertEqual([dict(r) for r in loaded], [dict(r) for r in streamed])
+
+    def test_dedup_and_suppression(self):
+        csv_content = ("Name,Email\nA,a@example.com\nA2,A@Example.com\nB,b@example.com\n"
+                       "C,c@example.com\nD,d@example.com\nB2,b@example.com\n")
+        with SuppressionList(':memory:') as suppression:
+            suppression.add_many(['C@EXAMPLE.COM'], reason='unsubscribe')
+            self.assertIn('c@example.com', suppression)
+            self.assertEqual(suppression.reason(' mailto:c@example.com'), 'unsubscribe')
+
+            recipients = get_recipient_data(process_csv(io.StringIO(csv_content)), suppression)
+            self.assertEqual([r['email'] for r in recipients], ['a@example.com', 'b@example.com', 'd@example.com'])
+
+            streamed = list(iter_recipients(io.StringIO(csv_content), chunksize=2, suppression=suppression))
+            self.assertEqual([r['email'] for r in streamed], ['a@example.com', 'b@example.com', 'd@example.com'])
+
+            counts = count_recipients(io.StringIO(csv_content), chunksize=2, suppression=suppression)
+            self.assertEqual((counts['duplicates'], counts['suppressed'], counts['sendable']), (2, 1, 3))
+
+    def test_load_contacts_keeps_only_sendable_rows(self):
+        csv_content = "Name,Email\nA,a@example.com\nA2,a@example.com\nBad,nope\n" + "".join(
+            f"U{i},u{i}@example.com\n" for i in range(10))
+        with SuppressionList(':memory:') as suppression:
+            suppression.add('u0@example.com')
+            contacts = load_contacts(io.StringIO(csv_content), suppression, preview_rows=3)
+
+        self.assertEqual(len(contacts.preview), 3)
+        self.assertEqual(contacts.stats, {'total': 13, 'valid': 12, 'duplicates': 1, 'suppressed': 1, 'sendable': 10})
+        self.assertNotIn('is_valid_email', contacts.sendable.columns)
+        emails = [r['email'] for r in contacts]
+        self.assertEqual(emails[:2], ['a@example.com', 'u1@example.com'])
+        self.assertEqual(len(emails), len(contacts))
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,134 @@
+import json
+import os
+import smtplib
+import tempfile
+import unittest
+import urllib.request
+from unittest import mock
+
+from services.email_services import SMTPSession
+from services.metrics_services import MetricsRegistry, metrics
+
+
+class TestMetricsRegistry(unittest.TestCase):
+    def test_disabled_registry_records_nothing(self):
+        registry = MetricsRegistry(enabled=False)
+        with registry.timer('stage'):
+            pass
+        registry.inc('things_total')
+        registry.observe('stage', 0.5)
+        snapshot = registry.snapshot()
+        self.assertEqual(snapshot['timers'], [])
+        self.assertEqual(snapshot['counters'], [])
+
+    def test_timers_and_counters_are_kept_per_label_set(self):
+        registry = MetricsRegistry(enabled=True)
+        registry.observe('ai_generate', 0.2, provider='OpenAI')
+        registry.observe('ai_generate', 0.4, provider='OpenAI')
+        registry.observe('ai_generate', 1.0, provider='Gemini')
+        registry.inc('emails_sent_total')
+        registry.inc('emails_sent_total', 2)
+
+        timers = {t['labels']['provider']: t for t in registry.snapshot()['timers']}
+        self.assertEqual(timers['OpenAI']['count'], 2)
+        self.assertAlmostEqual(timers['OpenAI']['mean_seconds'], 0.3)
+        self.assertAlmostEqual(timers['OpenAI']['max_seconds'], 0.4)
+        self.assertEqual(timers['Gemini']['count'], 1)
+        self.assertEqual(registry.snapshot()['counters'],
+                         [{'name': 'emails_sent_total', 'labels': {}, 'value': 3}])
+
+    def test_timed_decorator_checks_the_switch_at_call_time(self):
+        registry = MetricsRegistry(enabled=False)
+
+        @registry.timed('work')
+        def work(x):
+            return x * 2
+
+        self.assertEqual(work(2), 4)
+        registry.enable()
+        self.assertEqual(work(3), 6)
+        self.assertEqual(registry.snapshot()['timers'][0]['count'], 1)
+
+    def test_prometheus_output_has_cumulative_buckets(self):
+        registry = MetricsRegistry(enabled=True)
+        registry.observe('smtp_send', 0.002)
+        registry.observe('smtp_send', 0.2)
+        registry.inc('emails_failed_total', reason='550')
+        text = registry.to_prometheus()
+
+        self.assertIn('# TYPE campaign_smtp_send_seconds histogram', text)
+        self.assertIn('campaign_smtp_send_seconds_bucket{le="0.005"} 1', text)
+        self.assertIn('campaign_smtp_send_seconds_bucket{le="0.25"} 2', text)
+        self.assertIn('campaign_smtp_send_seconds_bucket{le="+Inf"} 2', text)
+        self.assertIn('campaign_smtp_send_seconds_count 2', text)
+        self.assertIn('campaign_emails_failed_total{reason="550"} 1', text)
+
+    def test_write_picks_format_from_extension(self):
+        registry = MetricsRegistry(enabled=True)
+        registry.inc('emails_sent_total')
+        with tempfile.TemporaryDirectory() as tmp:
+            json_path = os.path.join(tmp, 'out', 'metrics.json')
+            prom_path = os.path.join(tmp, 'metrics.prom')
+            registry.write(json_path)
+            registry.write(prom_path)
+            with open(json_path, encoding='utf-8') as f:
+                self.assertEqual(json.load(f)['counters'][0]['value'], 1)
+            with open(prom_path, encoding='utf-8') as f:
+                self.assertIn('campaign_emails_sent_total 1', f.read())
+
+    def test_serve_exposes_both_formats(self):
+        registry = MetricsRegistry(enabled=True)
+        registry.inc('emails_sent_total')
+        server = registry.serve(0)
+        self.addCleanup(server.shutdown)
+        base = f"http://127.0.0.1:{server.server_address[1]}"
+        with urllib.request.urlopen(base + '/metrics') as resp:
+            self.assertIn('campaign_emails_sent_total 1', resp.read().decode())
+        with urllib.request.urlopen(base + '/metrics.json') as resp:
+            self.assertEqual(json.load(resp)['counters'][0]['name'], 'emails_sent_total')
+
+
+class FakeSMTP:
+    def __init__(self, host, port, timeout=None):
+        pass
+
+    def ehlo(self):
+        pass
+
+    def login(self, user, password):
+        pass
+
+    def sendmail(self, from_addr, to_addrs, msg):
+        return {}
+
+    def quit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class TestInstrumentedStages(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(smtplib, 'SMTP', FakeSMTP)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        metrics.reset()
+        metrics.enable()
+        self.addCleanup(metrics.reset)
+        self.addCleanup(metrics.disable)
+
+    def test_smtp_session_records_connect_login_and_send(self):
+        with SMTPSession(username='me@example.com', password='pw', starttls=False) as session:
+            session.sendmail('me@example.com', ['a@example.com'], 'msg')
+            session.sendmail('me@example.com', ['b@example.com'], 'msg')
+
+        timers = {t['name']: t['count'] for t in metrics.snapshot()['timers']}
+        self.assertEqual(timers['smtp_connect'], 1)
+        self.assertEqual(timers['smtp_login'], 1)
+        self.assertEqual(timers['smtp_send'], 2)
+        self.assertNotIn('smtp_starttls', timers)
+
+
+if __name__ == '__main__':
+    unittest.main()
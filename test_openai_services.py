@@ -0,0 +1,257 @@
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import openai
+from openai import AsyncOpenAI
+
+from benchmarks.fakes import FakeLLMServer
+from services import openai_services
+from services.openai_services import (
+    ClientRegistry, PartialTemplateParser, ResponseCache, generate_email_template, personalize_stream,
+    personalize_to_queue, stream_email_template,
+)
+from services.queue_services import SendQueue, FAILED, PENDING
+
+
+class StubClient:
+    """Stands in for OpenAI(); answers every completion with ``content``."""
+
+    def __init__(self, content):
+        self.calls = 0
+        self.content = content
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, **kwargs):
+        self.calls += 1
+        message = SimpleNamespace(content=self.content)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+TEMPLATE = {"subject": "S", "title": "T", "body": "Hi [Name]", "cta_text": "Go"}
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.directory = tmp.name
+        self.client = StubClient(json.dumps(TEMPLATE))
+        patcher = mock.patch.object(openai_services, 'get_client', return_value=self.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_identical_requests_hit_cache(self):
+        cache = ResponseCache(self.directory)
+        first = generate_email_template("Pitch our CRM", cache=cache)
+        first['subject'] = "edited by the UI"
+        second = generate_email_template("Pitch our CRM", cache=cache)
+
+        self.assertEqual(self.client.calls, 1)
+        self.assertEqual(second, TEMPLATE)
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_key_covers_all_parameters(self):
+        cache = ResponseCache(self.directory)
+        generate_email_template("Pitch", cache=cache)
+        generate_email_template("Pitch", model="gpt-4o", cache=cache)
+        generate_email_template("Pitch", temperature=0.2, cache=cache)
+        generate_email_template("Pitch", provider="OpenRouter", cache=cache)
+
+        self.assertEqual(self.client.calls, 4)
+
+    def test_disk_tier_survives_new_instance_and_expires(self):
+        generate_email_template("Pitch", cache=ResponseCache(self.directory))
+        fresh = ResponseCache(self.directory)
+        self.assertEqual(generate_email_template("Pitch", cache=fresh), TEMPLATE)
+        self.assertEqual(fresh.stats()['disk_hits'], 1)
+        self.assertEqual(self.client.calls, 1)
+
+        expired = ResponseCache(self.directory, ttl=0)
+        generate_email_template("Pitch", cache=expired)
+        self.assertEqual(self.client.calls, 2)
+
+    def test_size_eviction(self):
+        cache = ResponseCache(self.directory, max_memory_entries=1, max_disk_bytes=300)
+        for i in range(10):
+            cache.set(f"{i:064x}", {"body": "x" * 50})
+            time.sleep(0.01)
+        files = [f for _, _, names in os.walk(self.directory) for f in names]
+
+        self.assertLess(len(files), 10)
+        self.assertIsNotNone(cache.get(f"{9:064x}"))
+
+    def test_unparseable_answers_are_not_cached(self):
+        self.client.content = "not json"
+        cache = ResponseCache(self.directory)
+        generate_email_template("Pitch", cache=cache)
+        generate_email_template("Pitch", cache=cache)
+
+        self.assertEqual(self.client.calls, 2)
+
+
+def _contacts(n):
+    return [{'email': f'user{i}@example.com', 'name': f'User {i}', 'company': 'Acme'} for i in range(n)]
+
+
+class TestPersonalizationPipeline(unittest.TestCase):
+    def _collect(self, server, recipients, **kwargs):
+        async def run():
+            client = AsyncOpenAI(base_url=server.base_url, api_key='test', max_retries=0)
+            try:
+                return [item async for item in personalize_stream(recipients, "Pitch our CRM", client=client,
+                                                                  cache=None, retry_base=0.01, **kwargs)]
+            finally:
+                await client.close()
+        return asyncio.run(run())
+
+    def test_bounded_concurrency_and_retries(self):
+        with FakeLLMServer(failures=[429, 429, 503]) as server:
+            results = self._collect(server, _contacts(20), concurrency=4)
+
+        self.assertEqual(len(results), 20)
+        self.assertTrue(all(error is None for _, _, error in results))
+        by_email = {recipient['email']: data for recipient, data, _ in results}
+        self.assertEqual(by_email['user7@example.com']['subject'], 'For User 7')
+        self.assertEqual(server.requests, 23)
+        self.assertLessEqual(server.max_in_flight, 4)
+
+    def test_gives_up_after_max_retries(self):
+        with FakeLLMServer(failures=[500] * 10) as server:
+            results = self._collect(server, _contacts(1), max_retries=2)
+
+        self.assertIsNotNone(results[0][2])
+        self.assertEqual(server.requests, 3)
+
+    def test_streams_into_send_queue(self):
+        queue = SendQueue(':memory:')
+        self.addCleanup(queue.close)
+        campaign_id = queue.create_campaign("[AI Subject]", "<p>[AI Body]</p>")
+        with FakeLLMServer() as server, \
+                mock.patch.object(openai_services, 'get_provider_config', return_value=('test', server.base_url)):
+            counts = personalize_to_queue(queue, campaign_id, _contacts(7), "Pitch", cache=None,
+                                          concurrency=3, flush_every=2)
+
+        self.assertEqual(counts, {'generated': 7, 'failed': 0})
+        messages = queue.claim(campaign_id, 10)
+        self.assertEqual(len(messages), 7)
+        self.assertEqual(messages[0].fields['ai_body'], f"Dear {messages[0].fields['name']}<br>")
+        self.assertEqual(queue.counts(campaign_id)[PENDING], 0)
+
+
+    def test_failed_generations_are_queued_as_failed_and_retried_on_rerun(self):
+        queue = SendQueue(':memory:')
+        self.addCleanup(queue.close)
+        campaign_id = queue.create_campaign("[AI Subject]", "<p>[AI Body]</p>")
+        with FakeLLMServer(failures=[500, 500]) as server, \
+                mock.patch.object(openai_services, 'get_provider_config', return_value=('test', server.base_url)), \
+                mock.patch('builtins.print'):
+            counts = personalize_to_queue(queue, campaign_id, _contacts(4), "Pitch", cache=None,
+                                          concurrency=1, max_retries=0)
+            self.assertEqual(counts, {'generated': 2, 'failed': 2})
+            self.assertEqual((queue.counts(campaign_id)[FAILED], queue.counts(campaign_id)['total']), (2, 4))
+            failed = [row for row in queue.iter_report(campaign_id) if row[2] == 'Failed']
+            self.assertEqual([row[0] for row in failed], ['user0@example.com', 'user1@example.com'])
+            self.assertIn('AI personalization failed', failed[0][5])
+
+            counts = personalize_to_queue(queue, campaign_id, _contacts(4), "Pitch", cache=None, concurrency=1)
+
+        self.assertEqual(counts, {'generated': 4, 'failed': 0})
+        self.assertEqual(queue.counts(campaign_id)[PENDING], 4)
+        revived = {m.email: m for m in queue.claim(campaign_id, 10)}['user0@example.com']
+        self.assertEqual(revived.fields['ai_body'], "Dear User 0<br>")
+
+class TestStreaming(unittest.TestCase):
+    def test_parser_reports_partial_and_completed_fields(self):
+        text = '```json\n{"subject": "Big \\"news\\"", "title": "Caf\\u00e9 \\ud83d\\ude00", "body": "a\\nb"}\n```'
+        expected = {"subject": 'Big "news"', "title": "Caf\u00e9 \U0001F600", "body": "a\nb"}
+        # Any split into chunks must give the same result
+        for size in (1, 2, 3, 7, len(text)):
+            parser = PartialTemplateParser()
+            for i in range(0, len(text), size):
+                values = parser.feed(text[i:i + size])
+            self.assertTrue(parser.valid)
+            self.assertEqual(values, expected)
+            self.assertEqual(parser.completed, ["subject", "title", "body"])
+
+        parser = PartialTemplateParser()
+        self.assertEqual(parser.feed('{"subject": "Done", "body": "Half way'), {"subject": "Done", "body": "Half way"})
+        self.assertEqual(parser.completed, ["subject"])
+
+    def test_parser_flags_plain_text(self):
+        parser = PartialTemplateParser()
+        parser.feed("Dear customer, we are thrilled to announce")
+        self.assertFalse(parser.valid)
+
+    def test_stream_from_server_updates_incrementally(self):
+        registry = ClientRegistry()
+        self.addCleanup(registry.close)
+        with FakeLLMServer(latency=0) as server, \
+                mock.patch.object(openai_services, 'get_provider_config', return_value=('test', server.base_url)), \
+                mock.patch.object(openai_services, 'client_registry', registry):
+            updates = list(stream_email_template("- name: Ann", cache=None))
+
+        self.assertGreater(len(updates), 5)
+        self.assertEqual(updates[-1], {"subject": "For Ann", "title": "Hi", "body": "Dear Ann<br>", "cta_text": "Go"})
+        first_subject = next(u for u in updates if u.get("subject"))
+        self.assertTrue("For Ann".startswith(first_subject["subject"]))
+
+    def test_falls_back_when_streaming_is_rejected(self):
+        client = StubClient(json.dumps(TEMPLATE))
+        create = client.chat.completions.create
+
+        def reject_streams(**kwargs):
+            if kwargs.get('stream'):
+                raise openai.APIConnectionError(request=mock.Mock())
+            return create(**kwargs)
+
+        client.chat.completions.create = reject_streams
+        with mock.patch.object(openai_services, 'get_client', return_value=client), \
+                mock.patch('builtins.print'):
+            updates = list(stream_email_template("Pitch", cache=None))
+
+        self.assertEqual(updates, [TEMPLATE])
+        self.assertEqual(client.calls, 1)
+
+
+class TestClientRegistry(unittest.TestCase):
+    def setUp(self):
+        self.registry = ClientRegistry(max_connections=4, max_keepalive_connections=4)
+        self.addCleanup(self.registry.close)
+
+    def test_one_client_per_provider_config(self):
+        configs = {'OpenAI': ('key-a', None), 'OpenRouter': ('key-b', 'https://openrouter.ai/api/v1')}
+        with mock.patch.object(openai_services, 'get_provider_config', side_effect=configs.get):
+            clients = []
+            threads = [threading.Thread(target=lambda: clients.append(self.registry.get('OpenAI')))
+                       for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            openrouter = self.registry.get('OpenRouter')
+
+        self.assertEqual(len({id(client) for client in clients}), 1)
+        self.assertIsNot(openrouter, clients[0])
+
+    def test_generations_reuse_connections(self):
+        with FakeLLMServer(latency=0) as server, \
+                mock.patch.object(openai_services, 'get_provider_config', return_value=('test', server.base_url)), \
+                mock.patch.object(openai_services, 'client_registry', self.registry):
+            for i in range(5):
+                data = generate_email_template(f"- name: Reader {i}", cache=None)
+                self.assertEqual(data['subject'], f"For Reader {i}")
+
+        self.assertEqual(server.requests, 5)
+        self.assertEqual(len(server.connections), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
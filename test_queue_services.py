@@ -0,0 +1,253 @@
+import csv
+import io
+import os
+import smtplib
+import tempfile
+import unittest
+
+from benchmarks.fakes import RecordingSession
+from services.queue_services import CampaignWorker, SendQueue, FAILED, PENDING, RETRYING, SENDING, SENT
+from services.send_services import DailyBudget, RateLimit, SendEngine
+
+
+class EnvelopeSession:
+    """Accepts multi-recipient envelopes, refusing the addresses in ``refuse`` at RCPT TO."""
+
+    def __init__(self, refuse=None):
+        self.refuse = refuse or {}
+        self.envelopes = []
+
+    def sendmail(self, from_addr, to_addrs, msg):
+        self.envelopes.append((list(to_addrs), msg))
+        return {a: self.refuse[a] for a in to_addrs if a in self.refuse}
+
+    def close(self):
+        pass
+
+
+class CrashingEngine:
+    """Delivers through ``engine`` but dies once ``after`` results have come back."""
+
+    def __init__(self, engine, after):
+        self.engine = engine
+        self.after = after
+        self.domain_limits = engine.domain_limits
+        self.budget = engine.budget
+
+    def run(self, jobs):
+        for i, result in enumerate(self.engine.run(jobs)):
+            if i == self.after:
+                raise RuntimeError('worker crashed')
+            yield result
+
+
+def _recipients(n):
+    return [{'email': f'user{i}@example.com', 'name': f'User {i}'} for i in range(n)]
+
+
+class TestSendQueue(unittest.TestCase):
+    def setUp(self):
+        self.queue = SendQueue(':memory:')
+        self.addCleanup(self.queue.close)
+        self.campaign_id = self.queue.create_campaign("Hi [Name]", "<p>Hello [Name]</p>", [("a.txt", b"data")])
+
+    def _engine_factory(self, session):
+        return lambda: SendEngine(workers=2, host='queue.test', rate_limit=RateLimit(per_second=1000, burst=1000),
+                                  session_factory=lambda: session)
+
+    def test_campaign_id_is_stable_and_enqueue_is_idempotent(self):
+        again = self.queue.create_campaign("Hi [Name]", "<p>Hello [Name]</p>", [("a.txt", b"data")])
+        self.assertEqual(again, self.campaign_id)
+        renamed = self.queue.create_campaign("Hi [Name]", "<p>Hello [Name]</p>", [("a.txt", b"data")], name='June')
+        self.assertNotEqual(renamed, self.campaign_id)
+        self.assertEqual(self.queue.enqueue(renamed, _recipients(3)), 3)
+
+        self.assertEqual(self.queue.enqueue(self.campaign_id, _recipients(3)), 3)
+        self.assertEqual(self.queue.enqueue(self.campaign_id, _recipients(5)), 2)
+        self.assertEqual(self.queue.counts(self.campaign_id)[PENDING], 5)
+
+    def test_claim_in_order_and_recover(self):
+        self.queue.enqueue(self.campaign_id, _recipients(5))
+        claimed = self.queue.claim(self.campaign_id, 2)
+
+        self.assertEqual([m.email for m in claimed], ['user0@example.com', 'user1@example.com'])
+        self.assertEqual(self.queue.counts(self.campaign_id)[SENDING], 2)
+        self.assertEqual(self.queue.recover(self.campaign_id), 2)
+        self.assertEqual([m.email for m in self.queue.claim(self.campaign_id, 1)], ['user0@example.com'])
+
+    def test_worker_drains_and_reports(self):
+        self.queue.enqueue(self.campaign_id, _recipients(10))
+        session = RecordingSession(reject={'user3@example.com'})
+        worker = CampaignWorker(self.queue, self.campaign_id, self._engine_factory(session), batch_size=4)
+        worker.run()
+
+        counts = self.queue.counts(self.campaign_id)
+        self.assertEqual((counts[SENT], counts[FAILED]), (9, 1))
+        self.assertIn(b'Hello User 0', dict(session.sent)['user0@example.com'])
+
+        rows = list(csv.reader(io.StringIO(self.queue.report_csv(self.campaign_id).decode('utf-8'))))
+        self.assertEqual(rows[0], ['Email', 'Name', 'Status', 'Timestamp', 'Attempts', 'Error'])
+        self.assertEqual(len(rows), 11)
+        self.assertEqual(rows[4][:3], ['user3@example.com', 'User 3', 'Failed'])
+
+    def test_resume_does_not_resend(self):
+        self.queue.enqueue(self.campaign_id, _recipients(6))
+        first = RecordingSession()
+        # Simulate a run that stopped after the first batch
+        for message in self.queue.claim(self.campaign_id, 3):
+            first.sendmail(None, [message.email], '')
+            self.queue.mark(message.seq, SENT)
+
+        second = RecordingSession()
+        CampaignWorker(self.queue, self.campaign_id, self._engine_factory(second)).run()
+
+        self.assertEqual(sorted(addr for addr, _ in second.sent),
+                         ['user3@example.com', 'user4@example.com', 'user5@example.com'])
+        self.assertEqual(self.queue.counts(self.campaign_id)[SENT], 6)
+
+    def test_worker_records_delivered_messages_when_it_dies(self):
+        self.queue.enqueue(self.campaign_id, _recipients(6))
+        first = RecordingSession()
+        engine_factory = self._engine_factory(first)
+        worker = CampaignWorker(self.queue, self.campaign_id, lambda: CrashingEngine(engine_factory(), after=4),
+                                flush_every=100, flush_interval=60)
+        worker.run()
+
+        self.assertIsInstance(worker.error, RuntimeError)
+        recorded = [row[0] for row in self.queue.iter_report(self.campaign_id) if row[2] == 'Sent']
+        self.assertEqual(len(recorded), 4)
+
+        second = RecordingSession()
+        CampaignWorker(self.queue, self.campaign_id, self._engine_factory(second)).run()
+        self.assertEqual(set(addr for addr, _ in second.sent) & set(recorded), set())
+        self.assertEqual(self.queue.counts(self.campaign_id)[SENT], 6)
+
+    def test_daily_limit_leaves_the_rest_queued_for_another_day(self):
+        self.queue.enqueue(self.campaign_id, _recipients(5))
+
+        def engine_factory(session, budget):
+            def factory():
+                engine = self._engine_factory(session)()
+                engine.budget = budget
+                return engine
+            return factory
+
+        first = RecordingSession()
+        worker = CampaignWorker(self.queue, self.campaign_id, engine_factory(first, DailyBudget(2)), batch_size=2)
+        worker.run()
+        counts = self.queue.counts(self.campaign_id)
+        self.assertTrue(worker.budget_exhausted)
+        self.assertEqual((counts[SENT], counts[FAILED], counts[PENDING]), (2, 0, 3))
+        self.assertEqual(self.queue.sent_today(), 2)
+
+        # A restarted process starts a new in-memory budget, but today's recorded sends still count
+        restarted = RecordingSession()
+        worker = CampaignWorker(self.queue, self.campaign_id, engine_factory(restarted, DailyBudget(2)))
+        worker.run()
+        self.assertTrue(worker.budget_exhausted)
+        self.assertEqual(restarted.sent, [])
+
+        # The next day
+        with self.queue._conn:
+            self.queue._conn.execute("UPDATE messages SET updated_at = updated_at - 86400")
+        second = RecordingSession()
+        CampaignWorker(self.queue, self.campaign_id, engine_factory(second, DailyBudget(2))).run()
+        self.assertEqual(len(second.sent), 2)
+        self.assertEqual(set(first.sent) & set(second.sent), set())
+        self.assertEqual(self.queue.counts(self.campaign_id)[SENT], 4)
+
+    def test_rejected_login_leaves_messages_queued(self):
+        self.queue.enqueue(self.campaign_id, _recipients(30))
+
+        class LockedOutSession(RecordingSession):
+            def sendmail(self, from_addr, to_addrs, msg):
+                raise smtplib.SMTPAuthenticationError(535, b'Username and Password not accepted')
+
+        worker = CampaignWorker(self.queue, self.campaign_id, self._engine_factory(LockedOutSession()), batch_size=10)
+        worker.run()
+        counts = self.queue.counts(self.campaign_id)
+        self.assertIn('535', str(worker.error))
+        self.assertEqual((counts[SENT], counts[FAILED], counts[PENDING]), (0, 0, 30))
+
+        # Once the password is fixed, sending again picks every message up
+        fixed = RecordingSession()
+        CampaignWorker(self.queue, self.campaign_id, self._engine_factory(fixed)).run()
+        self.assertEqual(len(fixed.sent), 30)
+        self.assertEqual(self.queue.counts(self.campaign_id)[SENT], 30)
+
+    def test_identical_messages_share_envelopes(self):
+        campaign_id = self.queue.create_campaign("Announcement", "<p>Hello everyone</p>")
+        self.queue.enqueue(campaign_id, _recipients(7))
+        session = EnvelopeSession(refuse={'user2@example.com': (550, b'No such user')})
+        CampaignWorker(self.queue, campaign_id, self._engine_factory(session), max_recipients=3).run()
+
+        self.assertEqual([len(to) for to, _ in session.envelopes], [3, 3, 1])
+        self.assertIn(b'To: undisclosed-recipients:;', session.envelopes[0][1])
+        rows = {row[0]: row for row in csv.reader(io.StringIO(self.queue.report_csv(campaign_id).decode('utf-8')))}
+        self.assertEqual(rows['user2@example.com'][2], 'Failed')
+        self.assertIn('550', rows['user2@example.com'][5])
+        self.assertEqual(self.queue.counts(campaign_id)[SENT], 6)
+
+    def test_personalized_messages_are_not_batched(self):
+        self.queue.enqueue(self.campaign_id, _recipients(4))
+        session = EnvelopeSession()
+        CampaignWorker(self.queue, self.campaign_id, self._engine_factory(session)).run()
+
+        self.assertEqual(sorted(to[0] for to, _ in session.envelopes), [f'user{i}@example.com' for i in range(4)])
+        self.assertTrue(all(len(to) == 1 for to, _ in session.envelopes))
+
+    def test_worker_renders_personalized_messages_on_processes(self):
+        self.queue.enqueue(self.campaign_id, _recipients(12))
+        session = RecordingSession(reject={'user5@example.com'})
+        CampaignWorker(self.queue, self.campaign_id, self._engine_factory(session), render_processes=2).run()
+
+        counts = self.queue.counts(self.campaign_id)
+        self.assertEqual((counts[SENT], counts[FAILED]), (11, 1))
+        payload = dict(session.sent)['user3@example.com']
+        self.assertIsInstance(payload, bytes)
+        self.assertIn(b'Hello User 3', payload)
+
+    def test_cached_counts_follow_every_change(self):
+        def fresh_counts():
+            other = SendQueue.__new__(SendQueue)
+            other._conn, other._lock, other._counts = self.queue._conn, self.queue._lock, {}
+            return other.counts(self.campaign_id)
+
+        self.queue.enqueue(self.campaign_id, _recipients(5))
+        self.assertEqual(self.queue.counts(self.campaign_id)[PENDING], 5)
+        self.queue.enqueue(self.campaign_id, _recipients(8))
+        claimed = self.queue.claim(self.campaign_id, 4)
+        self.queue.mark_many([(claimed[0].seq, SENT, None, 1), (claimed[1].seq, FAILED, '550', 1)])
+        self.queue.recover(self.campaign_id)
+        self.queue.claim(self.campaign_id, 1)
+
+        counts = self.queue.counts(self.campaign_id)
+        self.assertEqual(counts, fresh_counts())
+        self.assertEqual((counts[PENDING], counts[SENDING], counts[RETRYING], counts['total']), (4, 1, 1, 8))
+
+    def test_report_streams_to_csv_and_parquet_files(self):
+        import pyarrow.parquet as pq
+
+        self.queue.enqueue(self.campaign_id, _recipients(7))
+        [message] = self.queue.claim(self.campaign_id, 1)
+        self.queue.mark(message.seq, FAILED, "550 b'No such user'")
+        with tempfile.TemporaryDirectory() as tmp:
+            csv_path = os.path.join(tmp, 'reports', 'status.csv')
+            parquet_path = os.path.join(tmp, 'status.parquet')
+            self.queue.write_report(self.campaign_id, csv_path, 'csv')
+            self.queue.write_report(self.campaign_id, parquet_path, 'parquet')
+
+            with open(csv_path, 'rb') as f:
+                self.assertEqual(f.read(), self.queue.report_csv(self.campaign_id))
+            table = pq.read_table(parquet_path)
+            self.assertEqual(table.column_names, ['Email', 'Name', 'Status', 'Timestamp', 'Attempts', 'Error'])
+            self.assertEqual(table.num_rows, 7)
+            self.assertEqual(table.column('Status')[0].as_py(), 'Failed')
+            self.assertEqual(table.column('Error')[0].as_py(), "550 b'No such user'")
+            self.assertEqual(sorted(os.listdir(tmp)), ['reports', 'status.parquet'])
+        with self.assertRaises(ValueError):
+            self.queue.write_report(self.campaign_id, io.BytesIO(), 'xlsx')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import unittest
+
+from services.email_services import PreparedAttachment, attach_wire
+from services.render_services import RenderPool, render_heads
+from services.template_services import CompiledTemplate, compile_for_recipients
+
+
+def _records(n):
+    return [{'email': f'user{i}@example.com', 'name': f'User {i}'} for i in range(n)]
+
+
+def _templates():
+    fields = ('email', 'name')
+    return (CompiledTemplate.compile("Hi [Name]", fields),
+            compile_for_recipients("<p>Hello [Name] &amp; welcome</p>", fields))
+
+
+class TestRenderHeads(unittest.TestCase):
+    def test_renders_personalized_wire_heads(self):
+        subject, body = _templates()
+        attachment = PreparedAttachment.from_bytes('a.txt', b'data')
+        [(first, boundary), (second, _)] = render_heads(_records(2), subject, body)
+
+        self.assertIsInstance(first, bytes)
+        self.assertIn(b'Subject: Hi User 0\r\n', first)
+        self.assertIn(b'To: user1@example.com\r\n', second)
+        self.assertNotIn(b'\n', first.replace(b'\r\n', b''))
+        self.assertIn(b'filename="a.txt"', attach_wire(first, boundary, [attachment.wire]))
+
+    def test_bad_record_fails_alone(self):
+        subject, body = _templates()
+        records = _records(3)
+        records[1]['name'] = "Bob\nBcc: x@example.com"
+        first, bad, last = render_heads(records, subject, body)
+
+        self.assertIsNone(bad[0])
+        self.assertIn('Could not render message', bad[1])
+        self.assertIn(b'Subject: Hi User 2\r\n', last[0])
+
+
+class TestRenderPool(unittest.TestCase):
+    def test_pool_keeps_input_order_across_processes(self):
+        subject, body = _templates()
+        records = _records(25)
+        pool = RenderPool(subject, body, processes=2, batch_size=4, max_pending=2)
+        jobs = list(pool.render((i, r) for i, r in enumerate(records)))
+
+        self.assertEqual([job.ref for job in jobs], list(range(25)))
+        self.assertEqual(jobs[7].to_addrs, ['user7@example.com'])
+        self.assertIn(b'Subject: Hi User 7\r\n', jobs[7].payload)
+        self.assertTrue(all(job.payload.endswith(b'\r\n') for job in jobs))
+
+    def test_pool_jobs_leave_attachments_to_the_sender(self):
+        subject, body = _templates()
+        attachment = PreparedAttachment.from_bytes('big.bin', b'x' * 100000)
+        [job] = RenderPool(subject, body, (attachment,), processes=1).render(enumerate(_records(1)))
+
+        self.assertLess(len(job.payload), len(attachment.wire))
+        self.assertEqual(job.attachments, (attachment,))
+        message = attach_wire(job.payload, job.boundary, [attachment.wire])
+        self.assertIn(attachment.wire, message)
+        self.assertTrue(message.endswith(f"--{job.boundary}--\r\n".encode('ascii')))
+
+    def test_pool_reports_records_it_cannot_render(self):
+        subject, body = _templates()
+        records = _records(6)
+        records[2]['name'] = "Bob\nBcc: x@example.com"
+        jobs = list(RenderPool(subject, body, processes=2, batch_size=4).render(enumerate(records)))
+
+        self.assertEqual([job.ref for job in jobs], list(range(6)))
+        self.assertIn('Could not render message', jobs[2].render_error)
+        self.assertIsNone(jobs[2].payload)
+        self.assertIn(b'Subject: Hi User 3\r\n', jobs[3].payload)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import email
+import os
+import threading
+import unittest
+from datetime import datetime, timezone
+from unittest import mock
+
+import scheduler_logic
+from benchmarks.fakes import RecordingSession
+from scheduler_logic import InviteRenderer, sanitize_ai_html, send_meeting_invite
+from services.send_services import RateLimit, SendEngine
+
+
+START = datetime(2025, 3, 4, 15, 30, tzinfo=timezone.utc)
+END = datetime(2025, 3, 4, 16, 0, tzinfo=timezone.utc)
+
+
+class StubAI:
+    def __init__(self, body="Looking forward to it.\n\nWe will demo the <b>new</b> dashboards."):
+        self.body = body
+        self.prompts = []
+        self.lock = threading.Lock()
+
+    def __call__(self, prompt, **kwargs):
+        with self.lock:
+            self.prompts.append(prompt)
+        if self.body is None:
+            return {"subject": "Error", "title": "Error Generating Email", "body": "An error occurred: boom",
+                    "cta_text": "Retry"}
+        return {"subject": "Invite", "title": "Demo", "body": self.body, "cta_text": "Join"}
+
+
+class TestSanitize(unittest.TestCase):
+    def test_single_pass_cleanup(self):
+        text = ('  Hi team,\n\n  <p onclick="x()">Agenda</p>\n<img src=x onerror=alert(1)><BR/>Bring notes\n'
+                '<script type="application/ld+json">{"@type": "Event"}</script>Thanks<style>p{}</style>')
+
+        self.assertEqual(sanitize_ai_html(text),
+                         "Hi team,<br><p>Agenda</p><br><br>Bring notes<br>Thanks")
+
+    def test_unclosed_script_drops_the_rest(self):
+        self.assertEqual(sanitize_ai_html("See you\n<script>var a = 1;\nmore"), "See you<br>")
+
+
+class TestMeetingInvites(unittest.TestCase):
+    def setUp(self):
+        self.ai = StubAI()
+        patcher = mock.patch.object(scheduler_logic, 'generate_email_template', self.ai)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        env = mock.patch.dict(os.environ, {'EMAIL_ADDRESS': 'organizer@example.com'})
+        env.start()
+        self.addCleanup(env.stop)
+        self.renderer = InviteRenderer()
+        self.session = RecordingSession()
+
+    def _send(self, recipients, notes="", body="Fallback body"):
+        def engine_factory():
+            return SendEngine(workers=2, host='scheduler.test', rate_limit=RateLimit(per_second=1000, burst=1000),
+                              session_factory=lambda: self.session)
+        return send_meeting_invite("Demo invite", body, recipients, "Product demo", START, END, notes,
+                                   engine_factory=engine_factory, renderer=self.renderer)
+
+    def test_body_generated_once_and_sent_to_every_attendee(self):
+        recipients = [f"user{i}@example.com" for i in range(5)]
+        self.assertTrue(self._send(recipients))
+        self.assertTrue(self._send(recipients[:2]))
+
+        self.assertEqual(len(self.ai.prompts), 1)
+        self.assertEqual(len(self.session.sent), 7)
+        sent = dict(self.session.sent)
+        message = email.message_from_bytes(sent["user3@example.com"])
+        html_part, invite = message.get_payload()
+        html_body = html_part.get_payload()[0].get_payload(decode=True).decode()
+        self.assertIn("We will demo the <b>new</b> dashboards.", html_body)
+        self.assertIn(scheduler_logic.INVITE_FOOTER, html_body)
+        self.assertEqual(invite.get_content_type(), "text/calendar")
+        self.assertIn(b"mailto:user3@example.com", invite.get_payload(decode=True))
+
+    def test_new_notes_regenerate(self):
+        self._send(["a@example.com"], notes="Agenda v1")
+        self._send(["a@example.com"], notes="Agenda v2")
+
+        self.assertEqual(len(self.ai.prompts), 2)
+        self.assertIn("Agenda v2", self.ai.prompts[1])
+
+    def test_ai_failure_uses_fallback_and_is_not_memoized(self):
+        self.ai.body = None
+        with mock.patch('builtins.print'):
+            self._send(["a@example.com"], body="Plain invite")
+        self.ai.body = "AI body"
+        self._send(["a@example.com"], body="Plain invite")
+
+        first, second = (email.message_from_bytes(msg).get_payload()[0] for _, msg in self.session.sent)
+        self.assertIn("Plain invite", first.get_payload()[0].get_payload(decode=True).decode())
+        self.assertIn("AI body", second.get_payload()[0].get_payload(decode=True).decode())
+        self.assertEqual(len(self.ai.prompts), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,422 @@
+import email
+import smtplib
+import threading
+import time
+import unittest
+
+from services.send_services import (
+    BOUNCED, PERMANENT, QUOTA, SESSION, TRANSIENT, DomainLimit, DomainScheduler, RateLimit, RetryScheduler, SendEngine, SendJob,
+    TokenBucket, DailyBudget, batch_jobs, classify_failure, parse_domain_limits,
+)
+from services.email_services import PreparedAttachment, render_head, to_wire
+from services.suppression_services import BOUNCE, SuppressionList
+
+
+class FakeSession:
+    """SMTPSession stand-in; ``script`` maps an address to a list of exceptions to raise in turn."""
+
+    def __init__(self, script=None):
+        self.script = script or {}
+        self.sent = []
+        self.closed = 0
+        self.lock = threading.Lock()
+
+    def sendmail(self, from_addr, to_addrs, msg):
+        errors = self.script.get(to_addrs[0])
+        if errors:
+            raise errors.pop(0)
+        with self.lock:
+            self.sent.append(to_addrs[0])
+        return {}
+
+    def close(self):
+        self.closed += 1
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def _jobs(n):
+    return [SendJob([f"user{i}@example.com"], "Subject", "<p>Hi</p>", ref=i) for i in range(n)]
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_bucket_paces_to_rate(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=2.0, capacity=1, clock=clock, sleep=clock.sleep)
+        for _ in range(5):
+            bucket.acquire()
+        # First token is free, the next four each take half a second
+        self.assertAlmostEqual(clock.now, 2.0)
+
+    def test_daily_budget(self):
+        day = [1]
+        budget = DailyBudget(3, today=lambda: day[0])
+        self.assertEqual((budget.take(2), budget.take(2), budget.take(1)), (2, 1, 0))
+        day[0] = 2
+        self.assertEqual(budget.take(5), 3)
+
+        # Sends recorded elsewhere today raise the count; they already include this process's own
+        day[0] = 3
+        budget.take(1)
+        budget.seed(2)
+        self.assertEqual(budget.take(5), 1)
+        budget.seed(1)
+        self.assertEqual(budget.take(5), 0)
+
+
+class TestRetryScheduling(unittest.TestCase):
+    def test_classify_failure(self):
+        self.assertEqual(classify_failure(smtplib.SMTPResponseException(421, b'Busy')), (421, TRANSIENT))
+        self.assertEqual(classify_failure(smtplib.SMTPResponseException(452, b'Full')), (452, TRANSIENT))
+        self.assertEqual(classify_failure(smtplib.SMTPRecipientsRefused({'a@example.com': (550, b'No such user')})),
+                         (550, BOUNCED))
+        self.assertEqual(classify_failure(smtplib.SMTPDataError(550, b'Content rejected')), (550, PERMANENT))
+        self.assertEqual(classify_failure(smtplib.SMTPResponseException(552, b'Too big')), (552, PERMANENT))
+        self.assertEqual(classify_failure(smtplib.SMTPAuthenticationError(535, b'Bad login')), (535, SESSION))
+        self.assertEqual(classify_failure(smtplib.SMTPSenderRefused(550, b'Not allowed', 'me@example.com')),
+                         (550, SESSION))
+        self.assertEqual(classify_failure(smtplib.SMTPResponseException(530, b'Must issue STARTTLS')), (530, SESSION))
+        self.assertEqual(classify_failure(smtplib.SMTPSenderRefused(451, b'Try later', 'me@example.com')),
+                         (451, TRANSIENT))
+        self.assertEqual(classify_failure(ConnectionResetError()), (None, TRANSIENT))
+        self.assertEqual(classify_failure(ValueError('bad')), (None, PERMANENT))
+
+    def test_scheduler_releases_items_in_due_order(self):
+        clock = FakeClock()
+        retries = RetryScheduler(clock)
+        retries.schedule('late', 5)
+        retries.schedule('early', 1)
+        retries.schedule('also-early', 1)
+
+        self.assertEqual(retries.pop_due(), [])
+        self.assertEqual(retries.next_delay(), 1)
+        clock.sleep(1)
+        self.assertEqual(retries.pop_due(), ['early', 'also-early'])
+        clock.sleep(10)
+        self.assertEqual(retries.next_delay(), 0)
+        self.assertEqual(retries.pop_due(), ['late'])
+        self.assertIsNone(retries.next_delay())
+
+
+class TestDomainScheduler(unittest.TestCase):
+    def test_parse_domain_limits(self):
+        self.assertEqual(parse_domain_limits("Gmail.com=2:1.5, yahoo.com=1,example.org=0:3"), {
+            'gmail.com': DomainLimit(2, 1.5),
+            'yahoo.com': DomainLimit(1, None),
+            'example.org': DomainLimit(None, 3.0),
+        })
+
+    def test_domains_take_turns_under_concurrency_caps(self):
+        domains = DomainScheduler({'gmail.com': DomainLimit(concurrency=2)}, default_concurrency=10)
+        for i in range(4):
+            domains.push('gmail.com', f'g{i}')
+        domains.push('a.com', 'a0')
+        domains.push('b.com', 'b0')
+
+        started = [domains.pop_ready()[1] for _ in range(4)]
+        self.assertEqual(started, ['g0', 'a0', 'b0', 'g1'])
+        # Two gmail messages are in flight, so gmail has to wait
+        self.assertIsNone(domains.pop_ready())
+        domains.finished('gmail.com')
+        self.assertEqual(domains.pop_ready(), ('gmail.com', 'g2'))
+
+    def test_pacing_and_adaptation_to_deferrals(self):
+        clock = FakeClock()
+        domains = DomainScheduler({'gmail.com': DomainLimit(concurrency=4, per_second=2.0)}, clock=clock)
+        for i in range(3):
+            domains.push('gmail.com', i)
+        self.assertEqual(domains.pop_ready(), ('gmail.com', 0))
+        self.assertIsNone(domains.pop_ready())
+        self.assertAlmostEqual(domains.next_delay(), 0.5)
+
+        domains.finished('gmail.com', deferred=True)
+        self.assertEqual(domains.caps('gmail.com'), (1.0, 1.0))
+        for _ in range(40):
+            domains.finished('gmail.com')
+        self.assertEqual(domains.caps('gmail.com'), (4.0, 2.0))
+
+
+class TestBatchJobs(unittest.TestCase):
+    def test_identical_jobs_are_grouped_up_to_the_limit(self):
+        jobs = [SendJob([f"user{i}@example.com"], "News", "<p>Same</p>", ref=i) for i in range(5)]
+        batches = list(batch_jobs(jobs, max_recipients=2))
+
+        self.assertEqual([len(b.to_addrs) for b in batches], [2, 2, 1])
+        self.assertEqual(batches[0].to_header, 'undisclosed-recipients:;')
+        self.assertEqual(batches[0].ref, {'user0@example.com': 0, 'user1@example.com': 1})
+        # A lone recipient keeps their own address in the To header
+        self.assertIsNone(batches[2].to_header)
+        self.assertEqual(batches[2].ref, {'user4@example.com': 4})
+
+    def test_capped_domains_get_envelopes_of_their_own(self):
+        domains = ['gmail.com', 'corp.example', 'gmail.com', 'yahoo.com', 'other.example', 'gmail.com']
+        jobs = [SendJob([f"user{i}@{d}"], "News", "<p>Same</p>", ref=i) for i, d in enumerate(domains)]
+        limits = {'gmail.com': DomainLimit(concurrency=2), 'yahoo.com': DomainLimit(per_second=1.0),
+                  'corp.example': DomainLimit()}
+        batches = list(batch_jobs(jobs, max_recipients=2, domain_limits=limits))
+
+        # corp.example has no caps, so it shares an envelope with the other uncapped domain
+        self.assertEqual(sorted(sorted(b.ref.values()) for b in batches), [[0, 2], [1, 4], [3], [5]])
+
+    def test_uncapped_domains_fill_envelopes_together(self):
+        jobs = [SendJob([f"user{i}@corp{i}.example"], "News", "<p>Same</p>", ref=i) for i in range(1000)]
+        batches = list(batch_jobs(jobs, max_recipients=100, domain_limits={}))
+
+        self.assertEqual([len(b.to_addrs) for b in batches], [100] * 10)
+
+    def test_held_addresses_are_capped_by_the_window(self):
+        limits = {f"corp{i}.example": DomainLimit(concurrency=1) for i in range(6)}
+        jobs = [SendJob([f"user{i}@corp{i}.example"], "News", "<p>Same</p>", ref=i) for i in range(6)]
+        batches = batch_jobs(jobs, max_recipients=10, window=2, domain_limits=limits)
+
+        # With every address on its own capped domain, the oldest goes out as soon as a third is held
+        self.assertEqual(next(batches).to_addrs, ['user0@corp0.example'])
+        self.assertEqual(len(list(batches)), 5)
+
+    def test_different_content_starts_a_new_envelope(self):
+        jobs = [SendJob([f"user{i}@example.com"], "Hi", f"<p>Hi User {i}</p>", ref=i) for i in range(3)]
+        self.assertEqual([b.to_addrs for b in batch_jobs(jobs)], [[f"user{i}@example.com"] for i in range(3)])
+
+
+class EnvelopeSession:
+    """Refuses addresses at RCPT TO; ``script`` maps an address to the replies for successive attempts."""
+
+    def __init__(self, script):
+        self.script = script
+        self.envelopes = []
+        self.messages = []
+        self.lock = threading.Lock()
+
+    def sendmail(self, from_addr, to_addrs, msg):
+        with self.lock:
+            self.envelopes.append(list(to_addrs))
+            self.messages.append(msg)
+        refused = {a: self.script[a].pop(0) for a in to_addrs if self.script.get(a)}
+        if len(refused) == len(to_addrs):
+            raise smtplib.SMTPRecipientsRefused(refused)
+        return refused
+
+    def close(self):
+        pass
+
+
+class ConcurrencySession:
+    """Records the most messages in flight at once, overall and per recipient domain."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = {}
+        self.peak = {}
+        self.overall_peak = 0
+
+    def sendmail(self, from_addr, to_addrs, msg):
+        domain = to_addrs[0].rpartition('@')[2]
+        with self.lock:
+            self.active[domain] = self.active.get(domain, 0) + 1
+            self.peak[domain] = max(self.peak.get(domain, 0), self.active[domain])
+            self.overall_peak = max(self.overall_peak, sum(self.active.values()))
+        time.sleep(0.005)
+        with self.lock:
+            self.active[domain] -= 1
+        return {}
+
+    def close(self):
+        pass
+
+
+class TestSendEngine(unittest.TestCase):
+    def _engine(self, session, host, **kwargs):
+        clock = FakeClock()
+        return SendEngine(workers=3, host=host, rate_limit=RateLimit(per_second=1000, burst=1000),
+                          session_factory=lambda: session, sleep=clock.sleep, clock=clock, **kwargs)
+
+    def test_sends_all_jobs_and_reports_progress(self):
+        session = FakeSession()
+        progress = []
+        results = list(self._engine(session, 'all.test').run(_jobs(20), progress=lambda d, t: progress.append((d, t))))
+
+        self.assertEqual(len(results), 20)
+        self.assertTrue(all(r.ok for r in results))
+        self.assertEqual(sorted(session.sent), sorted(f"user{i}@example.com" for i in range(20)))
+        self.assertEqual(progress[-1], (20, 20))
+
+    def test_retries_transient_codes_and_fails_permanent(self):
+        session = FakeSession({
+            'user0@example.com': [smtplib.SMTPResponseException(450, b'Greylisted')],
+            'user1@example.com': [smtplib.SMTPRecipientsRefused({'user1@example.com': (550, b'No such user')})],
+        })
+        results = {r.job.ref: r for r in self._engine(session, 'retry.test').run(_jobs(2))}
+
+        self.assertTrue(results[0].ok)
+        self.assertEqual(results[0].attempts, 2)
+        self.assertFalse(results[1].ok)
+        self.assertIn('refused', results[1].error)
+        self.assertEqual(results[1].smtp_code, 550)
+        self.assertEqual(results[1].failure, BOUNCED)
+
+    def test_waiting_retry_does_not_hold_up_other_jobs(self):
+        session = FakeSession({'user0@example.com': [smtplib.SMTPResponseException(451, b'Try later')]})
+        order = [r.job.ref for r in self._engine(session, 'order.test').run(_jobs(10))]
+
+        self.assertEqual(order[-1], 0)
+        self.assertEqual(session.sent[-1], 'user0@example.com')
+
+    def test_gives_up_after_max_retries(self):
+        session = FakeSession({'user0@example.com': [smtplib.SMTPServerDisconnected('gone')] * 5})
+        [result] = self._engine(session, 'giveup.test', max_retries=2).run(_jobs(1))
+
+        self.assertFalse(result.ok)
+        self.assertEqual(result.attempts, 3)
+        self.assertEqual(result.failure, TRANSIENT)
+        self.assertIsNone(result.smtp_code)
+        self.assertEqual(session.closed, 3 + 1)
+
+    def test_bounces_are_suppressed(self):
+        session = FakeSession({
+            'user0@example.com': [smtplib.SMTPRecipientsRefused({'user0@example.com': (550, b'Unknown user')})],
+            'user1@example.com': [smtplib.SMTPResponseException(554, b'Transaction failed')],
+        })
+        with SuppressionList(':memory:') as suppression:
+            results = {r.job.ref: r for r in self._engine(session, 'bounce.test', suppression=suppression)
+                       .run(_jobs(3))}
+
+            self.assertEqual(results[0].failure, BOUNCED)
+            self.assertEqual(results[1].failure, PERMANENT)
+            self.assertTrue(results[2].ok)
+            self.assertEqual(suppression.reason('user0@example.com'), BOUNCE)
+            self.assertNotIn('user1@example.com', suppression)
+
+    def test_content_rejection_does_not_suppress_the_envelope(self):
+        session = FakeSession({'a@example.com': [smtplib.SMTPDataError(550, b'Message rejected as spam')]})
+        job = SendJob(['a@example.com', 'b@example.com'], "News", "<p>Same</p>", to_header='undisclosed-recipients:;')
+        with SuppressionList(':memory:') as suppression:
+            [result] = self._engine(session, 'data.test', suppression=suppression).run([job])
+
+            self.assertEqual(result.failure, PERMANENT)
+            self.assertNotIn('a@example.com', suppression)
+            self.assertNotIn('b@example.com', suppression)
+
+    def test_partial_refusals_are_settled_per_address(self):
+        with SuppressionList(':memory:') as suppression:
+            session = EnvelopeSession({
+                'a@example.com': [(450, b'Greylisted')],
+                'b@example.com': [(550, b'No such user')],
+            })
+            job = SendJob(['a@example.com', 'b@example.com', 'c@example.com'], "News", "<p>Same</p>",
+                          to_header='undisclosed-recipients:;')
+            progress = []
+            results = list(self._engine(session, 'partial.test', suppression=suppression)
+                           .run([job], progress=lambda d, t: progress.append((d, t))))
+
+            first, retried = results
+            self.assertEqual(first.recipient_status('c@example.com'), (True, None))
+            self.assertFalse(first.recipient_status('b@example.com')[0])
+            self.assertNotIn('a@example.com', first.job.to_addrs)
+            self.assertEqual(retried.job.to_addrs, ['a@example.com'])
+            self.assertTrue(retried.ok)
+            self.assertEqual(retried.attempts, 2)
+            self.assertEqual(session.envelopes[-1], ['a@example.com'])
+            self.assertEqual(progress, [(1, 1)])
+            self.assertEqual(suppression.reason('b@example.com'), BOUNCE)
+
+    def test_pre_rendered_heads_get_attachments_spliced_at_send_time(self):
+        attachment = PreparedAttachment.from_bytes('a.txt', b'data')
+        head, boundary = render_head("Hi", "<p>Hi</p>", ['user0@example.com'])
+        job = SendJob(['user0@example.com'], '', '', (attachment,), ref=0, payload=to_wire(head), boundary=boundary)
+        session = EnvelopeSession({})
+        [result] = self._engine(session, 'splice.test').run([job])
+
+        self.assertTrue(result.ok)
+        [sent] = session.messages
+        self.assertTrue(sent.startswith(job.payload))
+        self.assertIn(attachment.wire, sent)
+        self.assertEqual(email.message_from_bytes(sent).get_payload()[1].get_filename(), 'a.txt')
+
+    def test_render_errors_fail_only_their_job(self):
+        session = FakeSession()
+        jobs = _jobs(3)
+        jobs[1] = SendJob(['user1@example.com'], "Hi Bob\nBcc: x@example.com", "<p>Hi</p>", ref=1)
+        results = {r.job.ref: r for r in self._engine(session, 'render.test').run(jobs)}
+
+        self.assertFalse(results[1].ok)
+        self.assertEqual(results[1].failure, PERMANENT)
+        self.assertIn('Could not render message', results[1].error)
+        self.assertEqual(sorted(session.sent), ['user0@example.com', 'user2@example.com'])
+
+    def test_domain_caps_hold_while_other_domains_keep_sending(self):
+        session = ConcurrencySession()
+        jobs = [SendJob([f"user{i}@{'gmail.com' if i % 5 < 2 else f'corp{i}.example'}"], "Hi", "<p>Hi</p>")
+                for i in range(40)]
+        engine = SendEngine(workers=4, host='domains.test', rate_limit=RateLimit(per_second=1000, burst=1000),
+                            session_factory=lambda: session, domain_limits={'gmail.com': DomainLimit(concurrency=1)})
+        results = list(engine.run(jobs))
+
+        self.assertTrue(all(r.ok for r in results))
+        self.assertEqual(session.peak['gmail.com'], 1)
+        self.assertGreater(session.overall_peak, 1)
+
+    def test_daily_limit_stops_sending(self):
+        session = FakeSession()
+        engine = SendEngine(workers=1, host='daily.test',
+                            rate_limit=RateLimit(per_second=1000, per_day=3, burst=1000),
+                            session_factory=lambda: session)
+        results = list(engine.run(_jobs(5)))
+
+        self.assertEqual(sum(r.ok for r in results), 3)
+        self.assertEqual(len(session.sent), 3)
+        self.assertEqual([r.failure for r in results if not r.ok], [QUOTA, QUOTA])
+
+    def test_rejected_login_stops_the_run(self):
+        attempts = []
+
+        class LockedOutSession(FakeSession):
+            def sendmail(self, from_addr, to_addrs, msg):
+                attempts.append(to_addrs[0])
+                raise smtplib.SMTPAuthenticationError(535, b'Username and Password not accepted')
+
+        progress = []
+        results = list(self._engine(LockedOutSession(), 'login.test').run(
+            _jobs(200), progress=lambda d, t: progress.append(d)))
+
+        self.assertLessEqual(len(attempts), 3 * 4)
+        self.assertEqual(len(results), 200)
+        self.assertEqual({r.failure for r in results}, {SESSION})
+        self.assertEqual(sorted(r.job.ref for r in results), list(range(200)))
+        self.assertEqual(progress[-1], 200)
+
+    def test_explicit_rate_limit_is_honoured_for_a_known_host(self):
+        first = SendEngine(host='shared.test', rate_limit=RateLimit(per_second=1, per_day=2))
+        same = SendEngine(host='SHARED.test', rate_limit=RateLimit(per_second=1, per_day=2))
+        other = SendEngine(host='shared.test', rate_limit=RateLimit(per_second=5))
+
+        self.assertIs(same.budget, first.budget)
+        self.assertIsNot(other.budget, first.budget)
+        self.assertIsNone(other.budget.limit)
+        self.assertEqual(other.bucket.rate, 5)
+
+    def test_daily_limit_splits_an_envelope(self):
+        session = EnvelopeSession({})
+        engine = self._engine(session, 'split.test')
+        engine.budget = DailyBudget(2)
+        job = SendJob(['a@example.com', 'b@example.com', 'c@example.com'], "News", "<p>Same</p>",
+                      to_header='undisclosed-recipients:;')
+        progress = []
+        results = list(engine.run([job], progress=lambda d, t: progress.append((d, t))))
+
+        self.assertEqual([(r.ok, r.failure, r.job.to_addrs) for r in results],
+                         [(False, QUOTA, ['c@example.com']), (True, None, ['a@example.com', 'b@example.com'])])
+        self.assertEqual(session.envelopes, [['a@example.com', 'b@example.com']])
+        self.assertEqual(progress, [(1, 1)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import os
+import tempfile
+import unittest
+
+from services.template_services import CompiledTemplate, TemplateCache, compile_for_recipients, load_template
+
+
+class TestCompiledTemplate(unittest.TestCase):
+    def test_campaign_slots_match_replace_chain(self):
+        with open("templates/custom_email_template.html", "r", encoding="utf-8") as f:
+            template_html = f.read()
+        values = {"email_title": "T", "email_body": "B", "cta_text": "C", "cta_link": "L", "company_name": "Co"}
+        expected = template_html.replace("{{ EMAIL_TITLE }}", "T").replace("{{ EMAIL_BODY }}", "B") \
+                                .replace("{{ CTA_TEXT }}", "C").replace("{{ CTA_LINK }}", "L") \
+                                .replace("{{ COMPANY_NAME }}", "Co")
+
+        self.assertEqual(load_template("templates/custom_email_template.html").render(values), expected)
+
+    def test_recipient_slots_cover_csv_columns(self):
+        template = compile_for_recipients("Hi [Name] from [Company] ([Plan Tier]) [x-apple-data-detectors]",
+                                          ["name", "email", "company", "plan tier"])
+        rendered = template.render({"name": "Ann", "company": "Acme & Co", "plan tier": "Gold"})
+
+        self.assertEqual(rendered, "Hi Ann from Acme &amp; Co (Gold) [x-apple-data-detectors]")
+
+    def test_ai_fields_are_inserted_unescaped(self):
+        template = compile_for_recipients("<h1>[AI Title]</h1><p>[AI Body]</p><i>[Name]</i>", ["name", "email"])
+        rendered = template.render({"name": "<b>Ann</b>", "ai_title": "Hi Ann", "ai_body": "Line one<br>Line two"})
+
+        self.assertEqual(rendered, "<h1>Hi Ann</h1><p>Line one<br>Line two</p><i>&lt;b&gt;Ann&lt;/b&gt;</i>")
+
+    def test_missing_values_use_defaults(self):
+        template = CompiledTemplate.compile("Hi [Name], [Company]!")
+
+        self.assertEqual(template.render({"name": float("nan"), "company": None}), "Hi there, !")
+
+    def test_render_many(self):
+        template = CompiledTemplate.compile("{{ GREETING }} [name]")
+        rendered = template.render_many([{"GREETING": "Hi", "Name": "A"}, {"GREETING": "Yo", "Name": "B"}])
+
+        self.assertEqual(rendered, ["Hi A", "Yo B"])
+
+
+class TestTemplateCache(unittest.TestCase):
+    def test_reloads_only_when_the_file_changes(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "t.html")
+            with open(path, "w") as f:
+                f.write("<h1>{{ EMAIL_TITLE }}</h1>")
+            cache = TemplateCache()
+            first = cache.get(path)
+            self.assertIs(cache.get(path), first)
+
+            with open(path, "w") as f:
+                f.write("<h2>{{ EMAIL_TITLE }}</h2>")
+            os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 1_000_000))
+            self.assertEqual(cache.get(path).render({"email_title": "Hi"}), "<h2>Hi</h2>")
+
+            cache.clear()
+            self.assertIsNot(cache.get(path), first)
+
+
+if __name__ == '__main__':
+    unittest.main()